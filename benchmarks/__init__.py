@@ -0,0 +1,17 @@
+"""Benchmarks of the neuronunit hot paths, in the airspeed velocity (asv)
+format: classes whose time_* and peakmem_* methods are timed and measured
+for each combination of the class's params (e.g. trace lengths and
+population sizes), after its setup.
+
+Run with asv from the repository root (asv.conf.json), e.g.
+
+    asv run --python=same --quick     # the installed neuronunit, once
+    asv continuous master HEAD        # compare two commits
+
+or, without asv, with
+
+    python -m benchmarks [pattern]
+
+which reports the time and peak (traced) memory of each benchmark.
+Random number generators are seeded in each setup, so runs are repeatable.
+"""
@@ -0,0 +1,84 @@
+"""Run the benchmarks without asv: python -m benchmarks [pattern] [repeat]
+
+Reports, for each benchmark whose name ('<module>.<class>.<method>')
+matches the pattern (a regular expression) and each combination of its
+params, the fastest of repeat runs of its time_* methods (s), and the peak
+memory allocated by its peakmem_* methods (traced by tracemalloc, so of
+Python and numpy allocations rather than asv's peak resident memory).
+"""
+
+import importlib
+import itertools
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+
+def get_benchmarks(pattern=''):
+    """(name, class, method name) of the benchmarks matching pattern."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith('bench_') and filename.endswith('.py')):
+            continue
+        try:
+            module = importlib.import_module('benchmarks.' + filename[:-3])
+        except Exception as e:
+            print('%s: failed to import (%s: %s)' % (filename[:-3],
+                                                     type(e).__name__, e))
+            continue
+        for cls_name, cls in sorted(vars(module).items()):
+            if not (isinstance(cls, type) and
+                    cls.__module__ == module.__name__):
+                continue
+            for method in sorted(vars(cls)):
+                if not method.startswith(('time_', 'peakmem_')):
+                    continue
+                name = '%s.%s.%s' % (filename[:-3], cls_name, method)
+                if re.search(pattern, name):
+                    yield name, cls, method
+
+
+def run(cls, method, params, repeat=3):
+    """The time (s) or peak memory (bytes) of a benchmark method."""
+    benchmark = cls()
+    if hasattr(benchmark, 'setup'):
+        benchmark.setup(*params)
+    func = getattr(benchmark, method)
+    try:
+        if method.startswith('peakmem_'):
+            tracemalloc.start()
+            func(*params)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        best = float('inf')
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            func(*params)
+            best = min(best, timeit.default_timer() - start)
+        return best
+    finally:
+        if hasattr(benchmark, 'teardown'):
+            benchmark.teardown(*params)
+
+
+def main(pattern='', repeat=3):
+    for name, cls, method in get_benchmarks(pattern):
+        for params in itertools.product(*getattr(cls, 'params', [])):
+            label = ', '.join('%s=%s' % item for item in
+                              zip(getattr(cls, 'param_names', []), params))
+            try:
+                value = run(cls, method, params, repeat)
+            except Exception as e:
+                result = 'failed (%s: %s)' % (type(e).__name__, e)
+            else:
+                result = ('%.4g s' % value if method.startswith('time_')
+                          else '%.1f MB' % (value/1e6))
+            print('%s(%s): %s' % (name, label, result))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
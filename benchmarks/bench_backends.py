@@ -0,0 +1,95 @@
+"""Benchmarks of the integration of the reduced model backends."""
+
+import numpy as np
+
+from neuronunit.models.backends import rawpy
+
+from .common import DURATIONS, POPULATION_SIZES, DELAY, SPIKING_AMPLITUDE, \
+    seed
+
+# The default parameters of the Hodgkin-Huxley model (of dALLdt)
+HH_ATTRS = {'g_K': 36.0, 'g_Na': 120.0, 'g_L': 0.3, 'C_m': 1.0,
+            'E_L': -54.387, 'E_K': -77.0, 'E_Na': 50.0, 'vr': -65.0}
+
+
+def get_square_current(duration, dt, amplitudes):
+    """Samples of square currents (pA), one row per amplitude, as the RAW
+    backend's get_square_currents."""
+    delay = float(DELAY)
+    Iext = np.zeros((len(amplitudes), int((delay + duration + 200.0)/dt)))
+    start = int(delay/dt)
+    Iext[:, start:start+int(duration/dt)] = np.reshape(amplitudes, (-1, 1))
+    return Iext
+
+
+class RawGetVm(object):
+    """rawpy.get_vm, the Izhikevich model of the RAW backend."""
+
+    params = [DURATIONS]
+    param_names = ['duration']
+
+    def setup(self, duration):
+        seed()
+        self.attrs = rawpy.get_izhikevich_attrs()
+        self.attrs['dt'] = rawpy.RAWBackend.time_step
+        self.Iext = get_square_current(duration, self.attrs['dt'],
+                                       [float(SPIKING_AMPLITUDE)])[0]
+        # Compile outside of the timings
+        rawpy.get_vm(Iext=self.Iext[:2], **self.attrs)
+
+    def time_get_vm(self, duration):
+        rawpy.get_vm(Iext=self.Iext, **self.attrs)
+
+    def peakmem_get_vm(self, duration):
+        rawpy.get_vm(Iext=self.Iext, **self.attrs)
+
+
+class RawGetVmSweep(object):
+    """rawpy.get_vm_sweep, the RAW backend's integration of a population of
+    current amplitudes together."""
+
+    params = [POPULATION_SIZES, DURATIONS]
+    param_names = ['population', 'duration']
+
+    def setup(self, population, duration):
+        seed()
+        attrs = rawpy.get_izhikevich_attrs()
+        self.args = [attrs[k] for k in ('C', 'a', 'b', 'c', 'd', 'k', 'vPeak',
+                                        'vr', 'vt')]
+        self.dt = rawpy.RAWBackend.time_step
+        amplitudes = np.linspace(0, 2*float(SPIKING_AMPLITUDE), population)
+        self.Iext = get_square_current(duration, self.dt, amplitudes)
+        rawpy.get_vm_sweep(*(self.args + [self.dt, self.Iext[:, :2]]))
+
+    def time_get_vm_sweep(self, population, duration):
+        rawpy.get_vm_sweep(*(self.args + [self.dt, self.Iext]))
+
+    def peakmem_get_vm_sweep(self, population, duration):
+        rawpy.get_vm_sweep(*(self.args + [self.dt, self.Iext]))
+
+
+class HHGetVm(object):
+    """hhrawf.get_vm, the Hodgkin-Huxley model of the HH backend."""
+
+    params = [DURATIONS]
+    param_names = ['duration']
+    timeout = 300
+
+    def setup(self, duration):
+        from neuronunit.models.backends import hhrawf
+        self.get_vm = hhrawf.get_vm
+        seed()
+        delay = float(DELAY)
+        tmax = delay + duration + 200.0
+        self.attrs = dict(HH_ATTRS)
+        self.attrs['dt'] = 0.025
+        self.attrs['T'] = np.arange(0.0, tmax, self.attrs['dt'])
+        # A current density (uA/cm^2) that makes the model fire repetitively
+        self.attrs['I'] = (delay, duration, tmax, 10.0)
+        self.get_vm(dict(self.attrs, T=self.attrs['T'][:2]))
+
+    def time_get_vm(self, duration):
+        self.get_vm(self.attrs)
+
+    def peakmem_get_vm(self, duration):
+        self.get_vm(self.attrs)
@@ -0,0 +1,69 @@
+"""Benchmarks of the scaling of the rheobase search and of the optimization
+over the worker processes of a dask.distributed LocalCluster."""
+
+from neuronunit.optimization.executors import DistributedExecutor
+
+from .common import OBSERVATIONS, FREE_PARAMS, seed, get_model, get_tests, \
+    get_population
+
+WORKERS = [1, 2, 4]
+
+
+class DistributedBenchmark(object):
+    """Sets up a LocalCluster of a worker process per (single threaded)
+    worker, kept (with its imports done) across the runs of a benchmark."""
+
+    params = [WORKERS]
+    param_names = ['workers']
+    timeout = 900
+
+    def setup(self, workers):
+        from dask.distributed import Client, LocalCluster
+        seed()
+        self.cluster = LocalCluster(n_workers=workers, threads_per_worker=1,
+                                    processes=True, dashboard_address=None)
+        self.client = Client(self.cluster)
+        self.executor = DistributedExecutor(self.client)
+
+    def teardown(self, workers):
+        self.client.close()
+        self.cluster.close()
+
+
+class DistributedRheobase(DistributedBenchmark):
+    """RheobaseTestP's search of the RAW model's rheobase."""
+
+    def setup(self, workers):
+        from neuronunit.tests.fi import RheobaseTestP
+        super(DistributedRheobase, self).setup(workers)
+        self.model = get_model()
+        self.test = RheobaseTestP(observation=OBSERVATIONS['RheobaseTestP'])
+        self.test.analytic_property = None
+        self.test.executor = self.executor
+        # Import neuronunit in the workers outside of the timings
+        self.test.generate_prediction(self.model)
+
+    def time_generate_prediction(self, workers):
+        self.test.generate_prediction(self.model)
+
+
+class DistributedUpdateDeapPop(DistributedBenchmark):
+    """The evaluation of a generation of 16 individuals."""
+
+    def setup(self, workers):
+        from neuronunit.optimization import optimization_management
+        super(DistributedUpdateDeapPop, self).setup(workers)
+        self.update_deap_pop = optimization_management.update_deap_pop
+        self.tests = get_tests()
+        self.genes = [list(ind) for ind in get_population(16)]
+        self.run_generation()
+
+    def run_generation(self):
+        from neuronunit.optimization.optimization_management import \
+            WSListIndividual
+        pop = [WSListIndividual(genes) for genes in self.genes]
+        self.update_deap_pop(pop, self.tests, list(FREE_PARAMS),
+                             backend='RAW', executor=self.executor)
+
+    def time_update_deap_pop(self, workers):
+        self.run_generation()
@@ -0,0 +1,58 @@
+"""Benchmarks of the optimization pipeline: a generation of the genetic
+algorithm's evaluation (update_deap_pop), and a pass of the grid search."""
+
+from neuronunit.optimization.model_parameters import model_params
+
+from .common import POPULATION_SIZES, FREE_PARAMS, seed, get_tests, \
+    get_population
+
+
+class UpdateDeapPop(object):
+    """The evaluation of one generation of the RAW model: its rheobase
+    searches and test scores."""
+
+    params = [POPULATION_SIZES]
+    param_names = ['population']
+    timeout = 900
+
+    def setup(self, population):
+        from neuronunit.optimization import optimization_management
+        self.update_deap_pop = optimization_management.update_deap_pop
+        seed()
+        self.tests = get_tests()
+        self.genes = [list(ind) for ind in get_population(population)]
+
+    def run_generation(self):
+        from neuronunit.optimization.optimization_management import \
+            WSListIndividual
+        # A new population, as the evaluation records its results on it
+        pop = [WSListIndividual(genes) for genes in self.genes]
+        self.update_deap_pop(pop, self.tests, list(FREE_PARAMS),
+                             backend='RAW')
+
+    def time_update_deap_pop(self, population):
+        self.run_generation()
+
+    def peakmem_update_deap_pop(self, population):
+        self.run_generation()
+
+
+class RunSimpleGrid(object):
+    """A pass of the grid search over the free parameters, of npoints per
+    parameter (npoints**3 models)."""
+
+    params = [[2, 3]]
+    param_names = ['npoints']
+    timeout = 900
+
+    def setup(self, npoints):
+        from neuronunit.optimization import exhaustive_search
+        self.run_simple_grid = exhaustive_search.run_simple_grid
+        seed()
+        self.tests = get_tests()
+
+    def time_run_simple_grid(self, npoints):
+        self.run_simple_grid(npoints, self.tests, model_params, FREE_PARAMS)
+
+    def peakmem_run_simple_grid(self, npoints):
+        self.run_simple_grid(npoints, self.tests, model_params, FREE_PARAMS)
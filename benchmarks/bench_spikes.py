@@ -0,0 +1,29 @@
+"""Benchmarks of the spike feature extraction of membrane potentials."""
+
+from neuronunit.capabilities import spike_functions
+
+from .common import DURATIONS, seed, get_vm
+
+
+class SpikeWaveforms(object):
+    """get_spike_waveforms and spikes2widths of a regularly firing trace."""
+
+    params = [DURATIONS]
+    param_names = ['duration']
+
+    def setup(self, duration):
+        seed()
+        self.vm = get_vm(duration)
+        self.waveforms = spike_functions.get_spike_waveforms(self.vm)
+
+    def time_get_spike_waveforms(self, duration):
+        spike_functions.get_spike_waveforms(self.vm)
+
+    def peakmem_get_spike_waveforms(self, duration):
+        spike_functions.get_spike_waveforms(self.vm)
+
+    def time_spikes2widths(self, duration):
+        spike_functions.spikes2widths(self.waveforms)
+
+    def peakmem_spikes2widths(self, duration):
+        spike_functions.spikes2widths(self.waveforms)
@@ -0,0 +1,91 @@
+"""Benchmarks of neuronunit tests: the rheobase search, the Druckmann 2013
+feature battery and the exponential fits of the passive tests."""
+
+import numpy as np
+import quantities as pq
+from neo.core import AnalogSignal
+
+from .common import DURATIONS, OBSERVATIONS, seed, get_model
+
+
+class Rheobase(object):
+    """The serial (RheobaseTest) and parallel (RheobaseTestP) rheobase
+    searches, on the RAW backend."""
+
+    params = [['RheobaseTest', 'RheobaseTestP']]
+    param_names = ['test']
+    timeout = 600
+
+    def setup(self, name):
+        from neuronunit.tests import fi
+        seed()
+        self.model = get_model()
+        self.model._backend.use_memory_cache = False
+        self.test = getattr(fi, name)(
+            observation=OBSERVATIONS['RheobaseTestP'])
+        # Search, rather than compute the RAW model's rheobase
+        self.test.analytic_property = None
+
+    def time_generate_prediction(self, name):
+        self.test.generate_prediction(self.model)
+
+    def peakmem_generate_prediction(self, name):
+        self.test.generate_prediction(self.model)
+
+
+class Druckmann2013(object):
+    """The 38 tests of the Druckmann 2013 battery, on the RAW backend, with
+    their currents injected for the given duration."""
+
+    params = [[1000, 2000, 8000]]
+    param_names = ['duration']
+    timeout = 300
+
+    def setup(self, duration):
+        from neuronunit.tests.druckmann2013 import get_druckmann2013_tests
+        from neuronunit.tests.fi import RheobaseTest
+        seed()
+        self.model = get_model()
+        self.model._backend.use_memory_cache = False
+        rheobase = RheobaseTest(observation=OBSERVATIONS['RheobaseTestP'])\
+            .generate_prediction(self.model)['value']
+        ir_currents = [amplitude*pq.pA for amplitude in (-10, -5, 5)]
+        self.tests = get_druckmann2013_tests(1.5*rheobase, 3*rheobase,
+                                             ir_currents)
+        for test in self.tests:
+            test.params['injected_square_current']['duration'] = \
+                duration*pq.ms
+
+    def run_battery(self):
+        self.model.invalidate_run()
+        for test in self.tests:
+            test.generate_prediction(self.model)
+
+    def time_battery(self, duration):
+        self.run_battery()
+
+    def peakmem_battery(self, duration):
+        self.run_battery()
+
+
+class ExponentialFit(object):
+    """TestPulseTest.exponential_fit of a charging curve."""
+
+    params = [DURATIONS]
+    param_names = ['duration']
+
+    def setup(self, duration):
+        from neuronunit.tests.passive import TestPulseTest
+        self.exponential_fit = TestPulseTest.exponential_fit
+        seed()
+        dt = 0.025
+        t = np.arange(0, duration, dt)
+        v = -65 - 10*(1 - np.exp(-t/15.0)) + \
+            np.random.normal(scale=0.1, size=len(t))
+        self.segment = AnalogSignal(v, units=pq.mV, sampling_period=dt*pq.ms)
+
+    def time_exponential_fit(self, duration):
+        self.exponential_fit(self.segment, 0*pq.ms)
+
+    def peakmem_exponential_fit(self, duration):
+        self.exponential_fit(self.segment, 0*pq.ms)
@@ -0,0 +1,89 @@
+"""Shared setup of the benchmarks: seeds, models, currents and tests."""
+
+import random
+
+import numpy as np
+import quantities as pq
+
+from neuronunit.optimization.model_parameters import model_params, \
+    path_params
+
+SEED = 0
+
+# Durations (ms) of the current injections, i.e. the trace lengths, less
+# the 100 ms delay and the 200 ms the backends simulate after the current
+DURATIONS = [500, 2000, 8000]
+
+# Numbers of models (parameter sets) run or evaluated together
+POPULATION_SIZES = [4, 16, 32]
+
+# A current that makes the default (regular spiking) Izhikevich model fire
+SPIKING_AMPLITUDE = 300*pq.pA
+
+DELAY = 100*pq.ms
+
+# Parameters of the optimization and grid benchmarks
+FREE_PARAMS = ['a', 'b', 'vr']
+
+# Observations of the optimization and grid benchmarks (in the range of
+# neocortical pyramidal cells)
+OBSERVATIONS = {
+    'RheobaseTestP': {'mean': 50*pq.pA, 'std': 20*pq.pA, 'n': 10},
+    'InputResistanceTest': {'mean': 120*pq.MOhm, 'std': 40*pq.MOhm,
+                            'n': 10},
+    'TimeConstantTest': {'mean': 15*pq.ms, 'std': 5*pq.ms, 'n': 10},
+    'RestingPotentialTest': {'mean': -65*pq.mV, 'std': 5*pq.mV, 'n': 10},
+}
+
+
+def seed():
+    """Seed the random number generators (numpy's and Python's)."""
+    np.random.seed(SEED)
+    random.seed(SEED)
+
+
+def get_model(backend='RAW', **attrs):
+    from neuronunit.models.reduced import ReducedModel
+    model = ReducedModel(path_params['model_path'], backend=backend)
+    if attrs:
+        model.set_attrs(**attrs)
+    return model
+
+
+def get_current(duration, amplitude=SPIKING_AMPLITUDE):
+    return {'amplitude': amplitude, 'delay': DELAY,
+            'duration': duration*pq.ms}
+
+
+def get_vm(duration, amplitude=SPIKING_AMPLITUDE):
+    """The membrane potential (an AnalogSignal) of the RAW model."""
+    model = get_model()
+    model.inject_square_current(get_current(duration, amplitude))
+    return model.get_membrane_potential()
+
+
+def get_tests():
+    """Tests of the optimization benchmarks, with fixed observations."""
+    from neuronunit.tests import fi, passive
+    modules = {'RheobaseTestP': fi, 'InputResistanceTest': passive,
+               'TimeConstantTest': passive, 'RestingPotentialTest': passive}
+    tests = []
+    for name, observation in sorted(OBSERVATIONS.items()):
+        test = getattr(modules[name], name)(observation=observation)
+        # The optimization finds tests by name
+        test.name = name
+        tests.append(test)
+    return tests
+
+
+def get_population(size):
+    """Individuals of the free parameters, sampled uniformly from their
+    ranges in model_params."""
+    from neuronunit.optimization.optimization_management import \
+        WSListIndividual
+    pop = []
+    for _ in range(size):
+        pop.append(WSListIndividual(
+            np.random.uniform(np.min(model_params[k]), np.max(model_params[k]))
+            for k in FREE_PARAMS))
+    return pop
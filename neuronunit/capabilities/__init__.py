@@ -8,6 +8,8 @@ import numpy as np
 import quantities as pq
 import sciunit
 import matplotlib.pyplot as plt
+from neo.core import AnalogSignal
+from .trace import Trace
 from .spike_functions import spikes2amplitudes, spikes2widths,\
                              spikes2thresholds
 
@@ -137,6 +139,33 @@ class ReceivesSquareCurrent(sciunit.Capability):
         """
         raise NotImplementedError()
 
+    def inject_square_current_sweep(self, amplitudes, delay, duration):
+        """Inject a square current of each amplitude in turn.
+
+        Models may implement this natively (e.g. by integrating all the
+        amplitudes at once); by default each is simulated separately.
+
+        Parameters
+        ----------
+        amplitudes : a sequence of current amplitude quantities.
+        delay, duration : time quantities shared by every pulse.
+
+        Returns a neo.core.AnalogSignal with one column (channel) per
+        amplitude, truncated to the shortest trace.
+        """
+        traces = []
+        for amplitude in amplitudes:
+            self.inject_square_current({'amplitude': amplitude,
+                                        'delay': delay,
+                                        'duration': duration})
+            traces.append(self.get_membrane_potential())
+        length = min(len(vm) for vm in traces)
+        block = np.column_stack([vm.magnitude.reshape(len(vm), -1)[:length, 0]
+                                 for vm in traces])
+        return AnalogSignal(block, units=traces[0].units,
+                            sampling_period=traces[0].sampling_period,
+                            t_start=traces[0].t_start)
+
 
 class ReceivesCurrent(ReceivesSquareCurrent):
     """Indicate that somatic current can be injected into the model as
@@ -152,3 +181,23 @@ class ReceivesCurrent(ReceivesSquareCurrent):
         This is a time series of the current to be injected.
         """
         raise NotImplementedError()
+
+
+class ProvidesAnalyticProperties(sciunit.Capability):
+    """Indicate that the model may compute some electrophysiological
+    properties in closed form, without simulation.
+    """
+
+    def get_analytic_property(self, name, current=None):
+        """Compute a property of the model without simulating it.
+
+        Parameters
+        ----------
+        name : the property, e.g. 'rheobase' or 'input_resistance'.
+        current : the square current of the test, for properties which
+                  depend on it (same form as for inject_square_current).
+
+        Returns a quantity, or None if this property has no closed form for
+        the model (or its current parameters).
+        """
+        raise NotImplementedError()
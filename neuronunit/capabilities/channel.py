@@ -20,6 +20,12 @@ class NML2ChannelAnalysis(sciunit.Capability):
         return NotImplementedError("%s not implemented" %
                                    inspect.stack()[0][3])
 
+    def ca_get_iv_curve(self, **run_params):
+        """Make and run a LEMS file with the provided run parameters, and
+        compute its IV curve."""
+        self.ca_make_lems_file(**run_params)
+        return self.ca_compute_iv_curve(self.ca_run_lems_file())
+
     def compute_iv_curve(self, results):
         """Compute an IV Curve from the iv data in `results`."""
         return NotImplementedError("%s not implemented" %
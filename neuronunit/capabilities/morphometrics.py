@@ -0,0 +1,282 @@
+"""In-process L-Measure morphometrics of SWC files.
+
+An SWC file is parsed once into numpy arrays (type, xyz, radius and parent
+index of each point) and each L-Measure function is computed for all of its
+compartments at once, as vectorized reductions over the tree.  Every point
+but a root is a compartment: the segment from its parent to it, with its
+radius and type.  Results are cached by the contents of the SWC file.
+
+The functions reproduce L-Measure's (http://cng.gmu.edu:8080/Lm/help/) on
+NeuroMorpho.org reconstructions; see `measures` for those available.
+"""
+
+import hashlib
+import operator
+import re
+
+import numpy as np
+
+
+class Morphology(object):
+    """The points of an SWC file, and the tree quantities derived from them.
+
+    Per point arrays (N,) or (N, 3): type, xyz, radius, parent (index of the
+    parent point, -1 for roots) and length (of the compartment to the parent,
+    0 for roots).
+    """
+
+    def __init__(self, data):
+        data = np.atleast_2d(data)
+        ids = data[:, 0].astype(int)
+        parent_ids = data[:, 6].astype(int)
+        self.type = data[:, 1].astype(int)
+        self.xyz = data[:, 2:5]
+        self.radius = data[:, 5]
+        order = np.argsort(ids)
+        parent = order[np.searchsorted(ids, parent_ids, sorter=order)
+                       .clip(0, len(ids)-1)]
+        self.parent = np.where(parent_ids < 0, -1, parent)
+        self.is_compartment = self.parent >= 0
+        p = self.parent.clip(0)
+        self.length = np.where(self.is_compartment,
+                               np.linalg.norm(self.xyz - self.xyz[p], axis=1),
+                               0.0)
+        self.soma = self.type == 1
+        self.n_children = np.bincount(self.parent[self.is_compartment],
+                                      minlength=len(ids))
+        self.bifurcation = (self.n_children >= 2) & ~self.soma & \
+            self.is_compartment
+        self.tip = (self.n_children == 0) & ~self.soma & self.is_compartment
+        # Branches run between branching points: roots, soma points and
+        # bifurcations.  A branch ends at a bifurcation or tip.
+        self.branch_end = self.bifurcation | self.tip
+        branching = ~self.is_compartment | self.soma | self.bifurcation
+        self.root = np.where(self.is_compartment,
+                             nearest_ancestor(self.parent,
+                                              ~self.is_compartment),
+                             np.arange(len(ids)))
+        self.start = nearest_ancestor(self.parent, branching)
+        self.first = first_below(self.parent, branching)
+        self.path_distance = ancestor_sum(self.parent, self.length)
+        self.branch_order = ancestor_sum(
+            self.parent, (self.is_compartment & self.bifurcation[p])
+            .astype(int))
+
+    def get_daughters(self):
+        """The first two daughter branches of each bifurcation.
+
+        Returns the bifurcation points (B,), and the end points and first
+        compartments of their two daughter branches (B, 2).
+        """
+        ends = np.flatnonzero(self.branch_end & (self.start >= 0) &
+                              self.bifurcation[self.start.clip(0)])
+        ends = ends[np.argsort(self.start[ends], kind='stable')]
+        starts = self.start[ends]
+        first_of_start = np.r_[True, starts[1:] != starts[:-1]]
+        i = np.flatnonzero(first_of_start[:-1] & ~first_of_start[1:])
+        pairs = np.stack([ends[i], ends[i+1]], axis=1)
+        return starts[i], pairs, self.first[pairs]
+
+    def count_tips(self):
+        """The number of tips at or below each branch end point."""
+        tips = self.tip.astype(float)
+        ends = np.flatnonzero(self.branch_end)
+        # Branch ends hold the counts of their subtrees; add each level of
+        # branch order into the level above it.
+        for order in range(self.branch_order.max(), 0, -1):
+            level = ends[self.branch_order[ends] == order]
+            np.add.at(tips, self.start[level], tips[level])
+        return tips
+
+
+def ancestor_sum(parent, values):
+    """The sum of values over each point and all of its ancestors.
+
+    By pointer jumping: O(N log D) for a tree of depth D.
+    """
+    total = np.array(values)
+    up = parent.copy()
+    while True:
+        has = up >= 0
+        if not has.any():
+            return total
+        total[has] = total[has] + total[up[has]]
+        up[has] = up[up[has]]
+
+
+def nearest_ancestor(parent, marked):
+    """The nearest (strict) ancestor of each point that is marked, or -1."""
+    up = parent.copy()
+    while True:
+        jump = (up >= 0) & ~marked[up.clip(0)]
+        if not jump.any():
+            return up
+        up[jump] = up[up[jump]]
+
+
+def first_below(parent, marked):
+    """For each point, the highest ancestor-or-self whose parent is the
+    nearest marked ancestor (the first compartment of its branch)."""
+    p = parent.clip(0)
+    up = np.where((parent >= 0) & ~marked[p], parent, np.arange(len(parent)))
+    while True:
+        nxt = up[up]
+        if (nxt == up).all():
+            return up
+        up = nxt
+
+
+def get_angle(u, v):
+    """The angle (degrees) between the rows of u and v."""
+    cos = np.einsum('ij,ij->i', u, v) / \
+        (np.linalg.norm(u, axis=1)*np.linalg.norm(v, axis=1))
+    return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
+
+def at(m, index, values):
+    """A per point array of NaN, with values at index."""
+    result = np.full(len(m.type), np.nan)
+    result[index] = values
+    return result
+
+
+def compartments(m, values):
+    return np.where(m.is_compartment, values, np.nan)
+
+
+def euclidean_from_start(m):
+    return np.linalg.norm(m.xyz - m.xyz[m.start.clip(0)], axis=1)
+
+
+def path_from_start(m):
+    return m.path_distance - m.path_distance[m.start.clip(0)]
+
+
+def contraction(m):
+    ends = np.flatnonzero(m.branch_end)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = euclidean_from_start(m)[ends]/path_from_start(m)[ends]
+    return at(m, ends, ratio)
+
+
+def fractal_dim(m):
+    # The slope through the origin of log(path) vs log(euclidean distance)
+    # from the branch start, over the points of each branch.
+    euc, path = euclidean_from_start(m), path_from_start(m)
+    ok = m.is_compartment & ~m.soma & (euc > 0) & (path > 0)
+    x, y = np.log(euc[ok]), np.log(path[ok])
+    n = len(m.type)
+    sxy = np.bincount(m.first[ok], weights=x*y, minlength=n)
+    sxx = np.bincount(m.first[ok], weights=x*x, minlength=n)
+    ends = np.flatnonzero(m.branch_end)
+    i = m.first[ends]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(sxx[i] > 0, sxy[i]/sxx[i], 1.0)
+    return at(m, ends, slope)
+
+
+def partition_asymmetry(m):
+    bifs, ends, _ = m.get_daughters()
+    tips = m.count_tips()[ends]
+    n = tips.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value = np.where(n > 2, abs(tips[:, 0]-tips[:, 1])/(n-2), 0.0)
+    return at(m, bifs, value)
+
+
+def pk_classic(m):
+    bifs, _, firsts = m.get_daughters()
+    d = 2*m.radius
+    return at(m, bifs,
+              (d[firsts]**1.5).sum(axis=1)/d[bifs]**1.5)
+
+
+def bif_ampl_local(m):
+    bifs, _, firsts = m.get_daughters()
+    return at(m, bifs, get_angle(m.xyz[firsts[:, 0]] - m.xyz[bifs],
+                                 m.xyz[firsts[:, 1]] - m.xyz[bifs]))
+
+
+def bif_ampl_remote(m):
+    bifs, ends, _ = m.get_daughters()
+    return at(m, bifs, get_angle(m.xyz[ends[:, 0]] - m.xyz[bifs],
+                                 m.xyz[ends[:, 1]] - m.xyz[bifs]))
+
+
+# The L-Measure functions, as the value of each point (NaN where the function
+# does not apply).  These are invariant to rotation, so L-Measure's PCA
+# alignment option does not change them.
+measures = {
+    'Surface': lambda m: compartments(m, 2*np.pi*m.radius*m.length),
+    'Volume': lambda m: compartments(m, np.pi*m.radius**2*m.length),
+    'Length': lambda m: compartments(m, m.length),
+    'Diameter': lambda m: compartments(m, 2*m.radius),
+    'N_stems': lambda m: compartments(m, ~m.soma & m.soma[m.parent.clip(0)]),
+    'N_bifs': lambda m: compartments(m, m.bifurcation),
+    'N_branch': lambda m: compartments(m, m.branch_end),
+    'N_tips': lambda m: compartments(m, m.tip),
+    'EucDistance': lambda m: compartments(
+        m, np.linalg.norm(m.xyz - m.xyz[m.root], axis=1)),
+    'PathDistance': lambda m: compartments(m, m.path_distance),
+    'Branch_Order': lambda m: compartments(m, m.branch_order),
+    'Contraction': contraction,
+    'Fractal_Dim': fractal_dim,
+    'Partition_asymmetry': partition_asymmetry,
+    'Pk_classic': pk_classic,
+    'Bif_ampl_local': bif_ampl_local,
+    'Bif_ampl_remote': bif_ampl_remote,
+}
+
+
+def parse_specificity(specificity):
+    """A function of the point types selecting those an L-Measure
+    specificity (e.g. "Type > 1" or "Type==3") applies to."""
+    ops = {'==': operator.eq, '!=': operator.ne, '>=': operator.ge,
+           '<=': operator.le, '>': operator.gt, '<': operator.lt}
+    match = re.match(r'\s*Type\s*(==|!=|>=|<=|>|<)\s*(\d+)\s*$', specificity)
+    if match is None:
+        raise ValueError("Unsupported specificity: %s" % specificity)
+    op, value = ops[match.group(1)], int(match.group(2))
+    return lambda types: op(types, value)
+
+
+def get_statistics(values):
+    """L-Measure's statistics of the values of the selected compartments."""
+    considered = values[~np.isnan(values)]
+    n = len(considered)
+    return {'TotalSum': considered.sum(),
+            'CompartmentsConsidered': n,
+            'Compartments_Discarded': len(values) - n,
+            'Minimum': considered.min() if n else np.nan,
+            'Average': considered.mean() if n else np.nan,
+            'Maximum': considered.max() if n else np.nan,
+            'StdDev': considered.std() if n else np.nan}
+
+
+_morphologies = {}
+_statistics = {}
+
+
+def get_morphology(swc_path):
+    """The Morphology of an SWC file and its digest, parsed once per
+    distinct file contents."""
+    with open(swc_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if digest not in _morphologies:
+        lines = content.decode().splitlines()
+        _morphologies[digest] = Morphology(np.loadtxt(lines, comments='#',
+                                                      ndmin=2))
+    return _morphologies[digest], digest
+
+
+def get_measure(measure, swc_path, specificity="Type > 1"):
+    """The statistics of an L-Measure function over the compartments of an
+    SWC file selected by specificity (as pylmeasure's getOneMeasure)."""
+    morphology, digest = get_morphology(swc_path)
+    key = (digest, measure, specificity)
+    if key not in _statistics:
+        values = measures[measure](morphology)
+        selected = parse_specificity(specificity)(morphology.type)
+        _statistics[key] = get_statistics(values[selected])
+    return _statistics[key]
@@ -2,27 +2,116 @@
 
 import numpy as np
 import neo
-from elephant.spike_train_generation import threshold_detection
 from quantities import mV, ms
 from numba import jit
 import sciunit
 import math
+from .trace import Trace, as_trace
+
+
+@jit
+def find_crossings(v, thresholds, hysteresis, min_step):
+    """Find the upward crossings of several thresholds in one pass over v.
+
+    A crossing of thresholds[j] is a sample above it while the detector for j
+    is armed.  Detectors start armed, and re-arm when v falls to or below
+    thresholds[j] - hysteresis.  Crossings at which v rose by less than
+    min_step from the previous sample are skipped (the detector stays armed).
+
+    Returns the crossing sample indices, one row per threshold, and the
+    number of crossings in each row.
+    """
+    n = len(thresholds)
+    crossings = np.empty((n, len(v)//2 + 1), dtype=np.int64)
+    counts = np.zeros(n, dtype=np.int64)
+    armed = np.ones(n, dtype=np.bool_)
+    for i in range(len(v)):
+        for j in range(n):
+            if armed[j]:
+                if v[i] > thresholds[j] and \
+                   (i == 0 or not v[i] - v[i-1] < min_step):
+                    crossings[j, counts[j]] = i
+                    counts[j] += 1
+                    armed[j] = False
+            elif not v[i] > thresholds[j] - hysteresis:
+                armed[j] = True
+    return crossings, counts
+
+
+def threshold_crossings(signal, thresholds, hysteresis=None, min_slope=None):
+    """
+    Inputs:
+     signal: a neo.core.AnalogSignal with a single trace, or a Trace.
+     thresholds: the value, or list of values, above which signal has to
+                 cross (Quantities in units compatible with signal's).
+     hysteresis: how far below a threshold signal must fall before the next
+                 crossing of it counts.  Default: 0 (as elephant's
+                 threshold_detection).
+     min_slope: if given, only count crossings at which signal rises at
+                least this fast (a Quantity in signal units per time).
+
+    Returns:
+     a list of numpy arrays of sample indices, with the crossings of each
+     threshold.
+    """
+    if not isinstance(thresholds, (list, tuple)):
+        thresholds = [thresholds]
+    trace = as_trace(signal)
+    units = trace.units
+    v = np.ascontiguousarray(trace.data)
+    levels = np.array([float(t.rescale(units)) for t in thresholds])
+    hysteresis = 0.0 if hysteresis is None \
+        else float(hysteresis.rescale(units))
+    min_step = -np.inf if min_slope is None \
+        else float((min_slope*trace.dt*ms).rescale(units))
+    crossings, counts = find_crossings(v, levels, hysteresis, min_step)
+    return [crossings[j, :counts[j]] for j in range(len(levels))]
+
+
+def get_crossing_times(signal, indices):
+    """The times (as signal.times) of samples of signal."""
+    if isinstance(signal, Trace):
+        return (signal.t0 + signal.dt*np.asarray(indices))*ms
+    return signal.t_start + np.asarray(indices)/signal.sampling_rate
 
 
 def get_spike_train(vm, threshold=0.0*mV):
     """
     Inputs:
-     vm: a neo.core.AnalogSignal corresponding to a membrane potential trace.
+     vm: a neo.core.AnalogSignal corresponding to a membrane potential trace
+         (or a Trace).
      threshold: the value (in mV) above which vm has to cross for there
                 to be a spike.  Scalar float.
 
     Returns:
      a neo.core.SpikeTrain containing the times of spikes.
     """
-    spike_train = threshold_detection(vm, threshold=threshold)
+    indices = threshold_crossings(vm, threshold)[0]
+    times = get_crossing_times(vm, indices)
+    if isinstance(vm, Trace):
+        t_start, t_stop = vm.t0*ms, vm.t_stop*ms
+    else:
+        t_start, t_stop = vm.t_start, vm.t_stop
+        times = times.rescale(t_start.units)  # The units of vm.times
+    spike_train = neo.core.SpikeTrain(times.magnitude, units=times.units,
+                                      t_start=t_start, t_stop=t_stop)
     return spike_train
 
 
+def get_spike_count(vm, threshold=0.0*mV):
+    """
+    Inputs:
+     vm: a neo.core.AnalogSignal corresponding to a membrane potential trace
+         (or a Trace).
+     threshold: the value (in mV) above which vm has to cross for there
+                to be a spike.  Scalar float.
+
+    Returns:
+     the number of spikes.
+    """
+    return len(threshold_crossings(vm, threshold)[0])
+
+
 def get_spike_waveforms(vm, threshold=0.0*mV, width=10*ms):
     """
     Membrane potential trace (1D numpy array) to matrix of
@@ -39,7 +128,7 @@ def get_spike_waveforms(vm, threshold=0.0*mV, width=10*ms):
      a neo.core.AnalogSignal where each column contains a membrane potential
      snippets corresponding to one spike.
     """
-    spike_train = threshold_detection(vm, threshold=threshold)
+    spike_train = get_spike_train(vm, threshold=threshold)
 
     # Fix for 0-length spike train issue in elephant.
     try:
@@ -0,0 +1,86 @@
+"""A lightweight membrane potential trace, for use inside NeuronUnit.
+
+Backends, feature extraction and tests pass Trace objects between each
+other; neo.core.AnalogSignal objects are only built when asked for, through
+Trace.to_analog_signal (e.g. by ReducedModel.get_membrane_potential).
+"""
+
+import numpy as np
+import quantities as pq
+from neo.core import AnalogSignal
+
+
+class Trace(object):
+    """A uniformly sampled signal: a float buffer with t0, dt and units.
+
+    Times (t0, dt) are in ms; units is the name of the units of the data
+    (e.g. 'mV').
+    """
+
+    __slots__ = ('data', 't0', 'dt', 'units')
+
+    def __init__(self, data, dt, t0=0.0, units='mV'):
+        self.data = np.asarray(data, dtype=float).ravel()
+        self.dt = float(dt)
+        self.t0 = float(t0)
+        self.units = units
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    @property
+    def t_stop(self):
+        return self.t0 + len(self.data)*self.dt
+
+    def get_times(self, units='ms'):
+        """The sample times, as a numpy array in the given units."""
+        scale = float(pq.ms.rescale(units))
+        return (self.t0 + self.dt*np.arange(len(self.data)))*scale
+
+    def index(self, t):
+        """The index of the sample at time t (ms, or a Quantity)."""
+        if isinstance(t, pq.Quantity):
+            t = float(t.rescale(pq.ms))
+        return int((t - self.t0)/self.dt)
+
+    def segment(self, start, stop):
+        """The part of the trace from time start to stop."""
+        i, j = max(self.index(start), 0), max(self.index(stop), 0)
+        return Trace(self.data[i:j], self.dt, self.t0 + i*self.dt,
+                     self.units)
+
+    def rescale(self, units):
+        """The trace in other units (itself if they are the same)."""
+        if units == self.units:
+            return self
+        factor = float(pq.Quantity(1.0, self.units).rescale(units))
+        if factor < 1:  # Divide (e.g. mV to V by 1000) for exact results
+            data = self.data/float(pq.Quantity(1.0, units).rescale(self.units))
+        else:
+            data = self.data*factor
+        return Trace(data, self.dt, self.t0, units)
+
+    def mean(self):
+        return np.mean(self.data)*pq.Quantity(1.0, self.units)
+
+    def to_analog_signal(self):
+        """The trace as an AnalogSignal, with times in s."""
+        return AnalogSignal(self.data, units=self.units,
+                            sampling_period=self.dt/1000.0*pq.s,
+                            t_start=self.t0/1000.0*pq.s)
+
+
+def as_trace(signal):
+    """A Trace of a Trace or of a single channel neo.core.AnalogSignal.
+
+    The data of the AnalogSignal is not copied.
+    """
+    if isinstance(signal, Trace):
+        return signal
+    return Trace(signal.magnitude.ravel(),
+                 float(signal.sampling_period.rescale(pq.ms)),
+                 float(signal.t_start.rescale(pq.ms)),
+                 signal.dimensionality.string)
@@ -18,6 +18,7 @@ from decimal import Decimal
 import inspect
 import multiprocessing
 cpus = multiprocessing.cpu_count
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import numpy as np
 from matplotlib import pyplot as plt
@@ -38,7 +39,105 @@ import dask
 
 from neuronunit.tests.druckmann2013 import *
 
+
+def get_bracket_rounds(bisections, k):
+    """The number of rounds of a k-ary bracket search narrowing the bracket
+    at least as much as the given number of bisections."""
+    return int(np.ceil(bisections*np.log(2)/np.log(k+1) - 1e-9))
+
+
+def get_bracket_currents(lowerLevel, upperLevel, k):
+    """The k currents splitting the bracket into k+1 equal parts."""
+    return list(lowerLevel + (upperLevel-lowerLevel)*np.arange(1, k+1)/(k+1.0))
+
+
+def shrink_bracket(lowerLevel, upperLevel, currents, found):
+    """The new bracket: up to the lowest current at which the condition was
+    found, from the current below it."""
+    for current, current_found in zip(currents, found):
+        if current_found:
+            return lowerLevel, current
+        lowerLevel = current
+    return lowerLevel, upperLevel
+
+
+# The cell properties each protocol needs, i.e. the protocols that must have
+# been saved before it.  Protocols that are not listed (setup and tolerances,
+# and those timing their runs, e.g. DT_SENSITIVITY) are run alone, in order.
+protocol_dependencies = {
+    'stability_range': [],
+    'resting_voltage': [],
+    'threshold': ['stability_range', 'resting_voltage'],
+    'rheobase': ['threshold'],
+    'bias_current': ['resting_voltage'],
+    'STEADY_STATE': ['resting_voltage'],  # Both save the resting state
+    'RAMP': ['rheobase', 'STEADY_STATE'],
+    'SHORT_SQUARE': ['threshold', 'STEADY_STATE'],
+    'SQUARE': ['rheobase', 'STEADY_STATE'],
+    'LONG_SQUARE': ['rheobase', 'STEADY_STATE'],
+    'SHORT_SQUARE_HOLD': ['bias_current', 'threshold'],
+    'SHORT_SQUARE_TRIPPLE': ['threshold', 'STEADY_STATE'],
+    'SQUARE_SUBTHRESHOLD': ['threshold', 'STEADY_STATE'],
+    'NOISE': ['rheobase', 'STEADY_STATE'],
+    'NOISE_RAMP': ['rheobase', 'STEADY_STATE'],
+    'DRUCKMANN_PROPERTIES': ['SQUARE', 'LONG_SQUARE'],
+}
+
+
+def get_protocol_stages(properties, dependencies=protocol_dependencies):
+    """Split a list of properties into stages run one after the other.
+
+    Returns a list of stages: a property that is not in dependencies (run
+    alone), or a dict of the properties that can run concurrently, by
+    their position in properties, to the positions of those that must be
+    saved before each (the latest earlier ones of its dependencies and of
+    itself, within the stage).
+    """
+    stages = []
+    stage = {}
+    latest = {}
+    for i, prop in enumerate(properties):
+        if prop not in dependencies:
+            if stage:
+                stages.append(stage)
+            stages.append(prop)
+            stage, latest = {}, {}
+            continue
+        stage[i] = (prop, set(latest[dep] for dep in dependencies[prop] + [prop]
+                              if dep in latest))
+        latest[prop] = i
+    if stage:
+        stages.append(stage)
+    return stages
+
+
+# The model run by protocol scheduler workers (inherited by forking)
+_scheduled_model = None
+
+
+def _init_protocol_worker():
+    # Load NEURON and the cell once per worker: the NeuronRunner processes
+    # each protocol starts are forked from it
+    if not _scheduled_model.is_nosim():
+        _scheduled_model.load_model()
+
+
+def _save_protocol(prop):
+    # Get the properties the protocol depends on, saved by other workers
+    _scheduled_model.init_cell_record()
+    getattr(_scheduled_model, 'save_' + prop)()
+    return prop
+
+
 class CellModel(NMLDB_Model):
+    # A neuronunit.waveforms.WaveformStore to save protocol waveforms to, as
+    # compact binary arrays (default: saved to the database, as lists)
+    waveform_store = None
+
+    # Whether runs are simulated concurrently with others (whose contention
+    # for the CPUs slows them), as is saved with their run_time
+    concurrent = False
+
     def __init__(self, *args, **kwargs):
         super(CellModel, self).__init__(*args, **kwargs)
 
@@ -84,6 +183,68 @@ class CellModel(NMLDB_Model):
 
         self.init_cell_record()
 
+    def save_scheduled_properties(self, properties=None, processes=None):
+        """Save properties (default: all of them), running protocols that do
+        not depend on each other concurrently, in a pool of processes.
+
+        The runs of concurrent protocols are saved with run_time_concurrent
+        set, as their run times are slowed by each other."""
+        global _scheduled_model
+        if properties is None:
+            properties = self.all_properties
+        if processes is None:
+            processes = cpus()
+
+        for stage in get_protocol_stages(properties):
+            if not isinstance(stage, dict):
+                getattr(self, 'save_' + stage)()
+                continue
+
+            # Workers are forked per stage, with the settings saved so far
+            _scheduled_model = self
+            self.concurrent = processes > 1 and len(stage) > 1
+            context = multiprocessing.get_context('fork')
+            try:
+                with ProcessPoolExecutor(processes, mp_context=context,
+                                         initializer=_init_protocol_worker) \
+                        as pool:
+                    done, running = set(), {}
+                    while len(done) < len(stage):
+                        for i, (prop, before) in sorted(stage.items()):
+                            if i not in done and \
+                               i not in running.values() and before <= done:
+                                running[pool.submit(_save_protocol, prop)] = i
+                        finished, _ = wait(running,
+                                           return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            future.result()
+                            done.add(running.pop(future))
+            finally:
+                self.concurrent = False
+            self.init_cell_record()
+
+    def save_vi_waveforms(self, protocol, tvi_dict, label=None,
+                          meta_protocol=None, amplitude=None):
+        if self.waveform_store is not None:
+            self.waveform_store.save(protocol, tvi_dict, label=label,
+                                     meta_protocol=meta_protocol,
+                                     amplitude=amplitude)
+            return
+
+        # The database stores waveforms as lists
+        tvi_dict = dict((key, value.tolist() if isinstance(value, np.ndarray) else value)
+                        for key, value in tvi_dict.items())
+        super(CellModel, self).save_vi_waveforms(protocol=protocol,
+                                                 label=label,
+                                                 meta_protocol=meta_protocol,
+                                                 tvi_dict=tvi_dict)
+
+    def remove_protocol_waveforms(self, protocol):
+        if self.waveform_store is not None:
+            self.waveform_store.remove(protocol)
+        else:
+            super(CellModel, self).remove_protocol_waveforms(protocol)
+
     def init_cell_record(self):
         self.server.connect()
 
@@ -111,6 +272,16 @@ class CellModel(NMLDB_Model):
             # Retrieve the freshly created record
             self.cell_record = Cells.get_or_none(Cells.Model_ID == self.get_model_nml_id())
 
+    def save_cell_record(self, *fields):
+        """Save the given fields (names) of the cell record.
+
+        Protocols run concurrently (see save_scheduled_properties) each have
+        a copy of the record, so each saves only the fields it sets, rather
+        than the whole row, which would overwrite the others' fields with
+        stale values.
+        """
+        self.cell_record.save(only=[getattr(Cells, field) for field in fields])
+
     def save_stability_range(self):
 
         if self.is_nosim():
@@ -124,7 +295,7 @@ class CellModel(NMLDB_Model):
 
         assert self.cell_record.Stability_Range_Low < self.cell_record.Stability_Range_High
 
-        self.cell_record.save()
+        self.save_cell_record('Stability_Range_Low', 'Stability_Range_High')
 
     def save_resting_voltage(self):
 
@@ -143,7 +314,7 @@ class CellModel(NMLDB_Model):
         if not self.cell_record.Is_Intrinsically_Spiking:
             assert self.cell_record.Resting_Voltage < 1.0 # Allen Glif models rest at 0
 
-        self.cell_record.save()
+        self.save_cell_record('Resting_Voltage', 'Is_Intrinsically_Spiking')
 
 
     def save_threshold(self):
@@ -166,7 +337,7 @@ class CellModel(NMLDB_Model):
 
         assert self.cell_record.Threshold_Current_Low < self.cell_record.Threshold_Current_High
 
-        self.cell_record.save()
+        self.save_cell_record('Threshold_Current_Low', 'Threshold_Current_High')
 
 
     def save_rheobase(self):
@@ -188,7 +359,7 @@ class CellModel(NMLDB_Model):
         assert self.cell_record.Rheobase_Low < self.cell_record.Rheobase_High
         assert self.cell_record.Rheobase_High < self.cell_record.Threshold_Current_High
 
-        self.cell_record.save()
+        self.save_cell_record('Rheobase_Low', 'Rheobase_High')
 
     def save_bias_current(self):
         if self.is_nosim():
@@ -219,7 +390,7 @@ class CellModel(NMLDB_Model):
         else:
             assert self.cell_record.Bias_Current > 0
 
-        self.cell_record.save()
+        self.save_cell_record('Bias_Voltage', 'Bias_Current')
 
     def get_number_of_compartments(self, h):
         if self.is_abstract_cell():
@@ -843,54 +1014,17 @@ class CellModel(NMLDB_Model):
         strong = model.nmldb_model.get_druckmann2013_strong_current()
         ir_currents = model.nmldb_model.get_druckmann2013_input_resistance_currents()
 
-        tests = [
-            AP12AmplitudeDropTest(standard),
-            AP1SSAmplitudeChangeTest(standard),
-            AP1AmplitudeTest(standard),
-            AP1WidthHalfHeightTest(standard),
-            AP1WidthPeakToTroughTest(standard),
-            AP1RateOfChangePeakToTroughTest(standard),
-            AP1AHPDepthTest(standard),
-            AP2AmplitudeTest(standard),
-            AP2WidthHalfHeightTest(standard),
-            AP2WidthPeakToTroughTest(standard),
-            AP2RateOfChangePeakToTroughTest(standard),
-            AP2AHPDepthTest(standard),
-            AP12AmplitudeChangePercentTest(standard),
-            AP12HalfWidthChangePercentTest(standard),
-            AP12RateOfChangePeakToTroughPercentChangeTest(standard),
-            AP12AHPDepthPercentChangeTest(standard),
-            InputResistanceTest(injection_currents=ir_currents),
-            AP1DelayMeanTest(standard),
-            AP1DelaySDTest(standard),
-            AP2DelayMeanTest(standard),
-            AP2DelaySDTest(standard),
-            Burst1ISIMeanTest(standard),
-            Burst1ISISDTest(standard),
-            InitialAccommodationMeanTest(standard),
-            SSAccommodationMeanTest(standard),
-            AccommodationRateToSSTest(standard),
-            AccommodationAtSSMeanTest(standard),
-            AccommodationRateMeanAtSSTest(standard),
-            ISICVTest(standard),
-            ISIMedianTest(standard),
-            ISIBurstMeanChangeTest(standard),
-            SpikeRateStrongStimTest(strong),
-            AP1DelayMeanStrongStimTest(strong),
-            AP1DelaySDStrongStimTest(strong),
-            AP2DelayMeanStrongStimTest(strong),
-            AP2DelaySDStrongStimTest(strong),
-            Burst1ISIMeanStrongStimTest(strong),
-            Burst1ISISDStrongStimTest(strong),
-        ]
+        tests = get_druckmann2013_tests(standard, strong, ir_currents)
 
+        fields = []
         for i, test in enumerate(tests):
             mean = test.generate_prediction(model)['mean']
             field = test.__class__.__name__[:-4]
             setattr(self.cell_record, field, mean)
+            fields.append(field)
             print('Test ' + str(i+1).rjust(2,' ') + ' ' + field.rjust(50, ' ') + ": " + str(mean))
 
-        self.cell_record.save()
+        self.save_cell_record(*fields)
 
 
     def save_square_tuple_set(self, delay, threshold_current,
@@ -920,7 +1054,8 @@ class CellModel(NMLDB_Model):
                                   get_current_ti=lambda: get_current_ti(interval),
                                   restore_state=True)
 
-    def save_square_current_set(self, protocol, square_low, square_high, square_steps, delay, duration, post_delay=250):
+    def save_square_current_set(self, protocol, square_low, square_high, square_steps, delay, duration, post_delay=250,
+                                parallel=True):
 
         # Create current amplitude set
         amps = np.linspace(
@@ -928,18 +1063,32 @@ class CellModel(NMLDB_Model):
                     min(square_high, self.cell_record.Stability_Range_High),
                     num=square_steps).tolist()
 
+        def get_response(amp):
+            return self.get_square_response(delay=delay,
+                                            duration=duration,
+                                            post_delay=post_delay,
+                                            amp=amp,
+                                            restore_state=True)
+
         # Run each injection as a separate simulation, resuming from steady state
-        for amp in amps:
-            result = self.get_square_response(delay=delay,
-                                              duration=duration,
-                                              post_delay=post_delay,
-                                              amp=amp,
-                                              restore_state=True)
+        # (concurrently, unless their run times are measured)
+        if parallel:
+            concurrent = self.concurrent
+            self.concurrent = concurrent or len(amps) > 1
+            try:
+                bag = db.from_sequence(amps, npartitions=len(amps))
+                results = bag.map(get_response).compute(scheduler='threads')
+            finally:
+                self.concurrent = concurrent
+        else:
+            results = [get_response(amp) for amp in amps]
 
+        for amp, result in zip(amps, results):
             self.save_tvi_plot(label=protocol, case=self.short_string(amp) + " nA", tvi_dict=result)
 
             self.save_vi_waveforms(protocol=protocol,
                                    label=self.short_string(amp) + " nA",
+                                   amplitude=amp,
                                    tvi_dict=result)
 
     def get_square_response(self,
@@ -969,10 +1118,11 @@ class CellModel(NMLDB_Model):
                     t, v = self.runFor(delay + duration + post_delay)
 
             result = {
-                "t": t.tolist(),
-                "v": v.tolist(),
-                "i": self.ic_i_collector.get_values_list(),
+                "t": np.asarray(t),
+                "v": np.asarray(v),
+                "i": np.asarray(self.ic_i_collector.get_values_list()),
                 "run_time": timer.get_run_time(),
+                "run_time_concurrent": self.concurrent,
                 "steps": int(self.tvec.size()),
                 "cvode_active": int(self.config.cvode_active),
                 "dt_or_atol": self.config.abs_tolerance if self.config.cvode_active else self.config.dt
@@ -1024,7 +1174,8 @@ class CellModel(NMLDB_Model):
                                      square_steps=2,
                                      delay=delay,
                                      post_delay=0,
-                                     duration=1000)
+                                     duration=1000,
+                                     parallel=False)
 
         # The rest are used to quantify CVODE step frequency per spike
         self.save_square_current_set(protocol=protocol,
@@ -1033,7 +1184,8 @@ class CellModel(NMLDB_Model):
                                      square_steps=11,
                                      delay=delay,
                                      post_delay=0,
-                                     duration=1000)
+                                     duration=1000,
+                                     parallel=False)
 
         # Restore the integration method to as it was before
         self.config.cvode_active = orig_cvode
@@ -1296,10 +1448,11 @@ class CellModel(NMLDB_Model):
                     t, v = self.runFor(delay + duration + post_delay, test_condition)
 
             result = {
-                "t": t.tolist(),
-                "v": v.tolist(),
-                "i": self.ic_i_collector.get_values_list(),
+                "t": np.asarray(t),
+                "v": np.asarray(v),
+                "i": np.asarray(self.ic_i_collector.get_values_list()),
                 "run_time": timer.get_run_time(),
+                "run_time_concurrent": self.concurrent,
                 "steps": int(self.tvec.size()),
                 "cvode_active": int(self.config.cvode_active),
                 "dt_or_atol": self.config.abs_tolerance if self.config.cvode_active else self.config.dt
@@ -1315,6 +1468,11 @@ class CellModel(NMLDB_Model):
     def load_model(self):
         # Load cell hoc and get soma
         os.chdir(self.temp_model_path)
+
+        # Reuse the cell if it was loaded in this process, or in the one it
+        # was forked from (e.g. a protocol scheduler worker)
+        if getattr(self, 'loaded_h', None) is not None:
+            return self.loaded_h
         print("Loading NEURON... If this step 'freezes', ensure there are no hung NEURON processes with 'pkill -9 nrn*'")
         from neuron import h, gui
         print("DONE")
@@ -1346,6 +1504,7 @@ class CellModel(NMLDB_Model):
         else:
             raise Exception("Problem finding the soma section")
 
+        self.loaded_h = h
         return h
 
     def build_model(self, restore_tolerances=True):
@@ -1483,51 +1642,20 @@ class CellModel(NMLDB_Model):
 
         return current_range
 
-    def recompute_range(iteration,upperLevel,lowerLevel):
-        intervals = np.arange(upperLevel,lowerLevel,cpus)
-        return intervals
-
-    def list_process(simulate_iteration):
-        runner = NeuronRunner(simulate_iteration)
-        try:
-            found = runner.run()
-            return found
-        except NumericalInstabilityException:
-            if on_unstable is not None:
-                found = on_unstable()
-                return found
-            else:
-                return None
-
-    def simulate_iteration(time_flag):
-        self.time_flag = time_flag
-        h = self.build_model()
-        self.restore_state(state_file=state_file)
-
-        self.setCurrent(amp=currentAmp, delay=current_delay, dur=current_duration)
-        print("Trying " + str(currentAmp) + " nA...")
-
-        if not test_early:
-            t, v = self.runFor(run_for_after_delay)
-            found = test_condition(t, v)
-        else:
-            t, v = self.runFor(run_for_after_delay, test_condition)
-            found = test_condition(t, v)
-
-        plt.plot(t, v, label=str(round(currentAmp, 4)) + ", Found: " + str(found))
-        plt.legend(loc='upper left')
-        plt.savefig(str(iteration) + " " + fig_file)
-
-        print("FOUND" if found else "NOT FOUND")
-
-        return found
-
-
-
     def find_border(self, lowerLevel, upperLevel,
                     current_delay, current_duration,
                     run_for_after_delay, test_condition, max_iterations, fig_file,
-                    skip_current_delay=False, on_unstable=None, test_early=False):
+                    skip_current_delay=False, on_unstable=None, test_early=False,
+                    k=None):
+        """Find the current at which test_condition starts to hold.
+
+        Each round tries k currents evenly spaced inside the bracket, in
+        parallel (one NeuronRunner process each, all restoring the state
+        saved at current onset), and shrinks the bracket k+1 fold.  Rounds
+        are run until the bracket is as narrow as max_iterations bisections
+        would make it; k=1 is a plain bisection.  k defaults to the number of
+        CPUs.
+        """
 
         state_file = 'border_state.bin'
 
@@ -1546,33 +1674,52 @@ class CellModel(NMLDB_Model):
             runner = NeuronRunner(reach_resting_state)
             result = runner.run()
 
-        iterate = True
-        iteration = 0
-        found_once = False
+        def simulate_iteration(iteration, index, currentAmp):
+            def simulate(time_flag):
+                self.time_flag = time_flag
+                h = self.build_model()
+                self.restore_state(state_file=state_file)
 
-        upperLevel_start = upperLevel
-        lowerLevel_start = lowerLevel
-
-        first_interval = np.arange(lowerLevel_start,upperLevel_start,cpus)
-        scattered_iterable = db.from_sequence(first_interval,npartitions=cpus)
-        gathered_list = scattered_iterable.map(list_process)
-        while iterate:
-            scattered_iterable = db.from_sequence(intervals,npartitions=cpus)
-            gathered_list = scattered_iterable.map(list_process)
-            for g in gathered_list:
-                if g == True:
-                    break
-            intervals = recompute_range(iteration,upperLevel,lowerLevel)
-            if found:
-                upperLevel = currentAmp
-                found_once = True
-            else:
-                lowerLevel = currentAmp
+                self.setCurrent(amp=currentAmp, delay=current_delay, dur=current_duration)
+                print("Trying " + str(currentAmp) + " nA...")
+
+                if not test_early:
+                    t, v = self.runFor(run_for_after_delay)
+                    found = test_condition(t, v)
+                else:
+                    t, v = self.runFor(run_for_after_delay, test_condition)
+                    found = test_condition(t, v)
+
+                plt.plot(t, v, label=str(round(currentAmp, 4)) + ", Found: " + str(found))
+                plt.legend(loc='upper left')
+                plt.savefig(str(iteration) + "-" + str(index) + " " + fig_file)
+
+                print("FOUND" if found else "NOT FOUND")
+
+                return found
+
+            runner = NeuronRunner(simulate)
+            try:
+                return runner.run()
+            except NumericalInstabilityException:
+                if on_unstable is not None:
+                    return on_unstable()
+                return None
+
+        if k is None:
+            k = cpus()
+        found_once = False
 
-            iteration = iteration + 1
+        for iteration in range(get_bracket_rounds(max_iterations, k)):
+            currents = get_bracket_currents(lowerLevel, upperLevel, k)
+            # The runs are separate processes; threads just wait on them
+            bag = db.from_sequence(list(enumerate(currents)), npartitions=k)
+            found = bag.map(lambda x: simulate_iteration(iteration, *x))\
+                       .compute(scheduler='threads')
+            found_once = found_once or any(found)
+            lowerLevel, upperLevel = shrink_bracket(lowerLevel, upperLevel,
+                                                    currents, found)
 
-            if iteration >= max_iterations or lowerLevel == upperLevel_start or upperLevel == lowerLevel_start:
-                iterate = False
         current_range = (lowerLevel, upperLevel)
         return current_range, found_once
 
@@ -1644,10 +1791,11 @@ class CellModel(NMLDB_Model):
                 t, v = self.runFor(run_time)
 
             result = {
-                "t": t.tolist(),
-                "v": v.tolist(),
-                "i": self.ic_i_collector.get_values_list(),
+                "t": np.asarray(t),
+                "v": np.asarray(v),
+                "i": np.asarray(self.ic_i_collector.get_values_list()),
                 "run_time": timer.get_run_time(),
+                "run_time_concurrent": self.concurrent,
                 "steps": int(self.tvec.size()),
                 "cvode_active": int(self.config.cvode_active),
                 "dt_or_atol": self.config.abs_tolerance if self.config.cvode_active else self.config.dt
@@ -1699,7 +1847,7 @@ class CellModel(NMLDB_Model):
         self.cell_record.Sections = metrics["section_count"]
         self.cell_record.Compartments = metrics["compartment_count"]
 
-        self.cell_record.save()
+        self.save_cell_record('Sections', 'Compartments')
 
 
     def get_id_from_nml_file(self, nml):
@@ -0,0 +1,177 @@
+"""Benchmarks of the integration settings of model backends.
+
+Runs a model over standard protocols at each of a sweep of integration
+settings (a fixed time step 'dt' in ms, or the absolute 'tolerance' of
+variable step integration), recording for each run its wall time, steps,
+peak memory, and the error of its waveform against a reference run (the
+first, most accurate, setting).  choose_setting then picks the cheapest
+setting whose error is within a budget, e.g. to set up a backend for a cell
+type:
+
+    results = benchmark(model, get_square_protocols(100*pq.pA))
+    setting = choose_setting(results, error_budget=1.0)
+    set_integration(model, **setting)
+
+This generalizes cellmodelp's DT_SENSITIVITY and CVODE_STEP_FREQUENCIES
+protocols to all backends.
+"""
+
+import timeit
+import tracemalloc
+
+import numpy as np
+import quantities as pq
+
+from neuronunit.capabilities.trace import as_trace
+
+# Sweeps of integration settings for each backend, the reference (most
+# accurate) setting first
+default_settings = {
+    'RAW': [{'dt': dt} for dt in (0.003125, 0.00625, 0.0125, 0.025, 0.05,
+                                  0.1, 0.2)],
+    # odeint is adaptive; the trace is sampled at the backend's time step
+    'HH': [{'tolerance': tolerance} for tolerance in (1e-10, 1e-8, 1e-6,
+                                                      1e-4, 1e-2)],
+    'GLIF': [{'dt': dt} for dt in (0.03125, 0.0625, 0.125, 0.25, 0.5, 1.0)],
+    'NEURON': [{'dt': 1.0/steps_per_ms} for steps_per_ms in (1024, 256, 64,
+                                                            16, 4, 1)] +
+              [{'tolerance': tolerance} for tolerance in (1e-5, 1e-4, 1e-3,
+                                                          1e-2)],
+    'jNeuroML': [{'dt': dt} for dt in (0.0025, 0.005, 0.01, 0.025, 0.05)],
+}
+
+
+def get_square_protocols(amplitude, delay=100*pq.ms):
+    """Square current injections like those of cellmodelp (SHORT_SQUARE,
+    SQUARE and LONG_SQUARE), of the given amplitude."""
+    return {name: {'amplitude': amplitude, 'delay': delay,
+                   'duration': duration}
+            for name, duration in [('SHORT_SQUARE', 3*pq.ms),
+                                   ('SQUARE', 1000*pq.ms),
+                                   ('LONG_SQUARE', 2000*pq.ms)]}
+
+
+def get_backend_name(model):
+    return type(model._backend).__name__.replace('Backend', '')
+
+
+def set_integration(model, dt=None, tolerance=None):
+    """Set the integration of a model's backend: variable step with a
+    tolerance if given (otherwise fixed step), and a time step (ms)."""
+    backend = model._backend
+    if hasattr(backend, 'set_integration_method'):
+        backend.set_integration_method('fixed' if tolerance is None
+                                       else 'variable')
+    if tolerance is not None:
+        backend.set_tolerance(tolerance)
+    if dt is not None:
+        backend.set_time_step(dt*pq.ms)
+    # A new setting must be simulated anew
+    if hasattr(model, 'invalidate_run'):
+        model.invalidate_run()
+
+
+def get_waveform_error(reference, trace):
+    """The average absolute difference of a trace from the reference trace
+    (at the trace's sample times), as a percentage of the reference range
+    (as cellmodelp's compute_waveform_error)."""
+    times = trace.get_times()
+    v_reference = np.interp(times, reference.get_times(), reference.data)
+    v_range = np.ptp(reference.data)
+    if not (np.all(np.isfinite(trace.data)) and v_range > 0):
+        return np.inf
+    return np.average(np.abs(trace.data - v_reference))/v_range*100.0
+
+
+def get_steps(model, trace):
+    """The number of integration steps of the last run: the time points
+    recorded by variable step integrators, else the samples of the trace."""
+    backend = model._backend
+    h = getattr(backend, 'h', None)
+    if h is not None and h.cvode.active():
+        return int(backend.tVector.size())
+    return len(trace)
+
+
+def run_protocol(model, current):
+    """Inject a square current and return the membrane potential Trace."""
+    model.inject_square_current(current)
+    if hasattr(model, 'get_trace'):
+        return model.get_trace()
+    return as_trace(model.get_membrane_potential())
+
+
+def benchmark(model, protocols, settings=None, repeat=3, trace_memory=True):
+    """Run a model over protocols at each integration setting.
+
+    protocols: Square currents, by protocol name.
+    settings: Integration settings (see set_integration), the reference
+        first.  Defaults to those of the model's backend in default_settings.
+    repeat: Runs of each protocol and setting timed (the fastest is kept).
+    trace_memory: Whether to measure peak memory (in a further run, with
+        tracemalloc, i.e. of Python and numpy allocations).
+
+    Returns a list of dicts, one per protocol and setting, of the protocol,
+    setting, wall_time (s), steps, peak_memory (bytes) and error (% of the
+    reference range; see get_waveform_error).
+    """
+    if settings is None:
+        settings = default_settings[get_backend_name(model)]
+    results = []
+    references = {}
+    for setting in settings:
+        set_integration(model, **setting)
+        for name, current in sorted(protocols.items()):
+            wall_time = np.inf
+            for _ in range(repeat):
+                start = timeit.default_timer()
+                trace = run_protocol(model, current)
+                wall_time = min(wall_time, timeit.default_timer() - start)
+            steps = get_steps(model, trace)
+            peak_memory = None
+            if trace_memory:
+                tracemalloc.start()
+                run_protocol(model, current)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if name not in references:
+                references[name] = trace
+            results.append({'protocol': name,
+                            'setting': setting,
+                            'wall_time': wall_time,
+                            'steps': steps,
+                            'peak_memory': peak_memory,
+                            'error': get_waveform_error(references[name],
+                                                        trace)})
+    return results
+
+
+def choose_setting(results, error_budget=1.0):
+    """The setting of the lowest total wall time, over the protocols, of
+    those whose error is at most error_budget (%) for every protocol; None
+    if there is none."""
+    totals = {}
+    for result in results:
+        key = tuple(sorted(result['setting'].items()))
+        wall_time, error = totals.get(key, (0.0, 0.0))
+        totals[key] = (wall_time + result['wall_time'],
+                       max(error, result['error']))
+    within = [(wall_time, key) for key, (wall_time, error) in totals.items()
+              if error <= error_budget]
+    if not within:
+        return None
+    return dict(min(within)[1])
+
+
+def benchmark_backends(models, protocols, error_budget=1.0, **kwargs):
+    """Benchmark the models (e.g. one per backend, by backend name) over the
+    same protocols, and choose the setting of each.
+
+    Returns the results of benchmark and the chosen setting, by name.
+    """
+    report = {}
+    for name, model in models.items():
+        results = benchmark(model, protocols, **kwargs)
+        report[name] = {'results': results,
+                        'setting': choose_setting(results, error_budget)}
+    return report
@@ -15,6 +15,7 @@ import quantities as pq
 from pyneuroml import pynml
 from neo.core import AnalogSignal
 import neuronunit.capabilities.spike_functions as sf
+from neuronunit.capabilities.trace import Trace
 import sciunit
 from sciunit.models.backends import Backend, BackendException
 from sciunit.utils import dict_hash, import_module_from_path, \
@@ -22,4 +23,33 @@ from sciunit.utils import dict_hash, import_module_from_path, \
 
 # Test for NEURON support in a separate python process
 NEURON_SUPPORT = (os.system("python -c 'import neuron' > /dev/null 2>&1") == 0)
-PYNN_SUPPORT = (os.system("python -c 'import pyNN > /dev/null 2>&1") == 0)
\ No newline at end of file
+PYNN_SUPPORT = (os.system("python -c 'import pyNN > /dev/null 2>&1") == 0)
+
+# Resting states of models, by backend and model attributes.
+_steady_states = {}
+
+
+def get_steady_state(backend, compute):
+    """Get the resting state vector of the model of a backend.
+
+    `compute` is called once per backend type and set of model attributes;
+    the state it returns is then used as the initial condition of every
+    protocol, instead of simulating the relaxation to rest anew during the
+    delay before each stimulus.
+    """
+    key = (type(backend).__name__,
+           tuple(sorted((k, repr(v)) for k, v in backend.model.attrs.items())))
+    if key not in _steady_states:
+        _steady_states[key] = compute()
+    return _steady_states[key]
+
+
+def get_windows_stop(windows, dt):
+    """Number of samples, of period dt (ms), covering all the windows.
+
+    windows is a list of (start, stop) times of the parts of a trace which
+    must be simulated; unitless times are taken to be in ms.
+    """
+    def magnitude(x):
+        return float(x.rescale(pq.ms)) if hasattr(x, 'rescale') else float(x)
+    return int(max(magnitude(stop) for start, stop in windows)/dt) + 2
@@ -2,6 +2,7 @@ from quantities import mV, ms, s, V
 import sciunit
 from neo import AnalogSignal
 import neuronunit.capabilities as cap
+from neuronunit.capabilities.trace import Trace
 import numpy as np
 from neuronunit.models.backends import parse_glif
 from neuronunit.models.backends.base import Backend
@@ -13,6 +14,14 @@ import pickle
 import copy
 import re
 
+# Neuron configs already obtained in this process, by Allen ID.
+_neuron_configs = {}
+
+# Config entries which are plain attributes of a GlifNeuron, so that
+# updating them does not require building a new neuron.
+SCALAR_ATTRS = ['El', 'dt', 'C', 'th_inf', 'th_adapt', 'init_voltage',
+                'init_threshold']
+
 
 import allensdk.core.json_utilities as json_utilities
 from allensdk.model.glif.glif_neuron import GlifNeuron
@@ -35,7 +44,28 @@ except:
 
 
 
+def get_neuron_config(allen_id):
+    """Get a (private) copy of the neuron config of an Allen GLIF model.
+
+    The config is fetched from the Allen API (or the `allen_id.p` pickle)
+    once per process.
+    """
+    if allen_id not in _neuron_configs:
+        try:
+            nc = pickle.load(open(str('allen_id.p'),'rb'))
+        except:
+            glif_api = GlifApi()
+            nc = glif_api.get_neuron_configs([allen_id])[allen_id]
+            pickle.dump(copy.copy(nc),open(str('allen_id.p'),'wb'))
+        _neuron_configs[allen_id] = nc
+    return copy.deepcopy(_neuron_configs[allen_id])
+
+
 class GLIFBackend(Backend):
+
+    # Repeated simulations with the same parameters give the same result
+    stochastic = False
+
     def init_backend(self, attrs = None, cell_name = 'alice', current_src_name = 'hannah', DTC = None):
         backend = 'GLIF'
         super(GLIFBackend,self).init_backend()
@@ -52,27 +82,10 @@ class GLIFBackend(Backend):
 
 
         if self.allen_id == None:
-            try:
-                self.nc = pickle.load(open(str('allen_id.p'),'rb'))
-            except:
-                self.allen_id = 566302806
-                glif_api = GlifApi()
-
-                self.nc = glif_api.get_neuron_configs([self.allen_id])[self.allen_id]
-                pickle.dump(copy.copy(self.nc),open(str('allen_id.p'),'wb'))
-
-
-        else:
-
-            try:
-                self.nc = pickle.load(open(str('allen_id.p'),'rb'))
-            except:
-                glif_api = GlifApi()
-                self.allen_id = allen_id
-                self.glif = glif_api.get_neuronal_models_by_id([allen_id])[0]
-                self.nc = glif_api.get_neuron_configs([self.allen_id])[self.allen_id]
-                pickle.dump(self.nc,open(str('allen_id.p'),'wb'))
-
+            self.allen_id = 566302806
+        self.nc = get_neuron_config(self.allen_id)
+        # Simulate at a 1 ms resolution (glif.dt is in seconds).
+        self.nc['dt'] = 0.001
 
         self.glif = GlifNeuron.from_dict(self.nc)
 
@@ -134,67 +147,104 @@ class GLIFBackend(Backend):
         """Must return a neo.core.AnalogSignal.
         And must destroy the hoc vectors that comprise it.
         """
-        threshold = self.results['threshold']
-        interpolated_spike_times = self.results['interpolated_spike_times']
-
-        interpolated_spike_thresholds = self.results['interpolated_spike_threshold']
-        grid_spike_indices = self.results['spike_time_steps']
-        grid_spike_times = self.results['grid_spike_times']
-        after_spike_currents = self.results['AScurrents']
-
-        vm = self.results['voltage']
-        if len(self.results['interpolated_spike_voltage']) > 0:
-            isv = self.results['interpolated_spike_voltage'].tolist()[0]
-            vm = list(map(lambda x: isv if np.isnan(x) else x, vm))
-        dt =  self.glif.dt
-        self.vM = AnalogSignal(vm,units = mV,sampling_period =  dt * ms)
-        return vms
+        return self.vM.to_analog_signal()
 
-    def _local_run(self):
-        #self.results = np.array(self.glif.run(self.stim))
+    def _backend_run(self):
         results = {}
         results['vm'] = self.vM
-        results['t'] = self.vM.times
+        results['t'] = self.vM.get_times('s')
         results['run_number'] = results.get('run_number',0) + 1
         return results
 
-        return self.results
-
-
     def set_attrs(self, **attrs):
         self.model.attrs.update(attrs)
-        #self.nc.update(attrs)
+        rebuild = False
         for k,v in attrs.items():
             self.nc[k] = v
-        self.glif = GlifNeuron.from_dict(self.nc)
+            if k in SCALAR_ATTRS:
+                setattr(self.glif, k, v)
+            elif k == 'R_input':
+                self.glif.R_input = v
+                self.glif.G = 1.0/v
+            elif k == 'spike_cut_length':
+                self.glif.spike_cut_length = int(v)
+            else:
+                # e.g. arrays or dynamics methods, which the neuron derives
+                # other state from.
+                rebuild = True
+        if rebuild:
+            self.glif = GlifNeuron.from_dict(self.nc)
         return self.glif
 
 
+    def set_time_step(self, dt=1*pq.ms):
+        """Set the simulation time step; unitless values are in ms."""
+        if hasattr(dt, 'rescale'):
+            dt = float(dt.rescale(pq.ms))
+        # glif.dt is in seconds
+        self.nc['dt'] = self.glif.dt = float(dt)/1000.0
+
     def set_stop_time(self, stop_time = 650*pq.ms):
         """Sets the simulation duration
         stopTimeMs: duration in milliseconds
         """
         self.tstop = float(stop_time.rescale(pq.ms))
 
+    def get_stimulus_array(self, delay, duration, amplitude):
+        """Build a square stimulus sampled every glif.dt.
+
+        delay and duration are in ms; the stimulus is followed by a silent
+        period as long as delay + duration.
+        """
+        per_ms = 0.001/self.glif.dt
+        start = int(round(delay*per_ms))
+        width = int(round(duration*per_ms))
+        stim = np.zeros(2*(start+width))
+        stim[start:start+width] = amplitude
+        return stim
+
     def inject_square_current(self, current):
         if 'injected_square_current' in current.keys():
             c = current['injected_square_current']
         else:
             c = current
-        stop = float(c['delay'])+float(c['duration'])
         start = float(c['delay'])
         duration = float(c['duration'])
         amplitude = float(c['amplitude'])/1000.0
-        self.glif.dt = 0.001
         dt =  self.glif.dt
-        self.stim = [ 0.0 ] * int(start) + [ amplitude ] * int(duration) + [ 0.0 ] * int(stop)
-        #self.glif.init_voltage = -0.0065
+        self.stim = self.get_stimulus_array(start, duration, amplitude)
         self.results = self.glif.run(self.stim)
-        vm = self.results['voltage']
-        if len(self.results['interpolated_spike_voltage']) > 0:
-            isv = self.results['interpolated_spike_voltage'].tolist()[0]
-            vm = list(map(lambda x: isv if np.isnan(x) else x, vm))
-
-        vms = AnalogSignal(vm,units = V,sampling_period =  dt * s)
-        self.vM = vms
+        vm = np.asarray(self.results['voltage'])
+        isv = self.results['interpolated_spike_voltage']
+        if len(isv) > 0:
+            # Voltage is undefined (NaN) while spikes are cut out.
+            vm = np.where(np.isnan(vm), isv[0], vm)
+
+        self.vM = Trace(vm, dt*1000.0, units='V')
+        return self.vM
+
+    def run_batch(self, attrs_list, currents):
+        """Simulate several parameter sets, reusing one neuron and config.
+
+        Args:
+            attrs_list (list): one attrs dictionary per member.
+            currents (list or dict): square current for each member (same
+                keys as `inject_square_current`), or a single current applied
+                to every member.
+
+        Returns:
+            list: one membrane potential AnalogSignal per member.
+        """
+        if isinstance(currents, dict):
+            currents = [currents]*len(attrs_list)
+        model_attrs = copy.copy(self.model.attrs)
+        nc = copy.deepcopy(self.nc)
+        vms = []
+        for attrs, current in zip(attrs_list, currents):
+            self.set_attrs(**attrs)
+            vms.append(self.inject_square_current(current).to_analog_signal())
+        # Leave the backend parameterized as before the batch
+        self.model.attrs = model_attrs
+        self.nc = nc
+        self.glif = GlifNeuron.from_dict(self.nc)
         return vms
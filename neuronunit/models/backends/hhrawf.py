@@ -100,31 +100,73 @@ def dALLdt(X, t, attrs):
     return dVdt, dmdt, dhdt, dndt
 
 
-def get_vm(attrs):
+def get_vm(attrs, Y=None, bound=np.inf, chunks=10, settle=None):
     '''
     dt determined by
     Apply Hodgkin Huxley equation corresponding to point as model
     This function can't get too pythonic (functional), it needs to be a simple loop for
     numba/jit to understand it.
+    Y is the initial state (Vm, m, h, n); returns Vm (mV).
+    The time course is integrated in chunks, and integration stops once Vm
+    leaves (-bound, bound) or is not finite: the model diverged, and the
+    remaining samples are NaN.
+    With settle = (tolerance, steps), once |dVm/dt| has stayed below
+    tolerance (mV/ms) for the last steps samples of a chunk, the state is
+    held until the injected current next changes.
     '''
     # State (Vm, n, m, h)
     # saturation value
     #vr = attrs['vr']
-    Y = [-65.0, 0.05, 0.6, 0.32]
+    if Y is None:
+        Y = [-65.0, 0.05, 0.6, 0.32]
     # Solve ODE system
     T = attrs['T']
     dt = attrs['dt']
-    Vy = odeint(dALLdt, Y, T, args=(attrs,))
-
-    volts = [ v[0] for v in Vy ]
-    vm = AnalogSignal(volts,
-                 units = mV,
-                 sampling_period = dt * ms)
-    return vm
+    Vy = np.full((len(T), len(Y)), np.nan)
+    Vy[0] = Y
+    delay, duration = attrs['I'][:2]
+    changes = np.searchsorted(T, [delay, delay+duration])
+    size = max(1, int(np.ceil((len(T)-1)/float(chunks))))
+    start = 0
+    while start < len(T)-1:
+        stop = min(start+size, len(T)-1)
+        Vy[start:stop+1] = odeint(dALLdt, Vy[start], T[start:stop+1],
+                                  args=(attrs,), atol=attrs.get('atol'))
+        diverged = ~(np.abs(Vy[start:stop+1, 0]) < bound)
+        if diverged.any():
+            Vy[start+np.argmax(diverged):] = np.nan
+            break
+        if settle is not None and stop-start >= settle[1]:
+            dv = np.abs(np.diff(Vy[stop-settle[1]:stop+1, 0]))
+            if np.all(dv < settle[0]*dt):
+                later = changes[changes > stop]
+                hold = later[0]-1 if len(later) else len(T)-1
+                Vy[stop+1:hold+1] = Vy[stop]
+                stop = max(stop, hold)
+        start = stop
+
+    return Vy[:, 0]
 
 
 class HHBackend(Backend):
 
+    # Repeated simulations with the same parameters give the same result
+    stochastic = False
+
+    # Bound on |Vm| (mV) beyond which the model is deemed unstable, and the
+    # integration stopped
+    divergence_bound = 1000.0
+
+    # With settle detection on, the state is held once |dVm/dt| stays below
+    # settle_tolerance (mV/ms) for settle_window (ms); see set_settle
+    settle_tolerance = 1e-5
+    settle_window = 5.0
+
+    # Sampling period (ms) of the trace, and absolute tolerance of odeint's
+    # adaptive integration; None for 10000 samples and odeint's default
+    time_step = None
+    tolerance = None
+
     def init_backend(self, attrs = None, cell_name = 'alice', current_src_name = 'hannah', DTC = None):
         backend = 'HH'
         super(HHBackend,self).init_backend()
@@ -132,6 +174,8 @@ class HHBackend(Backend):
         self.current_src_name = current_src_name
         self.cell_name = cell_name
         self.vM = None
+        self.unstable = False
+        self.settle_windows = None
         self.attrs = attrs
 
         self.temp_attrs = None
@@ -163,25 +207,50 @@ class HHBackend(Backend):
         """Must return a neo.core.AnalogSignal.
         And must destroy the hoc vectors that comprise it.
         """
-        return self.vM
-
-    def get_membrane_potential(self):
-        """Must return a neo.core.AnalogSignal.
-        And must destroy the hoc vectors that comprise it.
-        """
-        return self.vM
+        return self.vM.to_analog_signal()
 
     def set_attrs(self, **attrs):
         self.model.attrs.update(attrs)
 
+    def set_time_step(self, dt=None):
+        """Set the sampling period of the trace; unitless values are in ms.
+        """
+        if hasattr(dt, 'rescale'):
+            dt = float(dt.rescale(pq.ms))
+        self.time_step = None if dt is None else float(dt)
+
+    def set_tolerance(self, tolerance=None):
+        """Set the absolute tolerance of the (variable step) integration."""
+        self.tolerance = tolerance
+
     def _backend_run(self):
         results = {}
         results['vm'] = self.vM
-        results['t'] = self.vM.times
+        results['t'] = self.vM.get_times('s')
         results['run_number'] = results.get('run_number',0) + 1
+        results['unstable'] = self.unstable
         return results
 
 
+    def set_settle(self, windows=None):
+        """Turn settle detection on for the windows of the trace needed.
+
+        Once the model settles (see get_vm) its state is held until the
+        current changes, and the trace ends after the last (start, stop)
+        window.  None turns settle detection off.
+        """
+        self.settle_windows = windows
+
+    def get_steady_state(self, tmax=1000.0):
+        """The state (Vm, m, h, n) the model relaxes to without current."""
+        def compute():
+            attrs = copy.copy(self.model.attrs)
+            attrs['I'] = (0.0, 0.0, tmax, 0.0)
+            Vy = odeint(dALLdt, [-65.0, 0.05, 0.6, 0.32], [0.0, tmax],
+                        args=(attrs,))
+            return Vy[-1]
+        return get_steady_state(self, compute)
+
     def inject_square_current(self, current):#, section = None, debug=False):
         """Inputs: current : a dictionary with exactly three items, whose keys are: 'amplitude', 'delay', 'duration'
         Example: current = {'amplitude':float*pq.pA, 'delay':float*pq.ms, 'duration':float*pq.ms}}
@@ -202,15 +271,30 @@ class HHBackend(Backend):
         self.set_stop_time(tmax*pq.ms)
         tmax = self.tstop
         tmin = 0.0
-        T = np.linspace(tmin, tmax, 10000)
+        if self.time_step is None:
+            T = np.linspace(tmin, tmax, 10000)
+        else:
+            T = np.arange(tmin, tmax, self.time_step)
         dt = T[1]-T[0]
 
         attrs = copy.copy(self.model.attrs)
         attrs['I'] = (delay,duration,tmax,amplitude)
         attrs['dt'] = dt
-        attrs['T'] = T
+        attrs['atol'] = self.tolerance
+        settle = None
+        if self.settle_windows is not None:
+            T = T[:get_windows_stop(self.settle_windows, dt)]
+            settle = (self.settle_tolerance, int(self.settle_window/dt))
         #print(attrs['C_m'])
         #print(attrs.keys())
 
-        self.vM  = get_vm(attrs)
+        # Start at rest from the current onset rather than simulating the
+        # relaxation to rest during the delay.
+        Y = self.get_steady_state()
+        onset = min(np.searchsorted(T, delay), len(T)-1)
+        attrs['T'] = T[onset:]
+        vm = get_vm(attrs, Y, bound=self.divergence_bound, settle=settle)
+        volts = np.concatenate([np.full(onset, Y[0]), vm])
+        self.unstable = not np.isfinite(volts[-1])
+        self.vM = Trace(volts, dt, units='mV')
         return self.vM
@@ -2,6 +2,7 @@
 
 import os
 import io
+import copy
 import tempfile
 
 from pyneuroml import pynml
@@ -68,3 +69,180 @@ class jNeuroMLBackend(Backend):
             print(self.stdout.getvalue())
         return results
 
+    def write_batch_lems(self, attrs_list, currents=None, exec_in_dir=None):
+        """Write one LEMS simulation containing a copy of the cell per member.
+
+        Each member of the batch gets its own cell component, population,
+        pulse generator and output columns, so that N parameterizations are
+        integrated side by side by a single jNeuroML (JVM) launch.
+
+        Args:
+            attrs_list (list): one attrs dictionary per member, in the same
+                form as `LEMSModel.attrs`, e.g.
+                {'izhikevich2007Cell': {'a': '0.03 per_ms'}}.
+            currents (list or dict): optional square current for each member
+                (same keys as `inject_square_current`), or a single current
+                applied to every member.
+            exec_in_dir (str): directory to write the batch files into.
+                A new temporary directory is used when not given.
+
+        Returns:
+            (str, dict): the path of the batch LEMS file and a mapping from
+                each batch output quantity to (member index, quantity).
+        """
+        n = len(attrs_list)
+        if currents is None or isinstance(currents, dict):
+            currents = [currents]*n
+        assert len(currents) == n, \
+            "Need one current per member of the batch (or a single current)"
+        if exec_in_dir is None:
+            exec_in_dir = tempfile.mkdtemp()
+
+        trees = self.model.get_parsed_trees()
+        lems_tree = trees[self.model.lems_file_path]
+        roots = [tree.getroot() for tree in trees.values()]
+
+        def clone_component(component_id, i, **kwargs):
+            # Components shared by several populations are copied only once
+            key = (component_id, i)
+            if key not in clones:
+                for root in roots:
+                    for elem in list(root):
+                        if elem.get('id') == component_id:
+                            clone = _batch_clone(elem, i, **kwargs)
+                            elem.addprevious(clone)
+                            clones[key] = clone.attrib['id']
+                if key not in clones:
+                    raise KeyError("No component with id '%s'" % component_id)
+            return clones[key]
+
+        clones = {}
+        populations = []
+        for root in roots:
+            for network in root.findall('network'):
+                pops = network.findall('population')
+                inputs = network.findall('explicitInput')
+                input_lists = network.findall('inputList')
+                pop_ids = [pop.attrib['id'] for pop in pops]
+                populations += pop_ids
+                for i in range(n):
+                    for pop in pops:
+                        new_pop = _batch_clone(pop, i)
+                        new_pop.attrib['component'] = clone_component(
+                            pop.attrib['component'], i, attrs=attrs_list[i])
+                        pop.addprevious(new_pop)
+                    for ei in inputs:
+                        new_ei = copy.deepcopy(ei)
+                        new_ei.attrib['input'] = clone_component(
+                            ei.attrib['input'], i, current=currents[i])
+                        new_ei.attrib['target'] = _batch_path(
+                            ei.attrib['target'], pop_ids, i)
+                        ei.addprevious(new_ei)
+                    for il in input_lists:
+                        new_il = _batch_clone(il, i)
+                        new_il.attrib['component'] = clone_component(
+                            il.attrib['component'], i, current=currents[i])
+                        new_il.attrib['population'] = \
+                            _batch_id(il.attrib['population'], i)
+                        for inp in new_il.findall('input'):
+                            inp.attrib['target'] = \
+                                _batch_path(inp.attrib['target'], pop_ids, i)
+                        il.addprevious(new_il)
+                for elem in pops + inputs + input_lists:
+                    network.remove(elem)
+
+        column_map = {}
+        for sim in lems_tree.getroot().findall('Simulation'):
+            for display in sim.findall('Display'):
+                sim.remove(display)
+            for output_file in sim.findall('OutputFile'):
+                columns = output_file.findall('OutputColumn')
+                for i in range(n):
+                    for col in columns:
+                        new_col = _batch_clone(col, i)
+                        quantity = _batch_path(col.attrib['quantity'],
+                                               populations, i)
+                        new_col.attrib['quantity'] = quantity
+                        col.addprevious(new_col)
+                        column_map[quantity] = (i, col.attrib['quantity'])
+                for col in columns:
+                    output_file.remove(col)
+
+        for file_path, tree in trees.items():
+            tree.write(os.path.join(exec_in_dir, os.path.basename(file_path)))
+        lems_path = os.path.join(exec_in_dir,
+                                 os.path.basename(self.model.lems_file_path))
+        return lems_path, column_map
+
+    def run_batch(self, attrs_list, currents=None):
+        """Simulate many parameterizations of the model in one jNeuroML run.
+
+        This amortizes the JVM launch of `_backend_run` over a whole batch,
+        e.g. a generation of an optimization.  See `write_batch_lems` for
+        the arguments.
+
+        Returns:
+            list: one results dictionary per member, keyed the same way as
+                the results of a single `_backend_run`.
+        """
+        f = pynml.run_lems_with_jneuroml
+        self.exec_in_dir = tempfile.mkdtemp()
+        lems_path, column_map = self.write_batch_lems(
+            attrs_list, currents=currents, exec_in_dir=self.exec_in_dir)
+        include_path = os.path.dirname(self.model.orig_lems_file_path)
+        with redirect_stdout(self.stdout):
+            results = f(lems_path,
+                        paths_to_include=[include_path],
+                        skip_run=self.model.skip_run,
+                        nogui=self.model.run_params['nogui'],
+                        load_saved_data=True,
+                        plot=False,
+                        exec_in_dir=self.exec_in_dir,
+                        exit_on_fail=False,
+                        verbose=self.model.run_params['v'])
+        if results is None or not results:
+            print(("No results returned: buffered error, warning, "
+                   "and notice messages follow:\n"))
+            print(self.stdout.getvalue())
+            return [None]*len(attrs_list)
+        batch = [{'t': results['t']} for _ in attrs_list]
+        for quantity, values in results.items():
+            if quantity in column_map:
+                i, orig_quantity = column_map[quantity]
+                batch[i][orig_quantity] = values
+        return batch
+
+
+def _batch_id(element_id, i):
+    """Id of the i-th batch copy of a LEMS/NeuroML element."""
+    return '%s_b%d' % (element_id, i)
+
+
+def _batch_path(path, populations, i):
+    """Point a path like 'RS_pop[0]/v' at the i-th copy of its population."""
+    for pop in populations:
+        for sep in ('[', '/'):
+            if path.startswith(pop + sep):
+                return _batch_id(pop, i) + path[len(pop):]
+            if path.startswith('../%s%s' % (pop, sep)):
+                return '../' + _batch_id(pop, i) + path[len(pop)+3:]
+    return path
+
+
+def _batch_clone(elem, i, attrs=None, current=None):
+    """Return a renamed copy of elem for the i-th member of a batch.
+
+    attrs are applied (by tag, as in `LEMSModel.set_lems_attrs`) and the
+    current keys are applied to pulse generator attributes.
+    """
+    clone = copy.deepcopy(elem)
+    clone.attrib['id'] = _batch_id(elem.attrib['id'], i)
+    for key, value in (attrs or {}).items():
+        if clone.tag == key:
+            for attr, attr_value in value.items():
+                clone.attrib[attr] = '%s' % attr_value
+    for attr in ['delay', 'duration', 'amplitude']:
+        if current and attr in current:
+            clone.attrib[attr] = '%s' % current[attr]
+    return clone
+
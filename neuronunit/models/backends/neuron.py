@@ -1,9 +1,15 @@
 import io
 import math
 import pdb
+import hashlib
+import shutil
+import tempfile
 from numba import jit
+import numpy as np
 
+from lxml import etree
 from sciunit.utils import redirect_stdout
+from neuronunit.models.lems import get_includes
 from .base import os, copy, subprocess
 from .base import pq, AnalogSignal, NEURON_SUPPORT, pynml
 from .base import Backend, BackendException, import_module_from_path
@@ -12,6 +18,182 @@ if NEURON_SUPPORT:
     import neuron
     from neuron import h
 
+# Root of the content-hashed cache of converted and compiled NEURON models.
+NEURON_CACHE = os.environ.get('NU_NEURON_CACHE',
+                              os.path.join(os.path.expanduser('~'),
+                                           '.neuronunit', 'nrn_cache'))
+
+# Sessions and mechanism directories loaded in this (worker) process.
+_sessions = {}
+_loaded_mechanisms = set()
+
+
+def get_session(lems_file_path, nml_paths=(), mechanisms_dir=None):
+    """Get the NEURON session for a LEMS model in this worker process.
+
+    The session is shared by every backend instance using the same model
+    contents, so conversion, compilation and import happen at most once
+    per process.
+    """
+    key = NEURONSession.content_hash(lems_file_path, nml_paths)
+    if key not in _sessions:
+        _sessions[key] = NEURONSession(lems_file_path, nml_paths, key=key,
+                                       mechanisms_dir=mechanisms_dir)
+    return _sessions[key]
+
+
+def get_included_paths(nml_paths):
+    """Get the NeuroML files nml_paths and those they include, recursively,
+    as absolute paths."""
+    paths = []
+    pending = [os.path.abspath(x) for x in nml_paths]
+    while pending:
+        path = pending.pop(0)
+        if path in paths:
+            continue
+        paths.append(path)
+        nml_dir = os.path.dirname(path)
+        pending += [os.path.normpath(os.path.join(nml_dir, x))
+                    for x in get_includes(etree.parse(path))]
+    return paths
+
+
+def resample(v_times, v_pots, fixed_dt):
+    """Linearly interpolate a variable step trace onto a fixed time step."""
+    n_samples = int(np.floor((v_times[-1]-v_times[0])/fixed_dt)) + 1
+    f_times = v_times[0] + fixed_dt*np.arange(n_samples)
+    return np.interp(f_times, v_times, v_pots)
+
+
+def explicit_input_name(input_id, target):
+    """Name of the hoc object jNeuroML generates for an explicitInput."""
+    return 'explicitInput_%s%s' % (input_id, target.replace('[', '')
+                                                  .replace(']', ''))
+
+
+class NEURONSession(object):
+    """A converted, compiled and initialized NEURON model.
+
+    The jNeuroML conversion and `nrnivmodl` compilation are done once into
+    a directory of NEURON_CACHE named by the hash of the model files, and
+    reused by later processes.  Within a process the generated `_nrn.py`
+    module is imported once and the hoc instance it builds is kept; between
+    simulations it is only re-parameterized and re-initialized.
+
+    Models made of the same cells (e.g. a population of copies of a cell)
+    can reuse already compiled mechanisms through `mechanisms_dir`, since
+    NEURON cannot load two mechanisms with the same name.
+    """
+
+    def __init__(self, lems_file_path, nml_paths=(), key=None,
+                 mechanisms_dir=None):
+        self.lems_file_path = os.path.abspath(lems_file_path)
+        # With the files they include, which the conversion needs too
+        self.nml_paths = get_included_paths(nml_paths)
+        if key is None:
+            key = self.content_hash(lems_file_path, self.nml_paths)
+        self.key = key
+        self.model_dir = os.path.join(NEURON_CACHE, key)
+        base_name = os.path.splitext(os.path.basename(lems_file_path))[0]
+        self.nrn_path = os.path.join(self.model_dir, '%s_nrn.py' % base_name)
+        self.mechanisms_dir = mechanisms_dir
+        self.nrn = None
+        self.ns = None
+        self.stdout = io.StringIO()
+
+    @staticmethod
+    def content_hash(lems_file_path, nml_paths=()):
+        """Hash the contents of the LEMS file and its NeuroML includes
+        (nml_paths and, recursively, the files they include)."""
+        sha = hashlib.sha1()
+        for path in [lems_file_path] + sorted(get_included_paths(nml_paths)):
+            with open(path, 'rb') as f:
+                sha.update(os.path.basename(path).encode('utf-8'))
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    @property
+    def compiled(self):
+        return os.path.isfile(self.nrn_path)
+
+    @property
+    def loaded(self):
+        return self.ns is not None
+
+    def compile(self, verbose=False):
+        """Convert the model to NEURON and compile its mechanisms, once.
+
+        The build happens in a scratch directory which is then renamed into
+        place, so that concurrent workers never see a half-built model.
+        """
+        if self.compiled:
+            return self
+        if not os.path.isdir(NEURON_CACHE):
+            os.makedirs(NEURON_CACHE, exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=NEURON_CACHE)
+        # Includes keep their paths relative to the LEMS file (those outside
+        # its directory are copied next to it)
+        lems_dir = os.path.dirname(self.lems_file_path)
+        for path in [self.lems_file_path] + self.nml_paths:
+            rel_path = os.path.relpath(path, lems_dir)
+            if rel_path.startswith(os.pardir):
+                rel_path = os.path.basename(path)
+            copy_path = os.path.join(build_dir, rel_path)
+            if not os.path.isdir(os.path.dirname(copy_path)):
+                os.makedirs(os.path.dirname(copy_path))
+            shutil.copy2(path, copy_path)
+        lems_copy = os.path.join(build_dir,
+                                 os.path.basename(self.lems_file_path))
+        pynml.run_lems_with_jneuroml_neuron(lems_copy,
+                                            skip_run=False,
+                                            nogui=True,
+                                            load_saved_data=False,
+                                            only_generate_scripts=True,
+                                            plot=False,
+                                            show_plot_already=False,
+                                            exec_in_dir=build_dir,
+                                            verbose=verbose,
+                                            exit_on_fail=False)
+        if self.mechanisms_dir is None:
+            subprocess.run(['nrnivmodl'], cwd=build_dir)
+        try:
+            os.rename(build_dir, self.model_dir)
+        except OSError:
+            # Another worker finished compiling the same model first.
+            shutil.rmtree(build_dir, ignore_errors=True)
+        return self
+
+    def load(self, tstop=650*pq.ms, dt=0.0025):
+        """Load mechanisms and instantiate the model, once per process.
+
+        Models loaded in a process share its hoc namespace, so must not
+        name their populations alike (see write_population_lems).
+        """
+        if self.loaded:
+            return self
+        self.compile()
+        mechanisms_dir = self.mechanisms_dir or self.model_dir
+        if mechanisms_dir not in _loaded_mechanisms:
+            with redirect_stdout(self.stdout):
+                neuron.load_mechanisms(mechanisms_dir)
+            _loaded_mechanisms.add(mechanisms_dir)
+        self.nrn = import_module_from_path(self.nrn_path)
+        self.h = self.nrn.neuron.h
+        self.h.tstop = float(tstop)
+        with redirect_stdout(self.stdout):
+            self.ns = self.nrn.NeuronSimulation(self.h.tstop, dt=dt)
+        return self
+
+    def reset(self):
+        """Return the loaded model to its initial state without reloading.
+
+        Parameters are assigned by the backend beforehand; `finitialize`
+        then sets every state variable from them.
+        """
+        self.h.finitialize(self.h.v_init)
+        return self
+
+
 class NEURONBackend(Backend):
     """Use for simulation with NEURON, a popular simulator.
 
@@ -55,6 +237,7 @@ class NEURONBackend(Backend):
         self.neuron = None
         self.model_path = None
         self.h = h
+        self.fixedTimeStep = None
 
         backend = 'NEURON'
 
@@ -142,6 +325,17 @@ class NEURONBackend(Backend):
             self.cvode = self.h.CVode()
             self.cvode.active(1 if method == "variable" else 0)
 
+    def set_sampling_period(self, sampling_period=None):
+        """Set the fixed time step onto which CVode output is resampled.
+
+        Args:
+            sampling_period (float): fixed time step in milliseconds, or None
+                to resample onto the integration time step `h.dt`.
+        """
+        if sampling_period is not None:
+            sampling_period = float(sampling_period)
+        self.fixedTimeStep = sampling_period
+
     def get_membrane_potential(self):
         """Get a membrane potential traces from the simulation.
 
@@ -151,65 +345,34 @@ class NEURONBackend(Backend):
             neo.core.AnalogSignal: the membrane potential trace
         """
         if self.h.cvode.active() == 0:
-            dt = float(copy.copy(self.h.dt))
-            fixed_signal = copy.copy(self.h.vVector.to_python())
+            dt = float(self.h.dt)
+            fixed_signal = np.array(self.vVector.as_numpy())
         else:
-            dt = float(copy.copy(self.fixedTimeStep))
-            fixed_signal = copy.copy(self.get_variable_step_analog_signal())
-
-        self.h.dt = dt
-        self.fixedTimeStep = float(1.0/dt)
+            dt = self.fixedTimeStep or float(self.h.dt)
+            fixed_signal = self.get_variable_step_analog_signal(dt)
         return AnalogSignal(fixed_signal,
                             units=pq.mV,
                             sampling_period=dt*pq.ms)
 
-    def get_variable_step_analog_signal(self):
+    def get_variable_step_analog_signal(self, fixed_dt=None):
         """Convert variable dt array values to fixed dt array.
 
-        Uses linear interpolation.
-        """
-        # Fixed dt potential
-        fPots = []
-        fDt = self.fixedTimeStep
-        # Variable dt potential
-        vPots = self.vVector.to_python()
-        # Variable dt times
-        vTimes = self.tVector.to_python()
-        duration = vTimes[len(vTimes)-1]
-        # Fixed and Variable dt times
-        fTime = vTime = vTimes[0]
-        # Index of variable dt time array
-        vIndex = 0
-        # Advance the fixed dt position
-        while fTime <= duration:
-
-            # If v and f times are exact, no interpolation needed
-            if fTime == vTime:
-                fPots.append(vPots[vIndex])
-
-            # Interpolate between the two nearest vdt times
-            else:
-
-                # Increment vdt time until it surpases the fdt time
-                while fTime > vTime and vIndex < len(vTimes):
-                    vIndex += 1
-                    vTime = vTimes[vIndex]
-
-                # Once surpassed, use the new vdt time and t-1
-                # for interpolation
-                vIndexMinus1 = max(0, vIndex-1)
-                vTimeMinus1 = vTimes[vIndexMinus1]
-
-                fPot = self.linearInterpolate(vTimeMinus1, vTime,
-                                              vPots[vIndexMinus1],
-                                              vPots[vIndex], fTime)
-
-                fPots.append(fPot)
+        Uses linear interpolation, done in one pass over zero-copy NumPy views
+        of the recorded hoc Vectors.
 
-            # Go to the next fdt time step
-            fTime += fDt
+        Args:
+            fixed_dt (float): time step of the returned samples in ms.
+                Defaults to the configured sampling period (or `h.dt`).
 
-        return fPots
+        Returns:
+            numpy.ndarray: the potential sampled every fixed_dt from the first
+                recorded time to the last.
+        """
+        if fixed_dt is None:
+            fixed_dt = self.fixedTimeStep or float(self.h.dt)
+        # Variable dt times and potentials
+        return resample(self.tVector.as_numpy(), self.vVector.as_numpy(),
+                        fixed_dt)
 
     def linearInterpolate(self, tStart, tEnd, vStart, vEnd, tTarget):
         """Perform linear interpolation."""
@@ -221,18 +384,16 @@ class NEURONBackend(Backend):
         return vTarget
 
     def load(self, tstop=650*pq.ms):
-        nrn_path = (os.path.splitext(self.model.orig_lems_file_path)[0] +
-                    '_nrn.py')
-        nrn = import_module_from_path(nrn_path)
-        self.reset_neuron(nrn.neuron)
-        self.h.tstop = tstop
+        self.session.load(tstop=tstop)
+        self.reset_neuron(self.session.nrn.neuron)
         self.set_stop_time(tstop)  # previously 500ms add on 150ms of recovery
-        with redirect_stdout(self.stdout):
-            self.ns = nrn.NeuronSimulation(self.h.tstop, dt=0.0025)
+        self.ns = self.session.ns
 
     def load_mechanisms(self):
-        with redirect_stdout(self.stdout):
-            neuron.load_mechanisms(self.neuron_model_dir)
+        if self.neuron_model_dir not in _loaded_mechanisms:
+            with redirect_stdout(self.stdout):
+                neuron.load_mechanisms(self.neuron_model_dir)
+            _loaded_mechanisms.add(self.neuron_model_dir)
 
     def load_model(self, verbose=True):
         """Load a NEURON model.
@@ -246,43 +407,21 @@ class NEURONBackend(Backend):
 
         Create a pyhoc file using jneuroml to convert from NeuroML to pyhoc.
         import the contents of the file into the current names space.
+
+        Conversion and compilation happen once per model contents, in the
+        NEURON_CACHE directory, and the import once per process (see
+        NEURONSession).
         """
         assert os.path.isfile(self.model.orig_lems_file_path)
-        base_name = os.path.splitext(self.model.orig_lems_file_path)[0]
-        NEURON_file_path = '{0}_nrn.py'.format(base_name)
-        self.neuron_model_dir = os.path.dirname(self.model.orig_lems_file_path)
-        assert os.path.isdir(self.neuron_model_dir)
-        if not os.path.exists(NEURON_file_path):
-            pynml.run_lems_with_jneuroml_neuron(
-                self.model.orig_lems_file_path,
-                skip_run=False,
-                nogui=True,
-                load_saved_data=False,
-                only_generate_scripts=True,
-                plot=False,
-                show_plot_already=False,
-                exec_in_dir=self.neuron_model_dir,
-                verbose=verbose,
-                exit_on_fail=False)
-            # use a different process to call NEURONS compiler nrnivmodl in the
-            # background if the NEURON_file_path does not yet exist.
-            nrnivmodl_flags = []
-            subprocess.run(["cd %s; nrnivmodl" % self.neuron_model_dir] +
-                           nrnivmodl_flags,
-                           shell=True)
-            print(os.environ['NEURON_HOME'])
-            print(self.neuron_model_dir)
-            self.load_mechanisms()
-        elif os.path.realpath(os.getcwd()) != \
-                os.path.realpath(self.neuron_model_dir):
-            # Load mechanisms unless they've already been loaded
-            #       subprocess.run(["cd %s; nrnivmodl" % self.neuron_model_dir],shell=True)
-            self.load_mechanisms()
+        self.session = get_session(self.model.orig_lems_file_path,
+                                   self.model.get_nml_paths(original=True))
+        self.session.compile(verbose=verbose)
+        self.neuron_model_dir = self.session.model_dir
         try:
             self.load()
         except Exception:
             pass
-        
+
         # Although the above approach successfuly instantiates a LEMS/neuroml model in pyhoc
         # the resulting hoc variables for current source and cell name are idiosyncratic (not generic).
         # the non generic approach described above makes it hard to create a generalizable code.
@@ -382,29 +521,22 @@ class NEURONBackend(Backend):
               whose keys are: 'amplitude', 'delay', 'duration'
 
         Implementation:
-        1. purge the HOC space, by calling reset_neuron()
-        2. Redefine the neuronal model in the HOC namespace, which was recently
-           cleared out.
-        3. Strip away quantities representation of physical units.
-        4. Translate the dictionary of current injection parameters into
+        1. Re-assign the model attributes to the session's loaded hoc
+           instance and re-initialize its state with finitialize.
+        2. Strip away quantities representation of physical units.
+        3. Translate the dictionary of current injection parameters into
            executable HOC code.
         """
-        self.h = None
-        self.neuron = None
-
-        nrn_path = os.path.splitext(self.model.orig_lems_file_path)[0]+'_nrn.py'
-        nrn = import_module_from_path(nrn_path)
-
         ##
-        # init_backend is the most reliable way to purge existing NEURON simulations.
-        # however we don't want to purge the model attributes, we only want to purge
-        # the NEURON model code.
-        # store the model attributes, in a temp buffer such that they persist throughout the model reinitialization.
+        # The model stays loaded in the session between simulations: its
+        # parameters are re-assigned and its state re-initialized, instead
+        # of re-importing the model code.
+        # store the model attributes, in a temp buffer such that they persist throughout the re-parameterization.
         ##
-        # These lines are crucial.
         temp_attrs = copy.copy(self.model.attrs)
-        self.init_backend()
+        self.load()
         self.set_attrs(**temp_attrs)
+        self.session.reset()
 
         current = copy.copy(current)
         if 'injected_square_current' in current.keys():
@@ -441,11 +573,167 @@ class NEURONBackend(Backend):
         self.h('run()')
         results = {}
         # Prepare NEURON vectors for quantities/sciunit
-        # By rescaling voltage to milli volts, and time to milli seconds.
-        results['vm'] = [float(x/1000.0) for x in
-                         copy.copy(self.neuron.h.v_v_of0.to_python())]
-        results['t'] = [float(x/1000.0) for x in
-                        copy.copy(self.neuron.h.v_time.to_python())]
+        # By rescaling voltage to volts, and time to seconds.
+        if self.h.cvode.active() == 0:
+            vm = np.array(self.vVector.as_numpy())
+            t = np.array(self.tVector.as_numpy())
+        else:
+            dt = self.fixedTimeStep or float(self.h.dt)
+            vm = self.get_variable_step_analog_signal(dt)
+            t = self.tVector.as_numpy()[0] + dt*np.arange(len(vm))
+        results['vm'] = vm/1000.0
+        results['t'] = t/1000.0
         results['run_number'] = results.get('run_number', 0) + 1
 
         return results
+
+    def write_population_lems(self, size, exec_in_dir=None):
+        """Write a variant of the model with `size` copies of the cell.
+
+        The population of the cell is enlarged and the explicit input of
+        its first member is repeated for every other member, so each copy
+        gets its own parameters (mechanism instance) and current clamp.
+        The population is renamed (as are the references to it), so that
+        its hoc objects can be loaded alongside those of the single cell.
+
+        Returns:
+            (str, list, str): the paths of the LEMS and NeuroML files of the
+                variant, and the id of the population.
+        """
+        if exec_in_dir is None:
+            exec_in_dir = tempfile.mkdtemp()
+        trees = self.model.get_parsed_trees()
+        pop_id = None
+        for tree in trees.values():
+            for network in tree.getroot().findall('network'):
+                for pop in network.findall('population'):
+                    if pop.attrib['component'] != self.cell_name:
+                        continue
+                    pop_id = pop.attrib['id']
+                    pop.attrib['size'] = str(size)
+                    target = '%s[0]' % pop_id
+                    for ei in network.findall('explicitInput'):
+                        if ei.attrib['target'] != target:
+                            continue
+                        for j in range(size-1, 0, -1):
+                            new_ei = copy.deepcopy(ei)
+                            new_ei.attrib['target'] = '%s[%d]' % (pop_id, j)
+                            ei.addnext(new_ei)
+        if pop_id is None:
+            raise BackendException("No population of cell '%s' found"
+                                   % self.cell_name)
+        new_id = '%s_x%d' % (pop_id, size)
+        for tree in trees.values():
+            for elem in tree.getroot().iter():
+                for key, value in elem.attrib.items():
+                    if value == pop_id or value.startswith(pop_id + '['):
+                        elem.attrib[key] = new_id + value[len(pop_id):]
+        paths = []
+        for file_path, tree in trees.items():
+            paths.append(os.path.join(exec_in_dir,
+                                      os.path.basename(file_path)))
+            tree.write(paths[-1])
+        return paths[0], paths[1:], new_id
+
+    def init_population(self, size):
+        """Instantiate `size` independent copies of the cell in one model.
+
+        The variant model is converted once (and cached like any other
+        session) but reuses the mechanisms compiled for the single cell.
+
+        Args:
+            size (int): number of copies simulated by each run of
+                `run_population`.
+        """
+        if not hasattr(self, 'session'):
+            self.load_model()
+        self.session.compile()
+        lems_path, nml_paths, pop_id = self.write_population_lems(size)
+        self.population_session = get_session(
+            lems_path, nml_paths, mechanisms_dir=self.session.model_dir)
+        self.population_session.compile()
+        self.population_size = size
+        self.population_id = pop_id
+        return self
+
+    def run_population(self, attrs_list, currents):
+        """Simulate many parameterizations of the cell in one NEURON run.
+
+        Each member is assigned to a copy of the cell with its own
+        parameters and current clamp, so that a whole group of candidates is
+        integrated by a single `run()`; more members than the population
+        size are simulated in consecutive runs.
+
+        Args:
+            attrs_list (list): one attrs dictionary per member, in the same
+                form as passed to `set_attrs`.
+            currents (list or dict): square current for each member (same
+                keys as `inject_square_current`), or a single current applied
+                to every member.
+
+        Returns:
+            list: one membrane potential AnalogSignal per member.
+        """
+        n = len(attrs_list)
+        if isinstance(currents, dict):
+            currents = [currents]*n
+        assert len(currents) == n, \
+            "Need one current per member of the population (or one current)"
+        currents = [c.get('injected_square_current', c) for c in currents]
+        if not hasattr(self, 'population_session'):
+            self.init_population(n)
+        # The single cell stays loaded too (both are integrated by run())
+        session = self.population_session.load()
+        h = session.h
+        size = self.population_size
+        mech = 'm_%s_%s' % (self.cell_name, self.population_id)
+        clamps = [explicit_input_name(self.current_src_name,
+                                      '%s[%d]' % (self.population_id, j))
+                  for j in range(size)]
+        h(' { v_pop_time = new Vector() } ')
+        h(' { v_pop_time.record(&t) } ')
+        vectors = []
+        for j in range(size):
+            h(' { v_pop_v_of%d = new Vector() } ' % j)
+            h(' { v_pop_v_of%d.record(&%s[%d].v(0.5)) } '
+              % (j, self.population_id, j))
+            vectors.append(getattr(h, 'v_pop_v_of%d' % j))
+
+        vms = []
+        for start in range(0, n, size):
+            members = list(range(start, min(start+size, n)))
+            for j in range(size):
+                if j >= len(members):
+                    # Unused copies are left unstimulated
+                    h('%s.amplitude = 0' % clamps[j])
+                    continue
+                i = members[j]
+                for h_key, h_value in attrs_list[i].items():
+                    h('%s[%d].%s = %s' % (mech, j, h_key, float(h_value)))
+                h('%s[%d].v0 = %s[%d].vr' % (mech, j, mech, j))
+                c = currents[i]
+                h('%s.amplitude = %s' % (clamps[j],
+                                         float(c['amplitude'])/1000.0))
+                h('%s.delay = %s' % (clamps[j], float(c['delay'])))
+                h('%s.duration = %s' % (clamps[j], float(c['duration'])))
+            stop = max(float(currents[i]['delay']) +
+                       float(currents[i]['duration']) for i in members)
+            h('tstop = %f' % (stop+100.0))
+            session.reset()
+            h('run()')
+
+            if h.cvode.active() == 0:
+                dt = float(h.dt)
+            else:
+                dt = self.fixedTimeStep or float(h.dt)
+            t = h.v_pop_time.as_numpy()
+            for j in range(len(members)):
+                v = vectors[j].as_numpy()
+                if h.cvode.active():
+                    v = resample(t, v, dt)
+                vms.append(AnalogSignal(np.array(v), units=pq.mV,
+                                        sampling_period=dt*pq.ms))
+        # The copies rest through the runs of the single cell
+        for clamp in clamps:
+            h('%s.amplitude = 0' % clamp)
+        return vms
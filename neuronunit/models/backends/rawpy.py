@@ -18,18 +18,26 @@ hc['vPeak'] = hc['vr'] + 86.364525297619
 hc['C'] = 89.7960714285714
 
 @jit
-def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.364525297619-65.2261863636364), vr=-65.2261863636364, vt=-50, dt=0.030, Iext=[]):
+def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.364525297619-65.2261863636364), vr=-65.2261863636364, vt=-50, dt=0.030, Iext=[], vBound=np.inf, settleTol=0.0, settleSteps=0):
     '''
     dt determined by
     Apply izhikevich equation as model
     This function can't get too pythonic (functional), it needs to be a simple loop for
     numba/jit to understand it.
+    Returns v (mV).
+    Integration stops when v leaves (-vBound, vBound) or u is not finite:
+    the model diverged, and the remaining samples are NaN.
+    With settleSteps > 0, once |dv/dt| has stayed below settleTol (mV/ms) for
+    settleSteps steps the model is taken to have settled, and its state is
+    held until Iext next changes.
     '''
     N = len(Iext)
     v = np.zeros(N)
     u = np.zeros(N)
     v[0] = vr
-    for m in range(0,N-1):
+    settled = 0
+    m = 0
+    while m < N-1:
         vT = v[m]+ (dt/2) * (k*(v[m] - vr)*(v[m] - vt)-u[m] + Iext[m])/C;
         v[m+1] = vT + (dt/2)  * (k*(v[m] - vr)*(v[m] - vt)-u[m] + Iext[m])/C;
         u[m+1] = u[m] + dt * a*(b*(v[m]-vr)-u[m]);
@@ -38,15 +46,158 @@ def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.36452
             v[m] = vPeak;# % padding the spike amplitude
             v[m+1] = c;# % membrane voltage reset
             u[m+1] = u[m+1] + d;# % recovery variable update
-    v = np.divide(v, 1000.0)
-    vm = AnalogSignal(v,
-                 units = mV,
-                 sampling_period = dt * ms)
-    return vm
+        if not (abs(v[m+1]) < vBound and np.isfinite(u[m+1])):
+            v[m+1:] = np.nan
+            break
+        if abs(v[m+1] - v[m]) < settleTol*dt:
+            settled += 1
+        else:
+            settled = 0
+        m += 1
+        if settleSteps > 0 and settled >= settleSteps:
+            while m < N-1 and Iext[m] == Iext[m-1]:
+                v[m+1] = v[m]
+                u[m+1] = u[m]
+                m += 1
+            settled = 0
+    return v
+
+
+@jit
+def get_vm_sweep(C, a, b, c, d, k, vPeak, vr, vt, dt, Iext, vBound=np.inf):
+    """Integrate get_vm for every row of Iext at once (mV, one row each)."""
+    n, N = Iext.shape
+    v = np.zeros((n, N))
+    u = np.zeros(n)
+    v[:, 0] = vr
+    stable = np.ones(n, dtype=np.bool_)
+    for m in range(0, N-1):
+        for i in range(n):
+            if not stable[i]:
+                continue
+            dv = (dt/2) * (k*(v[i, m] - vr)*(v[i, m] - vt)-u[i] + Iext[i, m])/C
+            v[i, m+1] = (v[i, m] + dv) + dv
+            u[i] = u[i] + dt * a*(b*(v[i, m+1]-vr)-u[i])
+            if v[i, m+1] >= vPeak:
+                v[i, m] = vPeak
+                v[i, m+1] = c
+                u[i] = u[i] + d
+            if not (abs(v[i, m+1]) < vBound and np.isfinite(u[i])):
+                v[i, m+1:] = np.nan
+                stable[i] = False
+    return v
+
+
+def get_onset(Iext):
+    """Index of the first sample at which any row of Iext is non-zero.
+
+    get_vm starts from rest (v = vr, u = 0), a fixed point of the model
+    without current, so the samples before the onset need no integration.
+    """
+    active = np.flatnonzero(np.any(Iext != 0, axis=0))
+    return int(active[0]) if len(active) else Iext.shape[1]-1
+
+
+def get_izhikevich_attrs(**attrs):
+    """Complete model attributes with the defaults of get_vm."""
+    import inspect
+    func = getattr(get_vm, 'py_func', get_vm)
+    params = inspect.signature(func).parameters
+    options = ['dt', 'Iext', 'vBound', 'settleTol', 'settleSteps']
+    full = {k: v.default for k, v in params.items() if k not in options}
+    full.update({k: float(v) for k, v in attrs.items() if k in full})
+    return full
+
+
+def get_analytic_property(name, current=None, **attrs):
+    """Compute a property of the Izhikevich (2007) model in closed form.
+
+    With x = v - vr and u at steady state, an injected current I balances
+    I = -k*x*(x - (vt-vr)) + b*x.  Rest is at vr, the input resistance
+    follows from the steady state reached for I, and when b <= 0 the rest
+    state is lost through a saddle-node bifurcation at
+    I = (b + k*(vt-vr))**2/(4*k), which is returned as the 'rheobase'.  It
+    is a lower bound: the latency of the first spike diverges at the
+    bifurcation, so a pulse of finite duration needs a little more current
+    (see RheobaseTestP, which searches above it).  The time
+    constant is that of an exponential fitted (as by TimeConstantTest) to the
+    linearized response to the test current.
+
+    Args:
+        name (str): one of 'rheobase', 'resting_potential',
+            'input_resistance' or 'time_constant'.
+        current (dict): the square current of the test, with 'amplitude'
+            and 'duration' (needed for the passive properties).
+
+    Returns:
+        quantities.Quantity: the property, or None if it has no closed form
+            for these parameters (e.g. the model is not at rest).
+    """
+    attrs = get_izhikevich_attrs(**attrs)
+    C, k, a, b = attrs['C'], attrs['k'], attrs['a'], attrs['b']
+    delta = attrs['vt'] - attrs['vr']
+    g = k*delta + b  # Steady state conductance at rest (nS)
+    if g <= 0:
+        return None  # Rest is unstable
+    if name == 'resting_potential':
+        return attrs['vr']*qt.mV
+    if name == 'rheobase':
+        if b > 0:
+            # The step response overshoots the steady state, so spikes may
+            # start below the bifurcation.
+            return None
+        return (g**2/(4*k))*qt.pA
+    amplitude = float(current['amplitude'].rescale(qt.pA))
+    if name == 'input_resistance':
+        if amplitude == 0:
+            return (1000.0/g)*qt.MOhm
+        disc = g**2 - 4*k*amplitude
+        if disc < 0:
+            return None  # No steady state: the cell spikes
+        x = (g - np.sqrt(disc))/(2*k)
+        return (1000.0*x/amplitude)*qt.MOhm
+    if name == 'time_constant':
+        from neuronunit.tests.passive import fit_exponentials
+        disc = g**2 - 4*k*amplitude
+        if disc < 0:
+            return None
+        # Linearization of (x, u) with the chord conductance between rest
+        # and the steady state reached for the test current (the slope
+        # halfway), so that the steady state is exact; driven by unit current.
+        x = (g - np.sqrt(disc))/(4*k)
+        jac = np.array([[-k*(delta-2*x)/C, -1.0/C], [a*b, -a]])
+        x_ss = -np.linalg.solve(jac, [1.0/C, 0.0])
+        lam, vecs = np.linalg.eig(jac)
+        coefs = np.linalg.solve(vecs, x_ss)
+        duration = float(current['duration'].rescale(qt.ms))
+        t = np.arange(0, duration-1, 0.1)
+        x = x_ss[0] - np.real((vecs[0]*coefs*np.exp(np.outer(t, lam))).sum(1))
+        _, tau, _ = fit_exponentials(t, x)
+        return tau[0]*qt.ms
+    raise KeyError("No analytic property '%s'" % name)
 
 
 class RAWBackend(Backend):
 
+    # Repeated simulations with the same parameters give the same result
+    stochastic = False
+
+    # Bound on |v| (mV) beyond which the model is deemed unstable, and the
+    # integration stopped
+    divergence_bound = 1000.0
+
+    # With settle detection on, the state is held once |dv/dt| stays below
+    # settle_tolerance (mV/ms) for settle_window (ms); see set_settle
+    settle_tolerance = 1e-5
+    settle_window = 5.0
+
+    # Integration time step (ms); see set_time_step
+    time_step = 0.025
+
+    # Properties of the model which get_analytic_property can compute
+    analytic_properties = ('rheobase', 'resting_potential',
+                           'input_resistance', 'time_constant')
+
     def init_backend(self, attrs = None, cell_name = 'alice', current_src_name = 'hannah', DTC = None):
         backend = 'RAW'
         super(RAWBackend,self).init_backend()
@@ -54,6 +205,8 @@ class RAWBackend(Backend):
         self.current_src_name = current_src_name
         self.cell_name = cell_name
         self.vM = None
+        self.unstable = False
+        self.settle_windows = None
         self.attrs = attrs
 
         self.temp_attrs = None
@@ -87,12 +240,29 @@ class RAWBackend(Backend):
         """Must return a neo.core.AnalogSignal.
         And must destroy the hoc vectors that comprise it.
         """
-        return self.vM
+        return self.vM.to_analog_signal()
+
+    def set_time_step(self, dt=0.025*pq.ms):
+        """Set the integration time step; unitless values are in ms."""
+        self.time_step = float(dt.rescale(pq.ms)) if hasattr(dt, 'rescale') \
+            else float(dt)
 
     def set_attrs(self, **attrs):
 
         self.model.attrs.update(attrs)
 
+    def get_analytic_property(self, name, current=None):
+        return get_analytic_property(name, current, **self.model.attrs)
+
+    def set_settle(self, windows=None):
+        """Turn settle detection on for the windows of the trace needed.
+
+        Once the model settles (see get_vm) its state is held until the
+        current changes, and the trace ends after the last (start, stop)
+        window.  None turns settle detection off.
+        """
+        self.settle_windows = windows
+
 
     def inject_square_current(self, current):#, section = None, debug=False):
         """Inputs: current : a dictionary with exactly three items, whose keys are: 'amplitude', 'delay', 'duration'
@@ -108,32 +278,70 @@ class RAWBackend(Backend):
             c = current['injected_square_current']
         else:
             c = current
-        amplitude = float(c['amplitude'])
-        duration = float(c['duration'])#/dt#/dt.rescale('ms')
-        delay = float(c['delay'])#/dt#.rescale('ms')
+        Iext, dt = self.get_square_currents([c['amplitude']], c['delay'],
+                                            c['duration'])
+        if self.settle_windows is not None:
+            Iext = Iext[:, :get_windows_stop(self.settle_windows, dt)]
+            attrs['settleTol'] = self.settle_tolerance
+            attrs['settleSteps'] = int(self.settle_window/dt)
+        onset = get_onset(Iext)
+        attrs['Iext'] = Iext[0, onset:]
+        attrs['dt'] = dt
+        attrs['vBound'] = self.divergence_bound
+        vr = get_izhikevich_attrs(**attrs)['vr']
+        v = np.concatenate([np.full(onset, vr), get_vm(**attrs)])
+        self.unstable = not np.isfinite(v[-1])
+        self.vM = Trace(v, dt, units='mV')
+
+        return self.vM
+
+    def get_square_currents(self, amplitudes, delay, duration):
+        """Sample square currents (one row per amplitude) for get_vm.
+
+        Unitless values are taken to be in pA and ms.
+        """
+        def magnitude(x, units):
+            return float(x.rescale(units)) if hasattr(x, 'rescale') \
+                else float(x)
+        duration = magnitude(duration, pq.ms)
+        delay = magnitude(delay, pq.ms)
         tMax = delay + duration + 200.0#/dt#*pq.ms
         self.set_stop_time(tMax*pq.ms)
         tMax = self.tstop
 
-        dt = 0.025
+        dt = self.time_step
         N = int(tMax/dt)
-        Iext = np.zeros(N)
+        Iext = np.zeros((len(amplitudes), N))
         delay_ind = int((delay/tMax)*N)
         duration_ind = int((duration/tMax)*N)
 
-        Iext[0:delay_ind-1] = 0.0
-        Iext[delay_ind:delay_ind+duration_ind-1] = amplitude
-        Iext[delay_ind+duration_ind::] = 0.0
+        for i, amplitude in enumerate(amplitudes):
+            Iext[i, delay_ind:delay_ind+duration_ind-1] = \
+                magnitude(amplitude, pq.pA)
+        return Iext, dt
 
-        attrs['Iext'] = Iext
-        attrs['dt'] = dt
-        self.vM  = get_vm(**attrs)
+    def inject_square_current_sweep(self, amplitudes, delay, duration):
+        """Integrate the responses to all amplitudes together.
 
-        return self.vM
+        Returns the membrane potential (V) as an AnalogSignal with one column
+        per amplitude; the columns of unstable responses end in NaN.
+        """
+        attrs = get_izhikevich_attrs(**self.model.attrs)
+        Iext, dt = self.get_square_currents(amplitudes, delay, duration)
+        onset = get_onset(Iext)
+        v = np.empty(Iext.shape)
+        v[:, :onset] = attrs['vr']
+        v[:, onset:] = get_vm_sweep(attrs['C'], attrs['a'], attrs['b'],
+                                    attrs['c'], attrs['d'], attrs['k'],
+                                    attrs['vPeak'], attrs['vr'], attrs['vt'],
+                                    dt, Iext[:, onset:],
+                                    self.divergence_bound)
+        return AnalogSignal(v.T/1000.0, units=pq.V, sampling_period=dt*ms)
 
     def _backend_run(self):
         results = {}
         results['vm'] = self.vM
-        results['t'] = self.vM.times
+        results['t'] = self.vM.get_times('s')
         results['run_number'] = results.get('run_number',0) + 1
+        results['unstable'] = self.unstable
         return results
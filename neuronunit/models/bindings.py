@@ -9,7 +9,6 @@ import numpy as np
 import quantities as pq
 import matplotlib.pyplot as plt
 
-from elephant.spike_train_generation import threshold_detection
 from neo import AnalogSignal
 try:
     from pyNN.neuron import HH_cond_exp
@@ -155,13 +154,13 @@ def bind_NU_interface(model):
     def get_spike_train(self,**run_params):
         vm = self.get_membrane_potential()
 
-        spike_train = threshold_detection(vm,threshold=-45.0*pq.mV)
+        spike_train = sf.get_spike_train(vm,threshold=-45.0*pq.mV)
 
         return spike_train
 
     def get_spike_count(self,**run_params):
         vm = self.get_membrane_potential()
-        return len(threshold_detection(vm,threshold=-45.0*pq.mV))
+        return sf.get_spike_count(vm,threshold=-45.0*pq.mV)
 
     model.init_backend = MethodType(init_backend,model)
     model.get_spike_count = MethodType(get_spike_count,model)
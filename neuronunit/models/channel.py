@@ -5,10 +5,15 @@ import re
 
 import neuronunit.capabilities.channel as cap
 from .lems import LEMSModel
+from .reduced import freeze
 from pyneuroml.analysis import NML2ChannelAnalysis as ca
 import quantities as pq
 
 
+# IV data of channel analysis runs, by channel, attributes and parameters
+_iv_curves = {}
+
+
 class ChannelModel(LEMSModel, cap.NML2ChannelAnalysis):
     """A model for ion channels"""
 
@@ -81,6 +86,22 @@ class ChannelModel(LEMSModel, cap.NML2ChannelAnalysis):
         self.iv_data['hold_v'] = (iv_data['hold_v'] * pq.V).rescale(pq.mV)
         return self.iv_data
 
+    def ca_get_iv_curve(self, **params):
+        """Get the IV data of the voltage step protocol with these params.
+
+        The protocol is run once per channel and distinct params; other
+        calls (e.g. from the peak and steady state IV curve tests) reuse
+        its IV data.
+        """
+        key = freeze((self.orig_lems_file_path, self.channel.id, self.attrs,
+                      params))
+        if key not in _iv_curves:
+            self.ca_make_lems_file(**params)
+            results = self.ca_run_lems_file(verbose=True)
+            _iv_curves[key] = self.ca_compute_iv_curve(results)
+        self.iv_data = _iv_curves[key]
+        return self.iv_data
+
     def plot_iv_curve(self, v, i, *plt_args, **plt_kwargs):
         ca.plot_iv_curve(self.a, v, i, *plt_args, **plt_kwargs)
 
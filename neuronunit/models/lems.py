@@ -19,6 +19,18 @@ from sciunit.utils import TemporaryDirectory
 from sciunit.models.runnable import RunnableModel
 
 
+def get_includes(tree):
+    """Get the NeuroML file paths a LEMS (or NeuroML) tree includes, as
+    written in it (i.e. relative to its file)."""
+    nml_paths = []
+    for atrb in ['file', 'href']:
+        for tag in ['Include', 'include']:
+            match = "*[contains(@%s, '.nml')][name() = '%s']" % (atrb, tag)
+            elements = tree.xpath(match)
+            nml_paths += [x.attrib[atrb] for x in elements]
+    return nml_paths
+
+
 class LEMSModel(RunnableModel):
     """A generic LEMS model."""
 
@@ -84,12 +96,7 @@ class LEMSModel(RunnableModel):
         """Get all NeuroML file paths associated with the model."""
         if not lems_tree:
             lems_tree = etree.parse(self.lems_file_path)
-        nml_paths = []
-        for atrb in ['file', 'href']:
-            for tag in ['Include', 'include']:
-                match = "*[contains(@%s, '.nml')][name() = '%s']" % (atrb, tag)
-                elements = lems_tree.xpath(match)
-                nml_paths += [x.attrib[atrb] for x in elements]
+        nml_paths = get_includes(lems_tree)
         if absolute:  # Turn into absolute paths
             lems_file_path = self.orig_lems_file_path if original \
                                                       else self.lems_file_path
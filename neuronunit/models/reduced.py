@@ -10,9 +10,22 @@ from .static import ExternalModel
 import neuronunit.capabilities.spike_functions as sf
 
 
+def freeze(value):
+    """A hashable, exact stand-in for attributes and run parameters."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, pq.Quantity):
+        return (tuple(np.ravel(value.magnitude).tolist()),
+                value.dimensionality.string)
+    return repr(value)
+
+
 class ReducedModel(LEMSModel,
                    cap.ReceivesSquareCurrent,
                    cap.ProducesActionPotentials,
+                   cap.ProvidesAnalyticProperties,
                    ):
     """Base class for reduced models, using LEMS"""
 
@@ -23,20 +36,74 @@ class ReducedModel(LEMSModel,
         name: Optional model name.
         """
 
+        # Number of runs simulated, and of those answered by the last one
+        self.run_counts = {'simulated': 0, 'reused': 0}
+        # Total duration (ms) of the simulated runs
+        self.simulated_ms = 0.0
+        # Whether any run with the current attributes diverged
+        self.unstable = False
+        self.invalidate_run()
         super(ReducedModel, self).__init__(LEMS_file_path, name=name,
                                            backend=backend, attrs=attrs)
         self.run_number = 0
         self.tstop = None
 
-    def get_membrane_potential(self, **run_params):
+    def invalidate_run(self):
+        """Forget the last run, so that the next one is simulated."""
+        self._run_key = None
+        self._trace = None
+        self._vm = None
+
+    def get_run_key(self):
+        return freeze((self.attrs, self.run_params))
+
+    def run(self, **run_params):
+        """Run the model, unless the last run had the same attributes and
+        run parameters (and no current was injected since): capability
+        calls chained on one protocol share a single simulation."""
+        self.use_default_run_params()
+        self.set_run_params(**run_params)
+        key = self.get_run_key()
+        if key == self._run_key:
+            self.run_counts['reused'] += 1
+            return
+        super(ReducedModel, self).run()
+        self._run_key = key
+        self._trace = None
+        self._vm = None
+        self.run_counts['simulated'] += 1
+        if isinstance(self.results, dict) and self.results.get('unstable'):
+            self.unstable = True
+        t = self.results.get('t') if isinstance(self.results, dict) else None
+        if t is not None and len(t):
+            self.simulated_ms += float(t[-1] - t[0])*1000.0  # t is in s
+
+    def set_attrs(self, **attrs):
+        self.invalidate_run()
+        self.unstable = False
+        super(ReducedModel, self).set_attrs(**attrs)
+
+    def get_trace(self, **run_params):
+        """Get the membrane potential (V) as a Trace, for use internally."""
         self.run(**run_params)
+        if self._trace is not None:
+            return self._trace
+        if isinstance(self.results.get('vm'), cap.Trace):
+            self._trace = self.results['vm'].rescale('V')
+            return self._trace
         for rkey in self.results.keys():
             if 'v' in rkey or 'vm' in rkey:
                 v = np.array(self.results[rkey])
         t = np.array(self.results['t'])
-        dt = (t[1]-t[0])*pq.s  # Time per sample in seconds.
-        vm = AnalogSignal(v, units=pq.V, sampling_rate=1.0/dt)
-        return vm
+        dt = (t[1]-t[0])*1000.0  # Time per sample in ms.
+        self._trace = cap.Trace(v, dt, units='V')
+        return self._trace
+
+    def get_membrane_potential(self, **run_params):
+        trace = self.get_trace(**run_params)
+        if self._vm is None:
+            self._vm = trace.to_analog_signal()
+        return self._vm
 
     def get_APs(self, **run_params):
         vm = self.get_membrane_potential(**run_params)
@@ -48,13 +115,31 @@ class ReducedModel(LEMSModel,
         spike_train = sf.get_spike_train(vm)
         return spike_train
 
+    def get_spike_count(self, **run_params):
+        return sf.get_spike_count(self.get_trace(**run_params))
+
     def inject_square_current(self, current):
         assert isinstance(current, dict)
         assert all(x in current for x in
                    ['amplitude', 'delay', 'duration'])
+        self.invalidate_run()
         self.set_run_params(injected_square_current=current)
         self._backend.inject_square_current(current)
 
+    def inject_square_current_sweep(self, amplitudes, delay, duration):
+        # Use the backend's batched implementation when it has one
+        if hasattr(self._backend, 'inject_square_current_sweep'):
+            return self._backend.inject_square_current_sweep(amplitudes,
+                                                             delay, duration)
+        return super(ReducedModel, self).inject_square_current_sweep(
+            amplitudes, delay, duration)
+
+    def get_analytic_property(self, name, current=None):
+        # Backends list the properties they can compute in closed form
+        if name not in getattr(self._backend, 'analytic_properties', ()):
+            return None
+        return self._backend.get_analytic_property(name, current)
+
 
 class VeryReducedModel(ExternalModel,
                    cap.ReceivesCurrent,
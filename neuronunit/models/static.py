@@ -12,6 +12,9 @@ class StaticModel(sciunit.Model,
                   cap.ProducesMembranePotential):
     """A model which produces a frozen membrane potential waveform."""
 
+    # The same waveform is produced every time
+    stochastic = False
+
     def __init__(self, vm):
         """Create an instace of a model that produces a static waveform.
 
@@ -30,6 +30,7 @@ import numpy
 
 import copy
 from neuronunit.optimization import optimization_management as om
+from neuronunit.optimization.profiling import profiler
 
 import pdb
 import math
@@ -74,6 +75,9 @@ def _update_history_and_hof(halloffame,pf, history, population,td):
 def _record_stats(stats, logbook, gen, population, invalid_count):
     '''Update the statistics with the new population'''
     record = stats.compile(population) if stats is not None else {}
+    if profiler.enabled:
+        # The stage totals of the generation, as a logbook chapter
+        record['profile'] = profiler.pop_totals()
     logbook.record(gen=gen, nevals=invalid_count, **record)
 
 def gene_bad(offspring):
@@ -204,3 +208,65 @@ def eaAlphaMuPlusLambdaCheckpoint(
 
 
     return population, halloffame, pf, logbook, history, gen_vs_pop
+
+
+def eaGenerateUpdateCheckpoint(
+        strategy,
+        toolbox,
+        ngen,
+        stats = None,
+        halloffame = None,
+        pf = None,
+        cp_frequency = 1,
+        cp_filename = None,
+        continue_cp = False,
+        td = None):
+    '''Evolve with an ask/tell strategy (e.g. a cmaes.CMAStrategy), which
+    generates each generation whole, for toolbox.evaluate to evaluate in
+    one batch; until ngen generations, or until the strategy stops.
+
+    toolbox.evaluate must return the individuals given, in order (e.g.
+    update_deap_pop with replace_lost=False), for the strategy to learn from.
+    '''
+    gen_vs_pop = []
+
+    if continue_cp:
+        cp = pickle.load(open(cp_filename, "rb"))
+        strategy = cp["strategy"]
+        start_gen = cp["generation"] + 1
+        halloffame = cp["halloffame"]
+        logbook = cp["logbook"]
+        history = cp["history"]
+        population = cp["population"]
+    else:
+        start_gen = 1
+        logbook = deap.tools.Logbook()
+        logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+        history = deap.tools.History()
+        population = []
+
+    for gen in range(start_gen, ngen + 1):
+        if strategy.stopped:
+            break
+        asked = strategy.ask()
+        population = _evaluate_invalid_fitness(toolbox, asked)
+        assert len(population) == len(asked)
+        strategy.tell(population)
+        gen_vs_pop.append(population)
+
+        halloffame, pf = _update_history_and_hof(halloffame, pf, history, population, td)
+        _record_stats(stats, logbook, gen, population, len(population))
+        logger.info(logbook.stream)
+
+        if(cp_filename and cp_frequency and
+           gen % cp_frequency == 0):
+            cp = dict(population=population,
+                      generation=gen,
+                      strategy=strategy,
+                      halloffame=halloffame,
+                      history=history,
+                      logbook=logbook)
+            pickle.dump(cp, open(cp_filename, "wb"))
+            logger.debug('Wrote checkpoint to %s', cp_filename)
+
+    return population, halloffame, pf, logbook, history, gen_vs_pop
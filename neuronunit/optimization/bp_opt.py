@@ -33,6 +33,7 @@ import deap.algorithms
 import deap.tools
 
 from . import algorithms
+from . import cmaes
 from bluepyopt.deapext.optimisations import tools
 
 import numpy
@@ -113,6 +114,10 @@ class WSFloatIndividual(float):
     def set_fitness(self,obj_size):
         self.fitness = WeightedSumFitness(obj_size=obj_size)
 
+# The strategies of SciUnitOptimization, besides 'ga'
+STRATEGIES = {'ga': None, 'cma': cmaes.CMAStrategy,
+              'bipop': cmaes.BIPOPStrategy}
+
 import bluepyopt.optimisations
 class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
     
@@ -129,8 +134,21 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
                  map_function=None,
                  backend=None,
                  nparams = 10,
-                 provided_dict= {}):
-        """Constructor"""
+                 provided_dict= {},
+                 executor=None,
+                 hc=None,
+                 strategy='ga'):
+        """Constructor
+
+        executor maps the evaluations (see executors.get_executor).
+        hc: Parameters held constant (see update_deap_pop).
+        strategy: 'ga' for the genetic algorithm, or an ask/tell evolution
+        strategy, of population size offspring_size (None for its default):
+        'cma' for CMA-ES, or 'bipop' for CMA-ES with BIPOP restarts (see
+        cmaes).
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError("strategy must be one of %s" % list(STRATEGIES))
 
         super(SciUnitOptimization, self).__init__()
         self.selection = selection
@@ -144,6 +162,9 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
         self.cxpb = cxpb
         self.mutpb = mutpb
         self.backend = backend
+        self.executor = executor
+        self.hc = hc
+        self.strategy = strategy
         # Create a DEAP toolbox
         self.toolbox = deap.base.Toolbox()
         self.setnparams(nparams = nparams, provided_dict = provided_dict)
@@ -161,7 +182,7 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
         return mps, tl
 
     def setnparams(self, nparams = 10, provided_dict = None):
-        self.params = optimization_management.create_subset(nparams = nparams,provided_dict = provided_dict)
+        self.params = optimization_management.create_subset(nparams = nparams,boundary_dict = provided_dict)
         self.nparams = len(self.params)
         self.params , self.td = self.transdict(self.params)
         return self.params, self.td
@@ -222,7 +243,7 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
                     LOWER[index]-=2.0
                     i+=2.0
 
-        self.grid_init = self.grid_sample_init(self.params)#(LOWER, UPPER, self.offspring_size)
+        self.bounds = (LOWER, UPPER)
 
         def uniform_params(lower_list, upper_list, dimensions):
             if hasattr(lower_list, '__iter__'):
@@ -258,11 +279,14 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
                     for gene in p:
                         gene = np.log(gene)
 
+            # Ask/tell strategies must be told of the individuals they
+            # generated, rather than of replacements for those lost
+            replace_lost = self.strategy == 'ga'
             if self.backend is None:
-                invalid_pop = update_deap_pop(invalid_ind, self.error_criterion, td = self.td)
+                invalid_pop = update_deap_pop(invalid_ind, self.error_criterion, td = self.td, hc = self.hc, executor = self.executor, replace_lost = replace_lost)
             else:
                 
-                invalid_pop = update_deap_pop(invalid_ind, self.error_criterion, td = self.td, backend = self.backend)
+                invalid_pop = update_deap_pop(invalid_ind, self.error_criterion, td = self.td, backend = self.backend, hc = self.hc, executor = self.executor, replace_lost = replace_lost)
             assert len(invalid_pop) != 0
             invalid_dtc = [ i.dtc for i in invalid_pop if hasattr(i,'dtc') ]
             fitnesses = list(map(evaluate, invalid_dtc))
@@ -295,6 +319,7 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
     def set_pop(self):
         IND_SIZE = len(list(self.params.values()))
         OBJ_SIZE = len(self.error_criterion)
+        self.grid_init = self.grid_sample_init(self.params)
         if IND_SIZE == 1:
             # I changed this too.
             pop = [ WSFloatIndividual(g,obj_size=OBJ_SIZE) for g in self.grid_init ]
@@ -302,6 +327,16 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
             pop = [ WSListIndividual(g, obj_size=OBJ_SIZE) for g in self.grid_init ]
         return pop
 
+    def get_strategy(self, offspring_size=None):
+        """The ask/tell evolution strategy (see cmaes) of self.strategy,
+        over the bounds of the parameters."""
+        LOWER, UPPER = self.bounds
+        ind_init = functools.partial(WSListIndividual,
+                                     obj_size=len(self.error_criterion))
+        return STRATEGIES[self.strategy](LOWER, UPPER, ind_init=ind_init,
+                                         lambda_=offspring_size,
+                                         seed=self.seed)
+
     def run(self,
             max_ngen=25,
             offspring_size=None,
@@ -315,32 +350,46 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
         if offspring_size is None:
             offspring_size = self.offspring_size
 
-        pop = self.toolbox.population(n=offspring_size)
-        pop = self.set_pop()
-        hof = deap.tools.HallOfFame(offspring_size)
-        pf = deap.tools.ParetoFront(offspring_size)
-
         stats = deap.tools.Statistics(key=lambda ind: ind.fitness.sum)
         stats.register("avg", numpy.mean)
         stats.register("std", numpy.std)
         stats.register("min", numpy.min)
         stats.register("max", numpy.max)
-        pop, hof, pf, log, history, gen_vs_pop = algorithms.eaAlphaMuPlusLambdaCheckpoint(
-            pop,
-            self.toolbox,
-            offspring_size,
-            self.cxpb,
-            self.mutpb,
-            max_ngen,
-            stats=stats,
-            halloffame=hof,
-            pf=pf,
-            nelite=self.elite_size,
-            cp_frequency=cp_frequency,
-            continue_cp=continue_cp,
-            cp_filename=cp_filename,
-            selection = self.selection,
-            td = self.td)
+        if self.strategy != 'ga':
+            strategy = self.get_strategy(offspring_size)
+            hof = deap.tools.HallOfFame(strategy.lambda_)
+            pf = deap.tools.ParetoFront()
+            pop, hof, pf, log, history, gen_vs_pop = algorithms.eaGenerateUpdateCheckpoint(
+                strategy,
+                self.toolbox,
+                max_ngen,
+                stats=stats,
+                halloffame=hof,
+                pf=pf,
+                cp_frequency=cp_frequency,
+                continue_cp=continue_cp,
+                cp_filename=cp_filename,
+                td = self.td)
+        else:
+            pop = self.set_pop()
+            hof = deap.tools.HallOfFame(offspring_size)
+            pf = deap.tools.ParetoFront(offspring_size)
+            pop, hof, pf, log, history, gen_vs_pop = algorithms.eaAlphaMuPlusLambdaCheckpoint(
+                pop,
+                self.toolbox,
+                offspring_size,
+                self.cxpb,
+                self.mutpb,
+                max_ngen,
+                stats=stats,
+                halloffame=hof,
+                pf=pf,
+                nelite=self.elite_size,
+                cp_frequency=cp_frequency,
+                continue_cp=continue_cp,
+                cp_filename=cp_filename,
+                selection = self.selection,
+                td = self.td)
 
         # insert the initial HOF value back in.
         td = self.td
@@ -0,0 +1,194 @@
+"""Covariance matrix adaptation evolution strategies (CMA-ES), with an
+ask/tell interface, so that each generation is generated whole and
+evaluated in one batch (e.g. by update_deap_pop; see
+algorithms.eaGenerateUpdateCheckpoint):
+
+    strategy = BIPOPStrategy(lower, upper, ind_init=Individual, seed=1)
+    while not strategy.stopped:
+        population = strategy.ask()
+        ...  # set the fitness of each individual
+        strategy.tell(population)
+
+Individuals are ranked by the weighted sum of their fitness values.  The
+parameters are searched in coordinates scaled to [0, 1] over their bounds,
+so that a single step size (sigma) suits them all, and the individuals
+asked (and told) are clipped to the bounds.
+
+CMAStrategy is one run of CMA-ES (deap.cma.Strategy).  BIPOPStrategy
+restarts it once it stops, from random points, alternating between runs of
+increasing population size and runs of small populations and step sizes
+(Hansen 2009, Benchmarking a BI-population CMA-ES on the BBOB-2009 function
+testbed).
+"""
+
+import math
+
+import numpy as np
+from deap import cma
+
+
+def get_score(ind):
+    """The weighted sum of the fitness values of an individual (the higher,
+    the better)."""
+    return sum(ind.fitness.wvalues)
+
+
+class _Point(list):
+    # The scaled coordinates of an individual, with its score as fitness,
+    # for deap.cma.Strategy.update
+    def __init__(self, values, fitness):
+        super(_Point, self).__init__(values)
+        self.fitness = fitness
+
+
+class CMAStrategy(object):
+    """A run of CMA-ES over parameters bounded by lower and upper.
+
+    ind_init: Makes an individual from a list of parameter values.
+    lambda_: Population size; by default 4 + 3 ln(n) for n parameters.
+    sigma: Initial step size, as a fraction of the bounds.
+    centroid: Initial mean; by default the middle of the bounds.
+    seed: Of the random numbers, unless random (a numpy RandomState) is
+        given.
+    tolfun: The run stops once the best scores of its last 10 + 30 n/lambda
+        generations range less than tolfun, ...
+    tolx: ... or once the step size (of the scaled coordinates) is below
+        tolx, or the covariance matrix is ill conditioned.
+    """
+
+    max_condition = 1e14
+
+    def __init__(self, lower, upper, ind_init=list, lambda_=None, sigma=0.3,
+                 centroid=None, seed=None, random=None, tolfun=1e-6,
+                 tolx=1e-8):
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        # Parameters without a range are held at their lower bound
+        self.span = np.clip(self.upper - self.lower, 0, None)
+        self.ind_init = ind_init
+        self.random = random if random is not None else \
+            np.random.RandomState(seed)
+        self.tolfun = tolfun
+        self.tolx = tolx
+        if centroid is None:
+            centroid = 0.5*np.ones(len(self.lower))
+        else:
+            centroid = self.to_unit(centroid)
+        params = {} if lambda_ is None else {'lambda_': int(lambda_)}
+        self.strategy = cma.Strategy(centroid=centroid, sigma=sigma, **params)
+        # The best score of each generation told
+        self.best_scores = []
+        self.evaluations = 0
+
+    @property
+    def lambda_(self):
+        return self.strategy.lambda_
+
+    def to_unit(self, values):
+        # Clipped, so that individuals out of bounds cannot move the mean
+        # out of them, nor stretch the covariances
+        span = np.where(self.span > 0, self.span, 1.0)
+        return np.clip((np.asarray(values, dtype=float) - self.lower)/span,
+                       0, 1)
+
+    def from_unit(self, x):
+        return self.lower + np.clip(x, 0, 1)*self.span
+
+    def ask(self):
+        """A population of lambda_ individuals."""
+        s = self.strategy
+        z = self.random.standard_normal((s.lambda_, s.dim))
+        xs = s.centroid + s.sigma*np.dot(z, s.BD.T)
+        return [self.ind_init(list(self.from_unit(x))) for x in xs]
+
+    def tell(self, population):
+        """Update the strategy from the individuals asked, evaluated."""
+        points = [_Point(self.to_unit(ind), get_score(ind))
+                  for ind in population]
+        self.strategy.update(points)
+        self.evaluations += len(points)
+        self.best_scores.append(max(point.fitness for point in points))
+
+    @property
+    def stopped(self):
+        s = self.strategy
+        n = 10 + int(math.ceil(30.0*s.dim/s.lambda_))
+        if len(self.best_scores) >= n and \
+                np.ptp(self.best_scores[-n:]) < self.tolfun:
+            return True
+        if s.sigma*max(np.max(np.abs(s.pc)), np.max(s.diagD)) < self.tolx:
+            return True
+        return not s.cond < self.max_condition
+
+    @property
+    def best_score(self):
+        return max(self.best_scores) if self.best_scores else -np.inf
+
+
+class BIPOPStrategy(object):
+    """CMA-ES restarted, once a run stops, at most max_restarts times.
+
+    The first run has the default population size.  Each further run is
+    from a random point, of the regime (of the two) which has used fewer
+    evaluations: 'large' runs double the population size of the last, with
+    the initial step size; 'small' runs have populations of between the
+    default size and half the last large one, and smaller step sizes.
+
+    Other arguments are those of CMAStrategy.
+    """
+
+    def __init__(self, lower, upper, ind_init=list, lambda_=None, sigma=0.3,
+                 centroid=None, seed=None, random=None, max_restarts=9,
+                 **kwargs):
+        self.random = random if random is not None else \
+            np.random.RandomState(seed)
+        self.kwargs = dict(kwargs, ind_init=ind_init, random=self.random)
+        self.lower = lower
+        self.upper = upper
+        self.sigma = sigma
+        self.max_restarts = max_restarts
+        self.run = CMAStrategy(lower, upper, lambda_=lambda_, sigma=sigma,
+                               centroid=centroid, **self.kwargs)
+        self.default_lambda = self.run.lambda_
+        self.restarts = 0
+        self.large_restarts = 0
+        self.regime = 'large'
+        self.evaluations = {'large': 0, 'small': 0}
+        self.best_score = -np.inf
+
+    @property
+    def lambda_(self):
+        return self.run.lambda_
+
+    def restart(self):
+        self.best_score = max(self.best_score, self.run.best_score)
+        self.restarts += 1
+        large_lambda = self.default_lambda*2**self.large_restarts
+        if self.evaluations['large'] <= self.evaluations['small'] or \
+                self.restarts == 1:
+            self.regime = 'large'
+            self.large_restarts += 1
+            lambda_ = self.default_lambda*2**self.large_restarts
+            sigma = self.sigma
+        else:
+            self.regime = 'small'
+            ratio = 0.5*large_lambda/self.default_lambda
+            lambda_ = int(self.default_lambda*ratio**(self.random.uniform()**2))
+            sigma = self.sigma*10**(-2*self.random.uniform())
+        centroid = self.run.from_unit(self.random.uniform(
+            size=len(self.run.lower)))
+        self.run = CMAStrategy(self.lower, self.upper, lambda_=lambda_,
+                               sigma=sigma, centroid=centroid, **self.kwargs)
+
+    def ask(self):
+        if self.run.stopped and self.restarts < self.max_restarts:
+            self.restart()
+        return self.run.ask()
+
+    def tell(self, population):
+        self.run.tell(population)
+        self.evaluations[self.regime] += len(population)
+
+    @property
+    def stopped(self):
+        return self.run.stopped and self.restarts >= self.max_restarts
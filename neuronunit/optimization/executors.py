@@ -0,0 +1,176 @@
+"""Executors, which map the work of the optimization and of the parallel
+rheobase search over processes, or machines.
+
+    SerialExecutor       In this process (e.g. for debugging).
+    BagExecutor          A dask.bag, with dask's scheduler (multiprocessing,
+                         by default); the default executor.
+    DistributedExecutor  A dask.distributed Client, e.g. of a LocalCluster
+                         or of a cluster of several nodes.
+
+An executor is chosen for a block of code with use_executor, or for the
+process with set_executor, e.g.
+
+    from dask.distributed import Client, LocalCluster
+    client = Client(LocalCluster(n_workers=4, threads_per_worker=1))
+    with use_executor(DistributedExecutor(client)):
+        pop = update_deap_pop(pop, tests, td)
+
+or passed to update_deap_pop, run_simple_grid, SciUnitOptimization, run_ga
+and RheobaseTestP (as its executor attribute).
+
+Objects that every task needs (e.g. the tests) are scattered once per map,
+and passed to the function mapped as keyword arguments, rather than pickled
+along with each item.
+"""
+
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+import dask
+import dask.bag as db
+
+N_CPUS = multiprocessing.cpu_count()
+
+# The dask schedulers which compute in this process
+IN_PROCESS_SCHEDULERS = ('synchronous', 'sync', 'single-threaded', 'threads',
+                         'threading')
+
+
+class SerialExecutor(object):
+    """Maps in this process."""
+
+    # Whether items are separate tasks, which idle workers take from busy
+    # ones: if so, uneven work (e.g. rheobase searches) is best mapped whole
+    work_stealing = False
+
+    # Whether items and results are pickled, to be sent between processes
+    serializes = False
+
+    @property
+    def width(self):
+        """The number of items mapped at once."""
+        return 1
+
+    def scatter(self, obj):
+        """A handle to obj for the keyword arguments of map."""
+        return obj
+
+    def map(self, func, items, **kwargs):
+        """[func(item, **kwargs) for item in items]"""
+        return [func(item, **kwargs) for item in items]
+
+
+class BagExecutor(SerialExecutor):
+    """Maps with a dask.bag of npartitions (at most one per item; by default
+    one per CPU), computed by scheduler (by default dask's configured one).
+    Nested bags don't work, so work mapped in the partitions is serial."""
+
+    def __init__(self, npartitions=None, scheduler=None):
+        self.npartitions = npartitions
+        self.scheduler = scheduler
+
+    @property
+    def width(self):
+        return self.npartitions or N_CPUS
+
+    @property
+    def serializes(self):
+        # Bags are computed with processes unless configured otherwise
+        scheduler = self.scheduler or dask.config.get('scheduler',
+                                                      'processes')
+        return scheduler not in IN_PROCESS_SCHEDULERS
+
+    def map(self, func, items, **kwargs):
+        items = list(items)
+        if not items:
+            return []
+        bag = db.from_sequence(items, npartitions=min(self.width,
+                                                      len(items)))
+        return bag.map(in_worker(func), **kwargs).compute(
+            scheduler=self.scheduler)
+
+
+class DistributedExecutor(SerialExecutor):
+    """Maps with a dask.distributed Client, one task per item, so that the
+    scheduler's work stealing balances uneven tasks over the workers.  Work
+    mapped within the tasks is serial.
+
+    Keyword arguments of map are sent to the function of each task, so must
+    not be named as those of Client.map (e.g. key, workers or pure).
+    """
+
+    work_stealing = True
+    serializes = True
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def width(self):
+        return sum(self.client.nthreads().values())
+
+    def scatter(self, obj):
+        # In a list, so that lists (e.g. of tests) are scattered whole
+        return self.client.scatter([obj], broadcast=True, hash=False)[0]
+
+    def map(self, func, items, **kwargs):
+        futures = self.client.map(in_worker(func), list(items), pure=False,
+                                  **kwargs)
+        return self.client.gather(futures)
+
+
+class in_worker(object):
+    """Wrap a function to run with a SerialExecutor, e.g. in the partitions
+    of a BagExecutor, or the workers of a DistributedExecutor.  A class, so
+    that it is pickled as a reference to the function."""
+
+    def __init__(self, func):
+        self.func = func
+        wraps(func)(self)
+
+    def __call__(self, *args, **kwargs):
+        with use_executor(SerialExecutor()):
+            return self.func(*args, **kwargs)
+
+
+# The executor used where none is given, or set with use_executor; None for
+# a BagExecutor
+default_executor = None
+
+_local = threading.local()
+
+
+def get_executor(executor=None):
+    """The executor given, else the one in use (see use_executor), else
+    the default one."""
+    if executor is not None:
+        return executor
+    stack = getattr(_local, 'executors', None)
+    if stack:
+        return stack[-1]
+    if default_executor is not None:
+        return default_executor
+    return BagExecutor()
+
+
+def set_executor(executor):
+    """Set the default executor (None for a BagExecutor)."""
+    global default_executor
+    default_executor = executor
+
+
+@contextmanager
+def use_executor(executor):
+    """Use executor (if not None) in this block, in this thread."""
+    if executor is None:
+        yield get_executor()
+        return
+    if not hasattr(_local, 'executors'):
+        _local.executors = []
+    _local.executors.append(executor)
+    try:
+        yield executor
+    finally:
+        _local.executors.pop()
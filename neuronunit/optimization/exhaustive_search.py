@@ -10,6 +10,7 @@ from neuronunit.optimization.model_parameters import model_params
 from neuronunit.optimization import data_transport_container
 from neuronunit.optimization.optimization_management import nunit_evaluation, update_deap_pop
 from neuronunit.optimization.optimization_management import update_dtc_pop
+from neuronunit.optimization.executors import get_executor
 import numpy as np
 from collections import OrderedDict
 
@@ -285,7 +286,7 @@ def run_rick_grid(rick_grid, tests,td):
         grid_results.extend(results)
     return grid_results
 
-def run_simple_grid(npoints, tests, ranges, free_params, hold_constant = None):
+def run_simple_grid(npoints, tests, ranges, free_params, hold_constant = None, executor = None):
     subset = OrderedDict()
     for k,v in ranges.items():
         if k in free_params:
@@ -304,19 +305,22 @@ def run_simple_grid(npoints, tests, ranges, free_params, hold_constant = None):
         consumable = [ val for g in grid_points for val in g.values() ]
     grid_results = []
     td = list(td)
-    if len(consumable) <= 16:
+    # Evaluate the grid in populations that keep the executor's workers busy
+    executor = get_executor(executor)
+    size = max(8, executor.width)
+    if len(consumable) <= 2*size:
         consumable = consumable
-        results = update_deap_pop(consumable, tests, td)
+        results = update_deap_pop(consumable, tests, td, executor = executor)
         if type(results) is not None:
             grid_results.extend(results)
 
-    if len(consumable) > 16:
-        consumable = chunks(consumable,8)
+    if len(consumable) > 2*size:
+        consumable = chunks(consumable,size)
         for sub_pop in consumable:
             sub_pop = sub_pop
             #sub_pop = [[i] for i in sub_pop ]
             #sub_pop = WSListIndividual(sub_pop)
-            results = update_deap_pop(sub_pop, tests, td)
+            results = update_deap_pop(sub_pop, tests, td, executor = executor)
             if type(results) is not None:
                 grid_results.extend(results)
     return grid_results
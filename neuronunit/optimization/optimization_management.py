@@ -9,6 +9,7 @@ from neuronunit.optimization.model_parameters import model_params, path_params
 import numpy
 from neuronunit.optimization import model_parameters as modelp
 from itertools import repeat
+from functools import partial
 
 import copy
 import math
@@ -19,6 +20,9 @@ from pyneuroml import pynml
 
 from deap import base
 from neuronunit.optimization.data_transport_container import DataTC
+from neuronunit.optimization.executors import get_executor, use_executor
+from neuronunit.optimization.profiling import profiler, profiled, \
+    get_model_counts, map_pickled
 
 
 import os
@@ -102,7 +106,12 @@ def bridge_judge(test_and_models):
     backend_ = dtc.backend
     model = mint_generic_model(backend_)
     model.set_attrs(**dtc.attrs)
-    pred = test.generate_prediction(model)
+    with profiler.span('generate_prediction', test=str(test)) as counters:
+        pred = test.generate_prediction(model)
+        counters.update(get_model_counts(model))
+    # Backends which abort diverging integrations flag the results; the
+    # model keeps the flag of any of the test's runs, not only the last.
+    dtc.unstable = bool(getattr(model, 'unstable', False))
     if pred is not None:
         if hasattr(dtc,'prediction'):# is not None:
             dtc.prediction[test] = pred
@@ -196,6 +205,23 @@ def dtc_to_rheo(dtc):
     return dtc
 
 
+def with_tests(dtc, tests, func):
+    '''
+    Call func on a DataTC sent without its tests (which are scattered to
+    the workers once instead, see executors), with a copy of the tests.
+    '''
+    dtc.tests = copy.deepcopy(tests)
+    dtc = func(dtc)
+    dtc.tests = None
+    return dtc
+
+
+def dtc_to_rheo_task(dtc, tests):
+    # dtc_to_rheo of one individual, as a task of an executor.
+    with profiler.span('rheobase'):
+        return with_tests(dtc, tests, dtc_to_rheo)
+
+
 def score_proc(dtc,t,score):
     dtc.score[str(t)] = {}
     #print(score.keys())
@@ -321,6 +347,10 @@ def nunit_evaluation_df(dtc):
             if str('RheobaseTest') != t.name and str('RheobaseTestP') != t.name:
                 t.params = dtc.vtest[k]
                 score, dtc= bridge_judge((t,dtc))
+                if dtc.unstable:
+                    # No point running the remaining tests.
+                    dtc = allocate_worst(dtc,tests)
+                    break
                 if score is not None:
                     if score.norm_score is not None:
                         dtc.scores[str(t)] = 1.0 - score.norm_score
@@ -358,6 +388,10 @@ def nunit_evaluation(dtc):
             if str('RheobaseTest') != t.name and str('RheobaseTestP') != t.name:
                 t.params = dtc.vtest[k]
                 score, dtc= bridge_judge((t,dtc))
+                if dtc.unstable:
+                    # No point running the remaining tests.
+                    dtc = allocate_worst(dtc,tests)
+                    break
                 if score is not None:
                     if score.norm_score is not None:
                         dtc.scores[str(t)] = 1.0 - score.norm_score
@@ -421,9 +455,7 @@ def update_dtc_pop(pop, td):
         _backend = pop[0].backend
     if isinstance(pop, Iterable):# and type(pop[0]) is not type(str('')):
         xargs = zip(pop,repeat(td),repeat(_backend))
-        npart = np.min([multiprocessing.cpu_count(),len(pop)])
-        bag = db.from_sequence(xargs, npartitions = npart)
-        dtcpop = list(bag.map(transform).compute())
+        dtcpop = get_executor().map(transform, list(xargs))
         assert len(dtcpop) == len(pop)
     else:
         for p in pop:
@@ -438,8 +470,7 @@ def update_dtc_pop(pop, td):
         assert exec('dtcpop[0].backend is '+str(_backend)+')')
     return dtcpop
 
-def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA = None, MU = None, seed_pop = None, model_type = str('RAW')):
-    from bluepyopt.deapext.optimisations import SciUnitOptimization
+def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA = None, MU = None, seed_pop = None, model_type = str('RAW'), executor = None, strategy = None):
     # Inputs:	
     #   - MODEL_PARAMS, is a dictionary of model parameter ranges (the boundaries that define regions where parameters are free to vary).
     #     You may not want all the parameters to be allowed to vary, so the optinal key word argument: free_params 
@@ -455,6 +486,10 @@ def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA =
     #     For example if you did a coarse grained grid search first, and want the first genes to look in the location
     #     of the coarse grained optima first.
     #   - use_test is a list of NU tests (a NeuronUnit tests suite), or a singular test.
+    #   - executor maps the evaluations, e.g. a DistributedExecutor of a cluster (see executors).
+    #   - strategy None (or 'ga') for the GA, or 'cma' for CMA-ES, or 'bipop' for CMA-ES with BIPOP restarts
+    #     (see cmaes), which generate each generation whole, of size MU (by default 4 + 3 ln(len(free_params))),
+    #     until max_ngen generations or convergence. On smooth objectives they need far fewer evaluations.
     #  Outputs:
     #   - ga_out a dictionary of GA optimization results
     #   - stats,     
@@ -463,6 +498,17 @@ def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA =
     ss = {}
     for k in free_params:
         ss[k] = explore_edges[k]
+    max_ngen = int(np.floor(max_ngen))
+    if strategy not in (None, str('ga')):
+        from neuronunit.optimization.bp_opt import SciUnitOptimization
+        DO = SciUnitOptimization(offspring_size = MU, error_criterion = test, provided_dict = ss,
+                                 nparams = len(ss), backend = model_type, hc = hc, strategy = strategy,
+                                 executor = executor)
+        with use_executor(executor):
+            ga_out = DO.run(max_ngen = max_ngen)
+        return ga_out, DO
+
+    from bluepyopt.deapext.optimisations import SciUnitOptimization
     if type(MU) == type(None):
         MU = 2**len(list(free_params))
     # make sure that the gene population size is divisible by 4.
@@ -470,7 +516,6 @@ def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA =
         selection = str('selNSGA')
     else:
         selection = str('selIBEA')
-    max_ngen = int(np.floor(max_ngen))
     DO = SciUnitOptimization(offspring_size = MU, error_criterion = test, boundary_dict = ss, backend = model_type, hc = hc,selection = selection, seed_pop= seed_pop)#, selection = selection, boundary_dict = ss, elite_size = 2, hc=hc)
 
     if seed_pop is not None:
@@ -481,14 +526,16 @@ def run_ga(explore_edges, max_ngen, test, free_params = None, hc = None, NSGA =
         DO.setup_deap()
 
     # This run condition should not need same arguments as above.
-    ga_out = DO.run(max_ngen = max_ngen)#offspring_size = MU, )
+    with use_executor(executor):
+        ga_out = DO.run(max_ngen = max_ngen)#offspring_size = MU, )
     return ga_out, DO
 
 
 def init_pop(pop, td, tests):
 
     from neuronunit.optimization.exhaustive_search import update_dtc_grid
-    dtcpop = list(update_dtc_pop(pop, td))
+    with profiler.span('init_pop'):
+        dtcpop = list(update_dtc_pop(pop, td))
     for d in dtcpop:
         d.tests = tests
         if hasattr(pop[0],'backend'):
@@ -511,7 +558,21 @@ def obtain_rheobase(pop, td, tests):
     and rheobase test rt
     '''
     pop, dtcpop = init_pop(pop, td, tests)
-    dtcpop = list(map(dtc_to_rheo,dtcpop))
+    executor = get_executor()
+    if executor.work_stealing:
+        # A task per individual, so that idle workers take on the searches
+        # queued behind long ones; each search is serial.
+        for d in dtcpop:
+            d.tests = None
+        dtcpop = executor.map(profiled(dtc_to_rheo_task), dtcpop,
+                              tests=executor.scatter(tests))
+        for i, d in enumerate(dtcpop):
+            d.tests = tests
+            profiler.collect(d, individual=i)
+    else:
+        for i, d in enumerate(dtcpop):
+            with profiler.span('rheobase', individual=i):
+                dtcpop[i] = dtc_to_rheo(d)
     for ind,d in zip(pop,dtcpop):
         if type(d.rheobase) is not type(1.0):
             ind.rheobase = d.rheobase
@@ -587,11 +648,21 @@ def filtered(pop,dtcpop):
 def parallel_route(pop,dtcpop,tests,td):
     for d in dtcpop:
         d.tests = copy.copy(tests)
-    dtcpop = list(map(format_test,dtcpop))
+    with profiler.span('format_test'):
+        dtcpop = list(map(format_test,dtcpop))
     #import pdb; pdb.set_trace()
-    npart = np.min([multiprocessing.cpu_count(),len(dtcpop)])
-    dtcbag = db.from_sequence(dtcpop, npartitions = npart)
-    dtcpop = list(dtcbag.map(nunit_evaluation).compute())
+    executor = get_executor()
+    with profiler.span('nunit_evaluation') as counters:
+        # The tests are sent to the workers once, rather than with each DTC
+        for d in dtcpop:
+            d.tests = None
+        dtcpop = map_pickled(profiled(partial(with_tests,
+                                              func=nunit_evaluation)),
+                             dtcpop, counters=counters, executor=executor,
+                             tests=executor.scatter(tests))
+        for i, d in enumerate(dtcpop):
+            d.tests = copy.copy(tests)
+            profiler.collect(d, individual=i)
     for i,d in enumerate(dtcpop):
         if not hasattr(pop[i],'dtc'):
             pop[i] = WSListIndividual(pop[i])
@@ -610,28 +681,60 @@ def make_up_lost(pop,dtcpop,td):
     if delta:
         cnt = 0
         while cnt < delta:
-            ind,dtc = new_genes(pop,dtcpop,td)
+            with profiler.span('new_genes', individual=len(pop)) as counters:
+                ind,dtc = new_genes(pop,dtcpop,td)
+                counters['retries'] = int(dtc.rheobase == -1.0)
             if dtc.rheobase != -1.0:
                 pop.append(ind)
                 dtcpop.append(dtc)
                 cnt += 1
     return pop, dtcpop
 
+def allocate_lost(pop,dtcpop,tests,td,lost):
+    '''
+    Evaluate the individuals not lost (see parallel_route), and allocate the
+    worst scores to those lost (the indices of those without a rheobase),
+    keeping them all, in order, rather than replacing the lost (see
+    make_up_lost).
+    '''
+    kept = [ i for i in range(len(pop)) if i not in lost ]
+    if kept:
+        kept_pop, kept_dtcpop = parallel_route([ pop[i] for i in kept ],
+                                               [ dtcpop[i] for i in kept ],
+                                               tests, td)
+        for i,p,d in zip(kept,kept_pop,kept_dtcpop):
+            pop[i], dtcpop[i] = p, d
+    for i in lost:
+        d = allocate_worst(dtcpop[i],tests)
+        d.tests = copy.copy(tests)
+        d.get_ss()
+    return pop, dtcpop
+
 import dask.bag as db
 
-def test_runner(pop,td,tests,single_spike=True):
+def test_runner(pop,td,tests,single_spike=True,replace_lost=True):
+    lost = []
     if single_spike:
-        pop, dtcpop = obtain_rheobase(pop, td, tests)
-        pop, dtcpop = make_up_lost(pop,dtcpop,td)
-        # there are many models, which have no actual rheobase current injection value.
-        # filter, filters out such models,
-        # gew genes, add genes to make up for missing values.
-        # delta is the number of genes to replace.
+        with profiler.span('obtain_rheobase'):
+            pop, dtcpop = obtain_rheobase(pop, td, tests)
+        if replace_lost:
+            with profiler.span('make_up_lost'):
+                pop, dtcpop = make_up_lost(pop,dtcpop,td)
+            # there are many models, which have no actual rheobase current injection value.
+            # filter, filters out such models,
+            # gew genes, add genes to make up for missing values.
+            # delta is the number of genes to replace.
+        else:
+            lost = [ i for i,d in enumerate(dtcpop)
+                     if d.rheobase is None or d.rheobase == -1.0 ]
 
     else:
         pop, dtcpop = init_pop(pop, td, tests)
 
-    pop,dtcpop = parallel_route(pop,dtcpop,tests,td)
+    if lost:
+        pop,dtcpop = allocate_lost(pop,dtcpop,tests,td,lost)
+    else:
+        pop,dtcpop = parallel_route(pop,dtcpop,tests,td)
     for ind,d in zip(pop,dtcpop):
         ind.dtc = d
         if not hasattr(ind,'fitness'):
@@ -639,7 +742,7 @@ def test_runner(pop,td,tests,single_spike=True):
     return pop,dtcpop
 
 
-def update_deap_pop(pop, tests, td, backend = None,hc = None):
+def update_deap_pop(pop, tests, td, backend = None,hc = None, executor = None, replace_lost = True):
     '''
     Inputs a population of genes (pop).
     Returned neuronunit scored DataTransportContainers (dtcpop).
@@ -648,6 +751,10 @@ def update_deap_pop(pop, tests, td, backend = None,hc = None):
     Rheobase values are found on the DTCs
     DTCs for which a rheobase value of x (pA)<=0 are filtered out
     DTCs are then scored by neuronunit, using neuronunit models that act in place.
+    The work is mapped by executor (see executors.get_executor).
+    If not replace_lost, DTCs without a rheobase are allocated the worst scores
+    instead, and the individuals are returned in order (e.g. for an ask/tell
+    strategy, which must be told of the individuals it generated).
     '''
 
     #pop = copy.copy(pop)
@@ -659,7 +766,9 @@ def update_deap_pop(pop, tests, td, backend = None,hc = None):
         pop[0].backend = None
         pop[0].backend = backend
 
-    pop, dtcpop = test_runner(pop,td,tests)
+    with use_executor(executor), \
+            profiler.span('update_deap_pop', population=len(pop)):
+        pop, dtcpop = test_runner(pop,td,tests,replace_lost=replace_lost)
     for p,d in zip(pop,dtcpop):
         p.dtc = d
     return pop
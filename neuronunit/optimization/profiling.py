@@ -0,0 +1,215 @@
+"""Instrumentation of the stages of the optimization pipeline.
+
+Stages are timed as spans, e.g.
+
+    with profiler.span('obtain_rheobase', generation=3) as counters:
+        ...
+        counters['simulations'] = n
+
+Each span is a record (a dict) of its stage, wall_time (s), its labels and
+those of the spans it is nested in (e.g. individual, test), and its counters
+(e.g. simulations, simulated_ms, bytes_pickled).  Records are passed to the
+profiler's sinks (e.g. a JSONLSink) and added to running totals per stage,
+e.g. for a logbook chapter (see pop_totals); the profiler keeps no records,
+so that it stays cheap however long it runs.
+
+Spans run in dask workers (e.g. per test, in nunit_evaluation) are captured
+by the profiled function wrapper onto the DataTC the function returns, and
+emitted by the parent process when it collects them.  A span costs a timer
+call and a dict, so profiling can stay on in production runs.
+"""
+
+import json
+import threading
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial, wraps
+
+import cloudpickle
+
+from neuronunit.optimization.executors import BagExecutor, get_executor
+
+
+class Profiler(object):
+    """Records spans of the optimization stages, and passes them to sinks
+    (callables taking each record)."""
+
+    def __init__(self, sinks=None, enabled=True):
+        self.enabled = enabled
+        self.sinks = list(sinks or [])
+        # The totals by stage of the records since the last pop_totals
+        self.totals = OrderedDict()
+        self._local = threading.local()
+
+    def _get_stack(self, name):
+        # The labels of the open spans, or the capturing lists, of this thread
+        if not hasattr(self._local, name):
+            setattr(self._local, name, [])
+        return getattr(self._local, name)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a stage; yields a dict of counters for the record."""
+        if not self.enabled:
+            yield {}
+            return
+        stack = self._get_stack('labels')
+        if stack:
+            labels = dict(stack[-1], **labels)
+        stack.append(labels)
+        counters = {}
+        start = timeit.default_timer()
+        try:
+            yield counters
+        finally:
+            wall_time = timeit.default_timer() - start
+            stack.pop()
+            record = dict(labels, stage=stage, wall_time=wall_time)
+            record.update(counters)
+            self.emit(record)
+
+    def emit(self, record):
+        captures = self._get_stack('captures')
+        if captures:
+            captures[-1].append(record)
+            return
+        add_to_totals(self.totals, record)
+        for sink in self.sinks:
+            sink(record)
+
+    @contextmanager
+    def capture(self):
+        """Collect the records emitted (in this thread) in a list, instead
+        of passing them on, e.g. to send them to another process."""
+        captures = self._get_stack('captures')
+        records = []
+        captures.append(records)
+        try:
+            yield records
+        finally:
+            captures.pop()
+
+    def collect(self, dtc, **labels):
+        """Emit the records captured onto a DataTC (see profiled), with the
+        labels of the open spans and the given labels."""
+        records = getattr(dtc, 'profile', None)
+        if not records:
+            return
+        dtc.profile = []
+        stack = self._get_stack('labels')
+        outer = dict(stack[-1] if stack else {}, **labels)
+        for record in records:
+            self.emit(dict(outer, **record))
+
+    def get_totals(self, records=None):
+        """The number of records, and the sums of their wall times and
+        counters, by stage: of the records given, else of those emitted since
+        the last pop_totals."""
+        if records is None:
+            return OrderedDict((stage, dict(total))
+                               for stage, total in self.totals.items())
+        totals = OrderedDict()
+        for record in records:
+            add_to_totals(totals, record)
+        return totals
+
+    def pop_totals(self):
+        """The totals of the records since the last call, flattened to
+        '<stage>.<counter>' keys (e.g. for a logbook chapter)."""
+        totals = self.totals
+        self.totals = OrderedDict()
+        return OrderedDict(('%s.%s' % (stage, key), value)
+                           for stage, total in totals.items()
+                           for key, value in total.items())
+
+
+# The counters summed by Profiler.get_totals
+COUNTERS = ('wall_time', 'simulations', 'simulated_ms', 'bytes_pickled',
+            'retries')
+
+
+def add_to_totals(totals, record):
+    """Count a record, and add its counters, to the totals of its stage."""
+    total = totals.setdefault(record['stage'], {'count': 0})
+    total['count'] += 1
+    for key, value in record.items():
+        if key in COUNTERS:
+            total[key] = total.get(key, 0) + value
+
+
+class JSONLSink(object):
+    """Writes each record as a line of JSON to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+profiler = Profiler()
+
+
+def get_model_counts(model):
+    """The number of runs a model simulated, and their total duration."""
+    if not hasattr(model, 'run_counts'):
+        return {}
+    return {'simulations': model.run_counts['simulated'],
+            'simulated_ms': getattr(model, 'simulated_ms', 0.0)}
+
+
+class profiled(object):
+    """Wrap a function of a DataTC (returning one) to capture the records
+    of its spans onto the profile of the DataTC returned, for
+    Profiler.collect.
+
+    A class rather than a closure, so that it is pickled (e.g. for dask
+    workers) as a reference to the function, and captures the spans of the
+    worker's own profiler.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        wraps(func)(self)
+
+    def __call__(self, dtc, *args, **kwargs):
+        with profiler.capture() as records:
+            dtc = self.func(dtc, *args, **kwargs)
+        dtc.profile = list(getattr(dtc, 'profile', None) or []) + records
+        return dtc
+
+
+def _call_pickled(payload, func, **kwargs):
+    return cloudpickle.dumps(func(cloudpickle.loads(payload), **kwargs))
+
+
+def map_pickled(func, items, npartitions=None, counters=None, executor=None,
+                **kwargs):
+    """Map func over items with an executor, as
+    [func(item, **kwargs) for item in items].
+
+    Where the executor sends them between processes (see
+    executors.SerialExecutor.serializes), items and results are pickled here,
+    rather than by the executor, to add the bytes sent to
+    counters['bytes_pickled']; otherwise they are passed as they are.
+    npartitions: Of the dask.bag, if the executor is a BagExecutor.
+    executor: See executors.get_executor.
+    """
+    executor = get_executor(executor)
+    if npartitions is not None and isinstance(executor, BagExecutor):
+        executor = BagExecutor(npartitions, executor.scheduler)
+    if not executor.serializes:
+        return executor.map(func, items, **kwargs)
+    payloads = [cloudpickle.dumps(item) for item in items]
+    results = executor.map(partial(_call_pickled, func=func), payloads,
+                           **kwargs)
+    if counters is not None:
+        counters['bytes_pickled'] = counters.get('bytes_pickled', 0) + \
+            sum(map(len, payloads)) + sum(map(len, results))
+    return [cloudpickle.loads(result) for result in results]
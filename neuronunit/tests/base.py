@@ -38,6 +38,13 @@ class VmTest(ProtocolToFeaturesTest):
 
     ephysprop_name = ''
 
+    # Name of the property of ncap.ProvidesAnalyticProperties this test
+    # measures, if it may be computed without simulation.
+    analytic_property = None
+
+    # Whether the last prediction was computed without simulation.
+    analytic_prediction = False
+
     observation_schema = [("Mean, Standard Deviation, N",
                            {'mean': {'units': True, 'required': True},
                             'std': {'units': True, 'min': 0, 'required': True},
@@ -79,9 +86,25 @@ class VmTest(ProtocolToFeaturesTest):
     def condition_model(self, model):
         model.set_run_params(t_stop=self.params['tmax'])
 
+    def get_analytic_prediction(self, model, current=None):
+        """Get the value of the analytic property from the model, if any.
+
+        Returns None when the test has no analytic property, or the model
+        cannot compute it in closed form, so that it must be simulated.
+        """
+        self.analytic_prediction = False
+        if self.analytic_property is None or \
+           not isinstance(model, ncap.ProvidesAnalyticProperties):
+            return None
+        value = model.get_analytic_property(self.analytic_property, current)
+        self.analytic_prediction = value is not None
+        return value
+
     def bind_score(self, score, model, observation, prediction):
-        score.related_data['vm'] = model.get_membrane_potential()
         score.related_data['model_name'] = '%s_%s' % (model.name, self.name)
+        if self.analytic_prediction:
+            return  # No membrane potential was simulated.
+        score.related_data['vm'] = model.get_membrane_potential()
 
         def plot_vm(self, ax=None, ylim=(None, None)):
             """A plot method the score can use for convenience."""
@@ -142,6 +165,8 @@ class VmTest(ProtocolToFeaturesTest):
         self.params['injected_square_current']['amplitude'] = rheobase
         model.inject_square_current(self.params['injected_square_current'])
 
+        if model.results.get('unstable'):
+            return False
         mp = model.results['vm']
         if np.any(np.isnan(mp)) or np.any(np.isinf(mp)):
             return False
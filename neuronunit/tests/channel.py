@@ -2,7 +2,6 @@
 
 import numpy as np
 from scipy.interpolate import interp1d
-from scipy.optimize import minimize
 import quantities as pq
 
 from sciunit.tests import ProtocolToFeaturesTest
@@ -67,23 +66,29 @@ class _IVCurveTest(ProtocolToFeaturesTest):
             "v_max must be greater than v_min"
         return params
 
-    def condition_model(self, model):
+    def get_ca_params(self, model):
         # Start with the model defaults
         params = model.default_params.copy()
         # Required parameter by ChannelAnalysis to commpute an IV curve
         params.update(**{'ivCurve': True})
         # Use test parameters as well to build the new LEMS file
         params.update(self.params)
+        return params
+
+    def condition_model(self, model):
         # Make a new LEMS file with these parameters
-        model.ca_make_lems_file(**params)
+        model.ca_make_lems_file(**self.get_ca_params(model))
 
     def setup_protocol(self, model):
-        """Implement sciunit.tests.ProtocolToFeatureTest.setup_protocol."""
-        self.condition_model(model)
+        """Implement sciunit.tests.ProtocolToFeatureTest.setup_protocol.
+
+        The protocol is run by get_result, once for all IV curve tests with
+        the same parameters."""
+        pass
 
     def get_result(self, model):
-        results = model.ca_run_lems_file(verbose=True)
-        return results
+        # The IV data, shared by the steady state and peak IV curve tests
+        return model.ca_get_iv_curve(**self.get_ca_params(model))
 
     def extract_features(self, model, result):
         """Implemented in the subclasses"""
@@ -131,6 +136,18 @@ class _IVCurveTest(ProtocolToFeaturesTest):
                 'i_pred': i_pred_interp,
                 'i_obs': i_obs_interp}
 
+    @staticmethod
+    def get_scale_factor(i_obs, i_pred):
+        """The (non-negative) factor on i_pred minimizing the sum-squared
+        difference from i_obs: the least-squares solution sum(o*p)/sum(p*p).
+        """
+        i_obs = i_obs.rescale(pq.pA).magnitude
+        i_pred = i_pred.rescale(pq.pA).magnitude
+        norm = np.dot(i_pred, i_pred)
+        if norm == 0:
+            return 1.0
+        return max(np.dot(i_obs, i_pred)/norm, 0.0)
+
     def compute_score(self, observation, prediction):
         # Sum of the difference between the curves.
         o = observation
@@ -138,12 +155,8 @@ class _IVCurveTest(ProtocolToFeaturesTest):
         interped = self.interp_IV_curves(o['v'], o['i'], p['v'], p['i'])
 
         if self.scale:
-            def f(sf):
-                score = FloatScore.compute_ssd(interped['i_obs'],
-                                               (10**sf)*interped['i_pred'])
-                return score.score.magnitude
-            result = minimize(f, 0.0)
-            scale_factor = 10**result.x
+            scale_factor = self.get_scale_factor(interped['i_obs'],
+                                                 interped['i_pred'])
             interped['i_pred'] *= scale_factor
         else:
             scale_factor = 1
@@ -183,8 +196,7 @@ class _IVCurveTest(ProtocolToFeaturesTest):
 class IVCurveSSTest(_IVCurveTest):
     """Test IV curves using steady-state curent"""
 
-    def extract_features(self, model, results):
-        iv_data = model.ca_compute_iv_curve(results)
+    def extract_features(self, model, iv_data):
         return {'v': iv_data['hold_v'],
                 'i': iv_data['i_steady']}
 
@@ -192,7 +204,6 @@ class IVCurveSSTest(_IVCurveTest):
 class IVCurvePeakTest(_IVCurveTest):
     """Test IV curves using steady-state curent"""
 
-    def extract_features(self, model, results):
-        iv_data = model.ca_compute_iv_curve(results)
+    def extract_features(self, model, iv_data):
         return {'v': iv_data['hold_v'],
                 'i': iv_data['i_peak']}
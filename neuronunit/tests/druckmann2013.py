@@ -6,10 +6,10 @@ AP analysis details (from suplementary info): https://github.com/scidash/neuronu
 Numbers in class names refer to the numbers in the publication table
 """
 
-from elephant.spike_train_generation import threshold_detection
 from neo import AnalogSignal
 from numba import jit
 from .base import np, pq, ncap, VmTest, scores
+from neuronunit.optimization.executors import get_executor
 
 
 # How this file is different to the original.
@@ -182,6 +182,19 @@ def isolate_code_block(threshold_crosses,start_time,dvdt_threshold_crosses,dvdt_
     return vm_chopped, threshold_crosses, ap_beginnings, vm_mag, vm_times
 
 
+def is_stochastic(model):
+    """Whether repeated simulations of the model may give different results.
+
+    Models, or their backends, declare this with a `stochastic` attribute;
+    those which do not (e.g. NEURON and jNeuroML) are assumed to be
+    deterministic.
+    """
+    if 'stochastic' in dir(type(model)):
+        return model.stochastic
+    backend = getattr(model, '_backend', None)
+    return getattr(backend, 'stochastic', False)
+
+
 class Druckmann2013Test(VmTest):
     """
     All tests inheriting from this class assume that the subject model:
@@ -210,18 +223,31 @@ class Druckmann2013Test(VmTest):
         self.APs = None
 
     def generate_prediction(self, model):
-        results = []
-
         reps = self.params['repetitions']
 
-        for rep in range(reps):
-            pred = self.generate_repetition_prediction(model)
-            results.append(pred)
-
-        if reps > 1:
-            return self.aggregate_repetitions(results)
+        if reps > 1 and not is_stochastic(model):
+            # Every repetition would be identical (std = 0)
+            return self.aggregate_repetitions(
+                [self.generate_repetition_prediction(model)])
+        elif reps > 1:
+            return self.aggregate_repetitions(self.run_repetitions(model, reps))
         else:
-            return results[0]
+            return self.generate_repetition_prediction(model)
+
+    def run_repetitions(self, model, reps):
+        """Run the repetitions with the executor in use (see
+        executors.get_executor); in the workers of an executor, serially."""
+        executor = get_executor()
+        return executor.map(self.run_repetition, range(reps),
+                            model=executor.scatter(model))
+
+    def run_repetition(self, rep, model):
+        if getattr(model, '_backend', None) is None:
+            # The backend is not pickled along with the model
+            attrs = dict(model.attrs)
+            model.set_backend(model.backend)
+            model.set_attrs(**attrs)
+        return self.generate_repetition_prediction(model)
 
     def generate_repetition_prediction(self, model):
         raise NotImplementedError()
@@ -263,9 +289,14 @@ class Druckmann2013Test(VmTest):
             dvdt = np.array(np.append([0], get_diff(vm))) * pq.mV / vm.sampling_period
         dvdt = AnalogSignal(dvdt, sampling_period=vm.sampling_period)
 
-        threshold_crosses = threshold_detection(vm,threshold=self.params['threshold'])
-        dvdt_threshold_crosses = threshold_detection(dvdt,threshold=self.params['beginning_threshold'])
-        dvdt_zero_crosses = threshold_detection(dvdt, threshold=0 * pq.mV/pq.ms)
+        sf = ncap.spike_functions
+        threshold_crosses = sf.get_crossing_times(
+            vm, sf.threshold_crossings(vm, self.params['threshold'])[0])
+        # Both dV/dt thresholds in one pass
+        dvdt_threshold_crosses, dvdt_zero_crosses = [
+            sf.get_crossing_times(dvdt, indices) for indices in
+            sf.threshold_crossings(dvdt, [self.params['beginning_threshold'],
+                                          0 * pq.mV/pq.ms])]
 
         vm_chopped, threshold_crosses, ap_beginnings, vm_mag, vm_times = isolate_code_block(
             threshold_crosses, \
@@ -827,17 +858,15 @@ class InputResistanceTest(Druckmann2013Test):
     def generate_prediction(self, model):
         voltages = []
 
-        # Loop through the injection currents
-        for i in self.injection_currents:
-
-            # Set the current amplitude
-            self.params['injected_square_current']['amplitude'] = i
-
-            # Inject current
-            model.inject_square_current(self.params['injected_square_current'])
+        # Inject every current (natively batched, if the model supports it)
+        current = self.params['injected_square_current']
+        vms = model.inject_square_current_sweep(self.injection_currents,
+                                                current['delay'],
+                                                current['duration'])
 
-            # Get the voltage waveform
-            vm = model.get_membrane_potential()
+        # Loop through the voltage waveforms of the injection currents
+        for j in range(vms.shape[1]):
+            vm = vms[:, j]
 
             # The voltage at final 1ms of current step is assumed to be steady state
             ss_voltage = np.median(vm.magnitude[np.where((vm.times >= 1999*pq.ms) & (vm.times <= 2000*pq.ms))]) * pq.mV
@@ -1479,3 +1508,52 @@ class Burst1ISISDStrongStimTest(Burst1ISISDTest):
 
     Same as :any:`Burst1ISISDTest` but for strong stimulus
     """
+
+
+def get_druckmann2013_tests(standard, strong, ir_currents):
+    """The 38 tests of the battery, in the order of the publication table.
+
+    standard, strong: The amplitudes of the standard (150% of rheobase) and
+        strong (300% of rheobase) stimuli.
+    ir_currents: The currents of InputResistanceTest.
+    """
+    return [
+        AP12AmplitudeDropTest(standard),
+        AP1SSAmplitudeChangeTest(standard),
+        AP1AmplitudeTest(standard),
+        AP1WidthHalfHeightTest(standard),
+        AP1WidthPeakToTroughTest(standard),
+        AP1RateOfChangePeakToTroughTest(standard),
+        AP1AHPDepthTest(standard),
+        AP2AmplitudeTest(standard),
+        AP2WidthHalfHeightTest(standard),
+        AP2WidthPeakToTroughTest(standard),
+        AP2RateOfChangePeakToTroughTest(standard),
+        AP2AHPDepthTest(standard),
+        AP12AmplitudeChangePercentTest(standard),
+        AP12HalfWidthChangePercentTest(standard),
+        AP12RateOfChangePeakToTroughPercentChangeTest(standard),
+        AP12AHPDepthPercentChangeTest(standard),
+        InputResistanceTest(injection_currents=ir_currents),
+        AP1DelayMeanTest(standard),
+        AP1DelaySDTest(standard),
+        AP2DelayMeanTest(standard),
+        AP2DelaySDTest(standard),
+        Burst1ISIMeanTest(standard),
+        Burst1ISISDTest(standard),
+        InitialAccommodationMeanTest(standard),
+        SSAccommodationMeanTest(standard),
+        AccommodationRateToSSTest(standard),
+        AccommodationAtSSMeanTest(standard),
+        AccommodationRateMeanAtSSTest(standard),
+        ISICVTest(standard),
+        ISIMedianTest(standard),
+        ISIBurstMeanChangeTest(standard),
+        SpikeRateStrongStimTest(strong),
+        AP1DelayMeanStrongStimTest(strong),
+        AP1DelaySDStrongStimTest(strong),
+        AP2DelayMeanStrongStimTest(strong),
+        AP2DelaySDStrongStimTest(strong),
+        Burst1ISIMeanStrongStimTest(strong),
+        Burst1ISISDStrongStimTest(strong),
+    ]
@@ -8,10 +8,11 @@ import os
 import multiprocessing
 import copy
 
-import dask.bag as db
-
 import neuronunit
 from neuronunit.optimization.data_transport_container import DataTC
+from neuronunit.optimization.executors import get_executor
+from neuronunit.optimization.profiling import profiler, profiled, \
+    get_model_counts
 from neuronunit.models.reduced import ReducedModel
 from .base import np, pq, ncap, VmTest, scores
 
@@ -186,6 +187,10 @@ class RheobaseTestP(RheobaseTest):
     ephysprop_name = 'Rheobase'
     score_type = scores.RatioScore
     get_rheobase_vm = True
+    analytic_property = 'rheobase'
+    # The executor of the search (see optimization.executors); None for the
+    # one in use
+    executor = None
 
     def condition_model(self, model):
         model.set_run_params(t_stop=self.params['tmax'])
@@ -211,6 +216,14 @@ class RheobaseTestP(RheobaseTest):
 
         prediction = {}
 
+        bound = self.get_analytic_prediction(model)
+        if bound is not None:
+            # The analytic current (a bifurcation) only bounds the rheobase
+            # from below: there the latency of the first spike is infinite,
+            # so no finite pulse fires.  Search the currents above it.
+            self.analytic_prediction = False
+            dtc.lookup[float(bound)] = 0
+            dtc = check_fix_range(dtc, get_executor(self.executor).width)
         rheobase = find_rheobase(self, dtc).rheobase
         if rheobase is not None:
             # Something like the below commented line must happen to set the
@@ -237,7 +250,7 @@ Functions to support the parallel rheobase search.
 """
 
 
-def check_fix_range(dtc):
+def check_fix_range(dtc, width=N_CPUS):
     """Check for the rheobase value.
 
     Inputs: lookup, A dictionary of previous current injection values
@@ -249,8 +262,11 @@ def check_fix_range(dtc):
     returned.
     given a dictionary of rheobase search values, use that
     dictionary as input for a subsequent search.
+    The next currents are width-1 (at least one) steps across the range, for
+    an executor checking width currents at once.
     """
     steps = []
+    n = max(width, 2)
     dtc.rheobase = None
     sub, supra = get_sub_supra(dtc.lookup)
 
@@ -263,14 +279,14 @@ def check_fix_range(dtc):
         assert sub.max() <= supra.min()
     elif len(sub) and len(supra):
         # Termination criterion
-        steps = np.linspace(sub.max(), supra.min(), N_CPUS+1)*pq.pA
+        steps = np.linspace(sub.max(), supra.min(), n+1)*pq.pA
         steps = steps[1:-1]*pq.pA
     elif len(sub):
-        steps = np.linspace(sub.max(), 2*sub.max(), N_CPUS+1)*pq.pA
+        steps = np.linspace(sub.max(), 2*sub.max(), n+1)*pq.pA
         steps = steps[1:-1]*pq.pA
     elif len(supra):
         steps = np.linspace(supra.min()-100, supra.min(),
-                            N_CPUS+1)*pq.pA
+                            n+1)*pq.pA
         steps = steps[1:-1]*pq.pA
 
     dtc.current_steps = steps
@@ -320,9 +336,11 @@ def check_current(dtc):
         uc = {'amplitude': ampl*pq.pA}
         current.update(uc)
         dtc.run_number += 1
-        model.inject_square_current(current)
-        dtc.previous = ampl
-        n_spikes = model.get_spike_count()
+        with profiler.span('check_current', amplitude=ampl) as counters:
+            model.inject_square_current(current)
+            dtc.previous = ampl
+            n_spikes = model.get_spike_count()
+            counters.update(get_model_counts(model))
         dtc.lookup[float(ampl)] = n_spikes
     return dtc
 
@@ -371,6 +389,7 @@ def find_rheobase(self, dtc):
     # until proven otherwise.
     # dtc = check_current(model.rheobase,dtc)
     # If its not true enter a search, with ranges informed by memory
+    executor = get_executor(self.executor)
     cnt = 0
     sub = np.array([0, 0])
     while dtc.boolean is False and cnt < 40:
@@ -383,17 +402,20 @@ def find_rheobase(self, dtc):
                       in range(0, len(dtc.current_steps))]
         for i, s in enumerate(dtc.current_steps):
             dtc_clones[i].ampl = dtc.current_steps[i]
+            dtc_clones[i].profile = []
         dtc_clones = [d for d in dtc_clones if not np.isnan(d.ampl)]
 
-        b0 = db.from_sequence(dtc_clones, npartitions=N_CPUS)
-        dtc_clone = list(b0.map(check_current).compute())
+        with profiler.span('rheobase_round', round=cnt):
+            dtc_clone = executor.map(profiled(check_current), dtc_clones)
+            for d in dtc_clone:
+                profiler.collect(d)
         for dtc in dtc_clone:
             if dtc.boolean is True:
                 return dtc
 
         for d in dtc_clone:
             dtc.lookup.update(d.lookup)
-        dtc = check_fix_range(dtc)
+        dtc = check_fix_range(dtc, executor.width)
 
         cnt += 1
         sub, supra = get_sub_supra(dtc.lookup)
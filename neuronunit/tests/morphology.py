@@ -2,9 +2,13 @@
 """NeuronUnit Test classes for cell models with morphology"""
 
 import quantities as pq
-from pylmeasure import *
+try:
+    from pylmeasure import getOneMeasure
+except ImportError:
+    getOneMeasure = None
 
 from neuronunit.capabilities.morphology import *
+from neuronunit.capabilities import morphometrics
 from sciunit.scores import ZScore
 
 
@@ -26,10 +30,22 @@ class MorphologyTest(sciunit.Test):
         :param measure: One of the functions from the list: http://cng.gmu.edu:8080/Lm/help/index.htm
         :param stat: One of: Average, Maximum, Minimum, StdDev, TotalSum
         :return: The computed measure statistic
+
+        Measures in morphometrics.measures are computed in process (and
+        cached per SWC file contents); others are run with L-Measure.
         '''
 
         swc_path = model_swc.produce_swc()
-        value = getOneMeasure(measure, swc_path, self.pca, self.specificity)[stat]
+        if measure in morphometrics.measures:
+            stats = morphometrics.get_measure(measure, swc_path,
+                                              self.specificity)
+        elif getOneMeasure is not None:
+            stats = getOneMeasure(measure, swc_path, self.pca,
+                                  self.specificity)
+        else:
+            raise ImportError("pylmeasure is needed for the %s measure"
+                              % measure)
+        value = stats[stat]
         return value
 
 
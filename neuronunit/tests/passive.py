@@ -1,12 +1,130 @@
 """Passive neuronunit tests, requiring no active conductances or spiking."""
 
 from .base import np, pq, ncap, VmTest, scores
-from scipy.optimize import curve_fit
+from neuronunit.capabilities.trace import as_trace
 
 DURATION = 500.0*pq.ms
 DELAY = 200.0*pq.ms
 
 
+def fit_exponentials(t, vms, iterations=10):
+    """Fit vm = a*exp(-t/tau) + c to each row of a stack of traces at once.
+
+    The fit is initialized by a linearized (log) least squares fit against
+    the steady state at the end of each trace, and then refined by a fixed
+    number of Levenberg-Marquardt iterations run on all traces together.
+
+    Args:
+        t (numpy.ndarray): sample times in ms, starting at 0 (shape (m,)).
+        vms (numpy.ndarray): traces in mV, shape (m,) or (n, m).
+        iterations (int): number of Levenberg-Marquardt iterations.
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): amplitudes (mV),
+            time constants (ms) and offsets (mV), one per trace.
+    """
+    t = np.asarray(t, dtype=float)
+    vms = np.atleast_2d(np.asarray(vms, dtype=float))
+    n_tail = max(1, vms.shape[1]//20)
+    n_head = max(1, vms.shape[1]//200)
+
+    # Linearized fit of log|vm - c| = log|a| - t/tau, weighted by |vm - c|^2
+    # (the log compresses the larger, better resolved deviations) and
+    # restricted to the start of the relaxation, until the deviation first
+    # falls into the noise.
+    c = vms[:, -n_tail:].mean(axis=1)
+    dv = vms - c[:, None]
+    a0 = dv[:, :n_head].mean(axis=1)
+    y = np.abs(dv)
+    above = np.cumprod(y > 0.1*np.abs(a0)[:, None], axis=1)
+    w = np.where(above > 0, y**2, 0.0)
+    log_y = np.log(np.where(w > 0, y, 1.0))
+    sw, st, stt = w.sum(1), (w*t).sum(1), (w*t*t).sum(1)
+    sy, sty = (w*log_y).sum(1), (w*t*log_y).sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (sw*sty - st*sy)/(sw*stt - st**2)
+        intercept = (sy - slope*st)/sw
+    ok = np.isfinite(slope) & (slope < 0)
+    tau = np.where(ok, -1.0/np.where(ok, slope, -1.0), 10.0)
+    a = np.where(ok, np.sign(a0)*np.exp(np.where(ok, intercept, 0.0)), a0)
+
+    def cost(a, tau, c):
+        return ((vms - a[:, None]*np.exp(-t/tau[:, None]) - c[:, None])**2
+                ).sum(1)
+
+    damping = np.full(len(vms), 1e-3)
+    current = cost(a, tau, c)
+    for _ in range(iterations):
+        e = np.exp(-t/tau[:, None])
+        residual = vms - a[:, None]*e - c[:, None]
+        jac = np.stack([e, a[:, None]*t*e/tau[:, None]**2,
+                        np.ones_like(e)], axis=-1)
+        jtj = np.einsum('nmi,nmj->nij', jac, jac)
+        jtr = np.einsum('nmi,nm->ni', jac, residual)
+        diag = jtj[:, [0, 1, 2], [0, 1, 2]]
+        jtj[:, [0, 1, 2], [0, 1, 2]] += damping[:, None]*diag
+        try:
+            step = np.linalg.solve(jtj, jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            break
+        new_tau = tau + step[:, 1]
+        new_tau = np.where(new_tau > 0, new_tau, tau)
+        new = cost(a + step[:, 0], new_tau, c + step[:, 2])
+        better = new < current
+        a = np.where(better, a + step[:, 0], a)
+        tau = np.where(better, new_tau, tau)
+        c = np.where(better, c + step[:, 2], c)
+        current = np.where(better, new, current)
+        damping = np.where(better, damping/10.0, damping*10.0)
+    return a, tau, c
+
+
+def stack_traces(vms):
+    """Stack AnalogSignals into one (n, m) array of mV values.
+
+    Traces are truncated to the shortest one; all must share a sampling
+    period.
+    """
+    if not isinstance(vms, (list, tuple)):
+        vms = [vms]
+    length = min(len(vm) for vm in vms)
+    stack = np.vstack([vm.rescale('mV').magnitude.ravel()[:length]
+                       for vm in vms])
+    return stack, vms[0].sampling_period, vms[0].t_start
+
+
+def fit_passive(vms, i):
+    """Estimate Rin, tau and capacitance of many test pulse responses.
+
+    Args:
+        vms (list): membrane potential AnalogSignals recorded with the same
+            test pulse i (see TestPulseTest.get_injected_square_current).
+
+    Returns:
+        dict: 'r_in' (Mohm), 'tau' (ms) and 'c' (pF) arrays with one value
+            per trace.
+    """
+    stack, dt, t_start = stack_traces(vms)
+    dt = float(dt.rescale('ms'))
+    t_start = float(t_start.rescale('ms'))
+    delay = float(i['delay'].rescale('ms')) - t_start
+    duration = float(i['duration'].rescale('ms'))
+
+    def window(start, stop):
+        return stack[:, int(start/dt):int(stop/dt)]
+
+    # Steady state before and at the end of the pulse
+    before = window(delay-11, delay-1).mean(axis=1)
+    after = window(delay+duration-11, delay+duration-1).mean(axis=1)
+    r_in = (after-before)/float(i['amplitude'].rescale('nA'))
+
+    # Charging segment: pulse onset until 1 ms before its end
+    charging = window(delay, delay+duration-1)
+    t = dt*np.arange(charging.shape[1])
+    _, tau, _ = fit_exponentials(t, charging)
+    return {'r_in': r_in, 'tau': tau, 'c': 1000.0*tau/r_in}
+
+
 class TestPulseTest(VmTest):
     """A base class for tests that use a square test pulse."""
 
@@ -31,12 +149,33 @@ class TestPulseTest(VmTest):
         t_stop = self.params['tmax']
         model.get_backend().set_stop_time(t_stop)
 
+    def generate_prediction(self, model):
+        """Use the analytic property of the model when it has one."""
+        value = self.get_analytic_prediction(
+            model, self.params['injected_square_current'])
+        if value is not None:
+            return {'value': value.simplified}
+        return super(TestPulseTest, self).generate_prediction(model)
+
     def setup_protocol(self, model):
         """Implement sciunit.tests.ProtocolToFeatureTest.setup_protocol."""
         self.condition_model(model)
-        model.inject_square_current(self.params['injected_square_current'])
+        i = self.params['injected_square_current']
+        windows = self.get_windows(i)
+        backend = model.get_backend()
+        settle = windows is not None and hasattr(backend, 'set_settle')
+        if settle:
+            backend.set_settle(windows)
+        try:
+            model.inject_square_current(i)
+        finally:
+            if settle:
+                backend.set_settle(None)
 
     def get_result(self, model):
+        # Features are computed from the lighter Trace when there is one
+        if hasattr(model, 'get_trace'):
+            return model.get_trace()
         vm = model.get_membrane_potential()
         return vm
 
@@ -49,64 +188,60 @@ class TestPulseTest(VmTest):
 
     @classmethod
     def get_segment(cls, vm, start, finish):
-        start = int((start/vm.sampling_period).simplified)
-        finish = int((finish/vm.sampling_period).simplified)
-        return vm[start:finish]
+        """The Trace of vm (a Trace or an AnalogSignal) from start to finish."""
+        return as_trace(vm).segment(start, finish)
 
     @classmethod
-    def get_rin(cls, vm, i):
+    def get_windows(cls, i):
+        """The (start, stop) windows of the trace the features use.
+
+        None if they use all of it.  Otherwise backends which detect when
+        the model settles (see set_settle) may skip the rest.
+        """
+        return None
+
+    @classmethod
+    def get_rin_windows(cls, i):
         start, stop = -11*pq.ms, -1*pq.ms
-        before = cls.get_segment(vm, start+i['delay'], stop+i['delay'])
-        after = cls.get_segment(vm, start+i['delay']+i['duration'],
-                                stop+i['delay']+i['duration'])
+        end = i['delay']+i['duration']
+        return [(start+i['delay'], stop+i['delay']), (start+end, stop+end)]
+
+    @classmethod
+    def get_rin(cls, vm, i):
+        before, after = [cls.get_segment(vm, start, stop)
+                         for start, stop in cls.get_rin_windows(i)]
         r_in = (after.mean()-before.mean())/i['amplitude']
         return r_in.simplified
 
     @classmethod
-    def get_tau(cls, vm, i):
+    def get_tau_window(cls, i):
         # 10 ms before pulse start or halfway between sweep start
         # and pulse start, whichever is longer
         start = max(i['delay'] - 10*pq.ms, i['delay']/2)
         stop = i['duration']+i['delay'] - 1*pq.ms  # 1 ms before pulse end
+        return start, stop
+
+    @classmethod
+    def get_tau(cls, vm, i):
+        start, stop = cls.get_tau_window(i)
         region = cls.get_segment(vm, start, stop)
         amplitude, tau, y0 = cls.exponential_fit(region, i['delay'])
         return tau
 
     @classmethod
     def exponential_fit(cls, segment, offset):
-        t = segment.times.rescale('ms')
-        start = t[0]
-        offset = offset-start
-        t = t-start
-        t = t.magnitude
-        vm = segment.rescale('mV').magnitude
-        offset = (offset * segment.sampling_rate).simplified
-        assert offset.dimensionality == pq.dimensionless
-        offset = int(offset)
-        guesses = [vm.min(),  # amplitude (mV)
-                   10,  # time constant (ms)
-                   vm.max()]  # y0 (mV)
-        vm_fit = vm.copy()
-
-        def func(x, a, b, c):
-            """Produce an exponential function.
-
-            Given function parameters a, b, and c, returns the exponential
-            decay function for those parameters.
-            """
-            vm_fit[:offset] = c
-            shaped = len(np.shape(vm_fit))
-            if shaped > 1:
-                vm_fit[offset:, 0] = a * np.exp(-t[offset:]/b) + c
-            elif shaped == 1:
-                vm_fit[offset:] = a * np.exp(-t[offset:]/b) + c
-
-            return vm_fit.squeeze()
-        # Estimate starting values for better convergence
-        popt, pcov = curve_fit(func, t, vm.squeeze(), p0=guesses)
-        amplitude = popt[0]*pq.mV
-        tau = popt[1]*pq.ms
-        y0 = popt[2]*pq.mV
+        """Fit an exponential to the part of segment after offset.
+
+        See fit_exponentials.
+        """
+        segment = as_trace(segment)
+        offset = segment.index(offset)
+        vm = segment.rescale('mV').data[offset:]
+        t = segment.dt*np.arange(len(vm))
+        a, tau, c = fit_exponentials(t, vm)
+        amplitude = a[0]*pq.mV
+        tau = tau[0]*pq.ms
+        y0 = c[0]*pq.mV
         return amplitude, tau, y0
 
     def compute_score(self, observation, prediction):
@@ -131,6 +266,12 @@ class InputResistanceTest(TestPulseTest):
 
     ephysprop_name = 'Input Resistance'
 
+    analytic_property = 'input_resistance'
+
+    @classmethod
+    def get_windows(cls, i):
+        return cls.get_rin_windows(i)
+
     def extract_features(self, model, result):
         features = super(InputResistanceTest, self).\
                             extract_features(model, result)
@@ -154,6 +295,12 @@ class TimeConstantTest(TestPulseTest):
 
     ephysprop_name = 'Membrane Time Constant'
 
+    analytic_property = 'time_constant'
+
+    @classmethod
+    def get_windows(cls, i):
+        return [cls.get_tau_window(i)]
+
     def extract_features(self, model, result):
         features = super(TimeConstantTest, self).\
                             extract_features(model, result)
@@ -192,6 +339,10 @@ class CapacitanceTest(TestPulseTest):
 
     ephysprop_name = 'Cell Capacitance'
 
+    @classmethod
+    def get_windows(cls, i):
+        return cls.get_rin_windows(i) + [cls.get_tau_window(i)]
+
     def extract_features(self, model, result):
         features = super(CapacitanceTest, self).extract_features(model, result)
         if features is not None:
@@ -234,6 +385,14 @@ class RestingPotentialTest(TestPulseTest):
 
     ephysprop_name = 'Resting membrane potential'
 
+    analytic_property = 'resting_potential'
+
+    def generate_prediction(self, model):
+        value = self.get_analytic_prediction(model)
+        if value is not None:
+            return {'mean': value, 'std': 0.0*value.units}
+        return super(TestPulseTest, self).generate_prediction(model)
+
     def extract_features(self, model, result):
         features = super(RestingPotentialTest, self).\
                             extract_features(model, result)
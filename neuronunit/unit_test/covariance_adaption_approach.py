@@ -1,26 +1,91 @@
-from neuronunit.optimzation import optimization_management
+"""Compare the evaluations CMA-ES (cmaes.CMAStrategy), CMA-ES with BIPOP
+restarts (cmaes.BIPOPStrategy) and the genetic algorithm (with the bounded
+operators of SciUnitOptimization) need to reach the same fitness, on
+benchmark functions of 4 bounded parameters.
+
+The same strategies optimize models with run_ga, e.g.
+
+    ga_out, DO = run_ga(explore_param, 50, tests, free_params=free_params,
+                        strategy='bipop')
+"""
+
+import random
+
+import numpy
+from deap import base, benchmarks, creator, tools
+
+from neuronunit.optimization.cmaes import CMAStrategy, BIPOPStrategy
+
+N = 4
+LOWER, UPPER = [-5.12]*N, [5.12]*N
+TARGET = 1e-3
+MAX_EVALUATIONS = 100000
 
 creator.create("FitnessMin", base.Fitness, weights=(-1.0,))
 creator.create("Individual", list, fitness=creator.FitnessMin)
 
-toolbox = base.Toolbox()
-toolbox.register("evaluate", benchmarks.rastrigin)
-self.toolbox.register("evaluate", optimization_management.evaluate)
 
-#Then, it does not get any harder. Once a Strategy is instantiated, its generate() and update() methods are registered in the toolbox for uses in the eaGenerateUpdate() algorithm. The generate() method is set to produce the created Individual class. The random number generator from numpy is seeded because the cma module draws all its number from it.
+def shifted_sphere(ind):
+    return benchmarks.sphere([x - 1.3 for x in ind])
+
+
+def evaluate(population, function):
+    for ind in population:
+        ind.fitness.values = function(ind)
+    return min(ind.fitness.values[0] for ind in population)
+
+
+def run_strategy(strategy, function):
+    evaluations = 0
+    while not strategy.stopped and evaluations < MAX_EVALUATIONS:
+        population = strategy.ask()
+        best = evaluate(population, function)
+        evaluations += len(population)
+        strategy.tell(population)
+        if best < TARGET:
+            return evaluations
+    return None
+
+
+def run_ga(function, mu=16, eta=10):
+    toolbox = base.Toolbox()
+    toolbox.register("mate", tools.cxSimulatedBinaryBounded, eta=eta,
+                     low=LOWER, up=UPPER)
+    toolbox.register("mutate", tools.mutPolynomialBounded, eta=eta,
+                     low=LOWER, up=UPPER, indpb=0.5)
+    parents = [creator.Individual(random.uniform(l, u)
+                                  for l, u in zip(LOWER, UPPER))
+               for _ in range(mu)]
+    evaluate(parents, function)
+    evaluations = mu
+    while evaluations < MAX_EVALUATIONS:
+        offspring = [toolbox.clone(ind) for ind in parents]
+        for a, b in zip(offspring[::2], offspring[1::2]):
+            toolbox.mate(a, b)
+        for ind in offspring:
+            toolbox.mutate(ind)
+        best = evaluate(offspring, function)
+        evaluations += len(offspring)
+        if best < TARGET:
+            return evaluations
+        parents = tools.selNSGA2(parents + offspring, mu)
+    return None
 
-def main():
-    numpy.random.seed(128)
 
-    strategy = cma.Strategy(centroid=[5.0]*N, sigma=5.0, lambda_=20*N)
-    toolbox.register("generate", strategy.generate, creator.Individual)
-    toolbox.register("update", strategy.update)
+def main(seed=1):
+    random.seed(seed)
+    for name, function in [('sphere', shifted_sphere),
+                           ('rosenbrock', benchmarks.rosenbrock),
+                           ('rastrigin', benchmarks.rastrigin)]:
+        cma = run_strategy(CMAStrategy(LOWER, UPPER,
+                                       ind_init=creator.Individual,
+                                       seed=seed), function)
+        bipop = run_strategy(BIPOPStrategy(LOWER, UPPER,
+                                           ind_init=creator.Individual,
+                                           seed=seed), function)
+        print('%s: evaluations to reach %s: CMA-ES %s, BIPOP-CMA-ES %s, '
+              'GA %s' % (name, TARGET, cma, bipop, run_ga(function)))
 
-    hof = tools.HallOfFame(1)
-    stats = tools.Statistics(lambda ind: ind.fitness.values)
-    stats.register("avg", numpy.mean)
-    stats.register("std", numpy.std)
-    stats.register("min", numpy.min)
-    stats.register("max", numpy.max)
 
-    algorithms.eaGenerateUpdate(toolbox, ngen=250, stats=stats, halloffame=hof)
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,495 @@ class EphysPropertiesTestCase(NotebookTools,
     def test_get_tau(self):
         self.do_notebook('get_tau')
 
+    def test_fit_passive(self):
+        import numpy as np
+        import quantities as pq
+        from neo.core import AnalogSignal
+        from neuronunit.tests.passive import fit_passive
+        dt = 0.1
+        t = np.arange(0, 800, dt)
+        taus = [5, 10, 20, 40]
+        vms = []
+        for tau in taus:
+            pulse = (t >= 200) & (t < 700)
+            v = -65 - pulse*(1-np.exp(-(t-200)/tau))  # 100 Mohm, -10 pA
+            vms.append(AnalogSignal(v, units=pq.mV,
+                                    sampling_period=dt*pq.ms))
+        i = {'delay': 200*pq.ms, 'duration': 500*pq.ms,
+             'amplitude': -10*pq.pA}
+        fit = fit_passive(vms, i)
+        np.testing.assert_allclose(fit['tau'], taus, rtol=0.01)
+        np.testing.assert_allclose(fit['r_in'], 100, rtol=0.01)
+        np.testing.assert_allclose(fit['c'], np.array(taus)*10, rtol=0.02)
+
+    def test_izhikevich_analytic(self):
+        import quantities as pq
+        from neuronunit.models.backends.rawpy import get_analytic_property
+        rs = {'C': 100, 'k': 0.7, 'vr': -60, 'vt': -40, 'a': 0.03, 'b': -2}
+        current = {'amplitude': -10*pq.pA, 'delay': 200*pq.ms,
+                   'duration': 500*pq.ms}
+        r_in = get_analytic_property('input_resistance', current, **rs)
+        self.assertAlmostEqual(float(r_in.rescale(pq.MOhm)), 79.63, 2)
+        tau = get_analytic_property('time_constant', current, **rs)
+        self.assertTrue(10 < float(tau.rescale(pq.ms)) < 13)
+        # Resonators have no closed form rheobase for a step current
+        self.assertIsNone(get_analytic_property('rheobase', a=0.1, b=30))
+
+    def test_izhikevich_rheobase(self):
+        import quantities as pq
+        from neuronunit.models.reduced import ReducedModel
+        from neuronunit.optimization.executors import SerialExecutor
+        from neuronunit.optimization.model_parameters import path_params
+        from neuronunit.tests.fi import RheobaseTestP
+        model = ReducedModel(path_params['model_path'], backend='RAW')
+        model.set_attrs(C=100, k=0.7, vr=-60, vt=-40, a=0.03, b=-2)
+        bound = model.get_analytic_property('rheobase')
+        test = RheobaseTestP(observation={'mean': 50*pq.pA, 'std': 20*pq.pA,
+                                          'n': 10})
+        test.get_rheobase_vm = False
+        test.executor = SerialExecutor()
+        rheobase = test.generate_prediction(model)['value']
+        self.assertFalse(test.analytic_prediction)
+        # The bifurcation current bounds the rheobase of a finite pulse
+        self.assertGreater(rheobase, bound)
+        current = test.get_injected_square_current()
+        for amplitude, spikes in [(rheobase, True),
+                                  (rheobase - test.params['tolerance'],
+                                   False)]:
+            current['amplitude'] = amplitude
+            model.inject_square_current(current)
+            self.assertEqual(model.get_spike_count() > 0, spikes)
+
+    def test_threshold_crossings(self):
+        import numpy as np
+        import quantities as pq
+        from neo.core import AnalogSignal
+        from elephant.spike_train_generation import threshold_detection
+        from neuronunit.capabilities import spike_functions as sf
+        v = np.random.RandomState(0).normal(size=2000)
+        v[::97] = np.nan
+        vm = AnalogSignal(v, units=pq.mV, sampling_period=0.1*pq.ms)
+        for threshold in [0.5*pq.mV, 0.0*pq.V]:
+            expected = threshold_detection(vm, threshold=threshold)
+            spike_train = sf.get_spike_train(vm, threshold=threshold)
+            np.testing.assert_array_equal(spike_train.magnitude,
+                                          expected.magnitude)
+        low, high = sf.threshold_crossings(vm, [0.5*pq.mV, 1*pq.mV],
+                                           hysteresis=1*pq.mV)
+        self.assertLess(len(low), sf.get_spike_count(vm, 0.5*pq.mV))
+        self.assertLess(len(high), len(low))
+
+    def test_trace(self):
+        import numpy as np
+        import quantities as pq
+        from neuronunit.capabilities import Trace
+        from neuronunit.capabilities.trace import as_trace
+        trace = Trace(np.arange(100.0), 0.5, t0=10.0, units='mV')
+        vm = trace.to_analog_signal()
+        np.testing.assert_allclose(vm.times.rescale(pq.ms).magnitude,
+                                   trace.get_times())
+        back = as_trace(vm)
+        self.assertEqual((back.dt, back.t0, back.units), (0.5, 10.0, 'mV'))
+        segment = trace.segment(20*pq.ms, 30.0)
+        self.assertEqual((len(segment), segment.t0, segment.data[0]),
+                         (20, 20.0, 20.0))
+        np.testing.assert_allclose(trace.rescale('V').data,
+                                   vm.rescale(pq.V).magnitude.ravel())
+
+    def test_bracket_search(self):
+        from neuronunit.cellmodelp import get_bracket_rounds, \
+            get_bracket_currents, shrink_bracket
+        for k in [1, 3, 8]:
+            lower, upper = 0.0, 10.0
+            for _ in range(get_bracket_rounds(10, k)):
+                currents = get_bracket_currents(lower, upper, k)
+                found = [current > 3.7 for current in currents]
+                lower, upper = shrink_bracket(lower, upper, currents, found)
+            self.assertTrue(lower <= 3.7 < upper)
+            self.assertLessEqual(upper - lower, 10.0/2**10)
+        self.assertEqual(get_bracket_rounds(10, 1), 10)
+        self.assertEqual(get_bracket_rounds(10, 3), 5)
+
+    def test_protocol_stages(self):
+        from neuronunit.cellmodelp import get_protocol_stages
+        stages = get_protocol_stages(['tolerances', 'stability_range',
+                                      'resting_voltage', 'threshold',
+                                      'DT_SENSITIVITY', 'threshold',
+                                      'STEADY_STATE', 'RAMP', 'SQUARE'])
+        self.assertEqual(stages, [
+            'tolerances',
+            {1: ('stability_range', set()), 2: ('resting_voltage', set()),
+             3: ('threshold', {1, 2})},
+            'DT_SENSITIVITY',
+            {5: ('threshold', set()), 6: ('STEADY_STATE', set()),
+             7: ('RAMP', {6}), 8: ('SQUARE', {6})}])
+
+    def test_concurrent_protocol_saves(self):
+        import fcntl
+        import json
+        import os
+        import shutil
+        import tempfile
+        import time
+        import types
+        from neuronunit import cellmodelp
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        row_path = os.path.join(path, 'cells.json')
+        row = {'Model_ID': 'NMLCL000001', 'Stability_Range_Low': None,
+               'Stability_Range_High': None, 'Resting_Voltage': None,
+               'Is_Intrinsically_Spiking': False, 'Is_Passive': False,
+               'Threshold_Current_Low': None, 'Threshold_Current_High': None}
+        with open(row_path, 'w') as f:
+            json.dump(row, f)
+
+        class Cells(object):
+            # The cells table: a row in a file shared by the protocol
+            # workers, saved (wholly, or only some fields) as by peewee
+            def __init__(self, **fields):
+                self.__dict__.update(fields)
+
+            @classmethod
+            def get_or_none(cls, query):
+                with open(row_path) as f:
+                    return cls(**json.load(f))
+
+            def save(self, only=None):
+                with open(row_path, 'r+') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    saved = json.load(f)
+                    saved.update((field, value)
+                                 for field, value in vars(self).items()
+                                 if only is None or field in only)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(saved, f)
+
+        for field in row:
+            setattr(Cells, field, field)  # Field objects, by name
+        self.addCleanup(setattr, cellmodelp, 'Cells',
+                        getattr(cellmodelp, 'Cells', None))
+        cellmodelp.Cells = Cells
+
+        class Cell(cellmodelp.CellModel):
+            # Both protocols read the record before either saves it
+            def __init__(self):
+                self.server = types.SimpleNamespace(connect=lambda: None)
+                self.steady_state_delay = 1000
+            def get_model_nml_id(self):
+                return row['Model_ID']
+            def is_nosim(self):
+                return False
+            def load_model(self):
+                pass
+            def use_optimal_dt_if_available(self):
+                pass
+            def get_stability_range(self):
+                time.sleep(0.2)
+                return -1.0, 2.0
+            def getRestingV(self, run_time, save_resting_state=False):
+                # Runs while stability_range does, in another worker
+                with open(os.path.join(path, 'concurrent'), 'a') as f:
+                    f.write('%d' % self.concurrent)
+                time.sleep(0.4)
+                return {'rest': -65.0}
+            def getThreshold(self, minCurrent, maxI):
+                return [0.5*maxI, 0.6*maxI]
+
+        cell = Cell()
+        cell.save_scheduled_properties(['stability_range',
+                                        'resting_voltage', 'threshold'],
+                                       processes=2)
+        self.assertFalse(cell.concurrent)
+        cell.getRestingV(1000)
+        with open(os.path.join(path, 'concurrent')) as f:
+            self.assertEqual(f.read(), '10')
+        saved = Cells.get_or_none(None)
+        self.assertEqual((saved.Stability_Range_Low,
+                          saved.Stability_Range_High,
+                          saved.Resting_Voltage), (-1.0, 2.0, -65.0))
+        self.assertEqual((saved.Threshold_Current_Low,
+                          saved.Threshold_Current_High), (1.0, 1.2))
+
+    def test_waveform_store(self):
+        import shutil
+        import tempfile
+        import numpy as np
+        from neuronunit.waveforms import WaveformStore
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        t = np.arange(0, 100, 0.025)
+        v = -65 + 20*np.sin(t)
+        for delta, level in [(False, 0), (True, 0), (True, 6)]:
+            store = WaveformStore(path, delta=delta, level=level)
+            for amp in [0.1, 0.2]:
+                store.save('SQUARE', {'t': t, 'v': v + amp, 'i': None,
+                                      'steps': np.int64(len(t)),
+                                      'cvode_active': 0},
+                           label='%s nA' % amp, amplitude=amp)
+            store.save('RAMP', {'t': t, 'v': v, 'i': t/100.0})
+            sweeps = list(store.iter_waveforms('SQUARE', amplitude=0.2))
+            self.assertEqual(len(sweeps), 1)
+            self.assertEqual((sweeps[0]['label'], sweeps[0]['steps']),
+                             ('0.2 nA', len(t)))
+            np.testing.assert_array_equal(sweeps[0]['v'],
+                                          (v + 0.2).astype(np.float32))
+            self.assertNotIn('i', sweeps[0])
+            self.assertEqual([sweep['protocol'] for sweep in
+                              store.iter_waveforms(arrays=('t',))],
+                             ['RAMP', 'SQUARE', 'SQUARE'])
+            store.remove('SQUARE')
+            store.remove('RAMP')
+            self.assertEqual(store.get_protocols(), [])
+
+    def test_profiling(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+        import dask
+        from neuronunit.optimization.data_transport_container import DataTC
+        from neuronunit.optimization.executors import BagExecutor, \
+            SerialExecutor
+        from neuronunit.optimization.profiling import Profiler, JSONLSink
+        from neuronunit.optimization import profiling
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        sink = JSONLSink(os.path.join(path, 'profile.jsonl'))
+        profiler = Profiler(sinks=[sink])
+        dtc = DataTC()
+        with profiler.span('evaluate', generation=1) as counters:
+            # As in a worker process
+            with profiler.capture() as captured:
+                with profiler.span('test', test='a') as test_counters:
+                    test_counters['simulations'] = 2
+            dtc.profile = captured
+            profiler.collect(dtc, individual=0)
+            counters['bytes_pickled'] = 10
+        sink.close()
+        self.assertEqual(dtc.profile, [])
+        with open(sink.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['stage'] for r in records], ['test', 'evaluate'])
+        self.assertEqual((records[0]['individual'], records[0]['generation'],
+                          records[0]['test']), (0, 1, 'a'))
+        totals = profiler.pop_totals()
+        self.assertEqual((totals['test.simulations'],
+                          totals['evaluate.bytes_pickled']), (2, 10))
+        self.assertEqual(profiler.pop_totals(), {})
+        # Totals are kept running, rather than every record
+        profiler.sinks = []
+        for _ in range(3):
+            with profiler.span('test') as test_counters:
+                test_counters['simulations'] = 1
+        self.assertEqual(profiler.get_totals()['test'],
+                         {'count': 3, 'simulations': 3,
+                          'wall_time': profiler.totals['test']['wall_time']})
+        self.assertEqual(profiler.get_totals(records)['test']['count'], 1)
+        profiler.pop_totals()
+        profiler.enabled = False
+        with profiler.span('off'):
+            pass
+        self.assertEqual(profiler.totals, {})
+        counters = {}
+        with dask.config.set(scheduler='synchronous'):
+            self.assertEqual(profiling.map_pickled(abs, [-1, 2], 1,
+                                                   counters), [1, 2])
+        # Nothing is pickled in this process
+        self.assertEqual(counters, {})
+        self.assertTrue(BagExecutor(scheduler='processes').serializes)
+        class PicklingExecutor(SerialExecutor):
+            serializes = True
+        self.assertEqual(profiling.map_pickled(abs, [-1, 2], 1, counters,
+                                               PicklingExecutor()), [1, 2])
+        self.assertGreater(counters['bytes_pickled'], 0)
+
+    def test_executors(self):
+        import quantities as pq
+        from neuronunit.models.reduced import ReducedModel
+        from neuronunit.optimization.model_parameters import path_params
+        from neuronunit.optimization import executors, profiling
+        from neuronunit.tests.fi import RheobaseTestP
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            self.skipTest("dask.distributed is not installed")
+        cluster = LocalCluster(n_workers=2, threads_per_worker=1,
+                               processes=False, dashboard_address=None)
+        client = Client(cluster)
+        self.addCleanup(cluster.close)
+        self.addCleanup(client.close)
+        distributed = executors.DistributedExecutor(client)
+        self.assertEqual(distributed.width, 2)
+        def scale(x, factor):
+            return x*factor
+
+        for executor in [executors.SerialExecutor(), distributed,
+                         executors.BagExecutor(scheduler='synchronous')]:
+            factor = executor.scatter([3])
+            self.assertEqual(executor.map(scale, [1, 2], factor=factor),
+                             [[3], [3, 3]])
+            self.assertEqual(profiling.map_pickled(scale, [1, 2],
+                                                   executor=executor,
+                                                   factor=factor),
+                             [[3], [3, 3]])
+        # The same search, in the workers of a cluster
+        model = ReducedModel(path_params['model_path'], backend='RAW')
+        observation = {'mean': 50*pq.pA, 'std': 20*pq.pA, 'n': 10}
+        rheobases = []
+        for executor in [executors.SerialExecutor(), distributed]:
+            test = RheobaseTestP(observation=observation)
+            test.analytic_property = None
+            test.get_rheobase_vm = False
+            test.executor = executor
+            rheobases.append(test.generate_prediction(model)['value'])
+        self.assertAlmostEqual(float(rheobases[0]), float(rheobases[1]),
+                               delta=1.0)
+        self.assertIsInstance(executors.get_executor(),
+                              executors.BagExecutor)
+        with executors.use_executor(distributed):
+            self.assertIs(executors.get_executor(), distributed)
+
+    def test_druckmann_repetitions(self):
+        import quantities as pq
+        from neuronunit.models.reduced import ReducedModel
+        from neuronunit.optimization.model_parameters import path_params
+        from neuronunit.optimization import executors
+        from neuronunit.tests.druckmann2013 import AP1DelayMeanTest
+        bag = executors.BagExecutor(scheduler='synchronous')
+        # Work mapped in the partitions of a bag is serial
+        def nested(x):
+            return executors.get_executor()
+        self.assertIsInstance(bag.map(nested, [1])[0],
+                              executors.SerialExecutor)
+        model = ReducedModel(path_params['model_path'], backend='RAW')
+        test = AP1DelayMeanTest(current_amplitude=300*pq.pA, repetitions=3)
+        # A deterministic model is run once
+        self.assertEqual(test.generate_prediction(model)['n'], 1)
+        model._backend.stochastic = True
+        with executors.use_executor(bag):
+            prediction = test.generate_prediction(model)
+        self.assertEqual(prediction['n'], 3)
+        self.assertEqual(float(prediction['std']), 0)
+
+    def test_unstable_evaluation(self):
+        import quantities as pq
+        try:
+            from neuronunit.optimization.optimization_management import \
+                bridge_judge
+        except ImportError:
+            self.skipTest("The optimization dependencies are not installed")
+        from neuronunit.optimization.data_transport_container import DataTC
+        class DivergingTest(object):
+            # Its first run diverges (as k < 0), its last does not
+            observation = {'mean': -65*pq.mV}
+            def generate_prediction(self, model):
+                for amplitude in [-10*pq.pA, 0*pq.pA]:
+                    model.inject_square_current({'amplitude': amplitude,
+                                                 'delay': 100*pq.ms,
+                                                 'duration': 500*pq.ms})
+                    model.get_membrane_potential()
+                self.results = model.results
+        test = DivergingTest()
+        dtc = DataTC()
+        dtc.backend = 'RAW'
+        dtc.attrs = {'k': -1.6}
+        _, dtc = bridge_judge((test, dtc))
+        self.assertFalse(test.results['unstable'])
+        self.assertTrue(dtc.unstable)
+
+    def test_cmaes(self):
+        import pickle
+        import numpy as np
+        from deap import base, benchmarks, creator
+        from neuronunit.optimization.cmaes import CMAStrategy, BIPOPStrategy
+        # Scored by the weighted sum of two objectives
+        creator.create("CMAFitness", base.Fitness, weights=(-1.0, -1.0))
+        creator.create("CMAIndividual", list, fitness=creator.CMAFitness)
+        lower, upper = [-5.12, 0.0, -5.12], [5.12, 10.0, -5.12]
+        def rastrigin(ind):
+            return benchmarks.rastrigin(ind[:1])[0], \
+                benchmarks.sphere([ind[1] - 1.3])[0]
+        def minimize(strategy, max_evaluations=20000):
+            evaluations, best = 0, np.inf
+            while not strategy.stopped and evaluations < max_evaluations:
+                population = strategy.ask()
+                self.assertEqual(len(population), strategy.lambda_)
+                for ind in population:
+                    self.assertTrue(np.all(lower <= np.array(ind)) and
+                                    np.all(np.array(ind) <= upper))
+                    ind.fitness.values = rastrigin(ind)
+                    best = min(best, sum(ind.fitness.values))
+                evaluations += len(population)
+                strategy.tell(population)
+            return best, evaluations
+        cma = CMAStrategy(lower, upper, ind_init=creator.CMAIndividual,
+                          seed=0)
+        self.assertEqual(cma.lambda_, 7)
+        _, evaluations = minimize(cma)
+        self.assertTrue(cma.stopped)
+        self.assertEqual(evaluations, cma.evaluations)
+        # Restarts find the global minimum of the multimodal objective
+        bipop = BIPOPStrategy(lower, upper, ind_init=creator.CMAIndividual,
+                              seed=0)
+        best, evaluations = minimize(bipop)
+        self.assertLess(best, 1e-6)
+        self.assertGreater(bipop.restarts, 0)
+        # As in a checkpoint, and reproducibly
+        strategy = pickle.loads(pickle.dumps(
+            CMAStrategy(lower, upper, ind_init=creator.CMAIndividual, seed=1)))
+        self.assertEqual(strategy.ask(), CMAStrategy(
+            lower, upper, ind_init=creator.CMAIndividual, seed=1).ask())
+
+    def test_generate_update(self):
+        import numpy as np
+        from deap import base, creator, tools
+        try:
+            from neuronunit.optimization import algorithms
+        except ImportError:
+            self.skipTest("The optimization dependencies are not installed")
+        from neuronunit.optimization.cmaes import CMAStrategy
+        creator.create("GUFitness", base.Fitness, weights=(-1.0,))
+        creator.create("GUIndividual", list, fitness=creator.GUFitness)
+        strategy = CMAStrategy([0.0, 0.0], [1.0, 1.0],
+                               ind_init=creator.GUIndividual, seed=0)
+        asked, told = [], []
+        ask, tell = strategy.ask, strategy.tell
+        def record_ask():
+            asked.append(ask())
+            return asked[-1]
+        def record_tell(population):
+            told.append(population)
+            tell(population)
+        strategy.ask, strategy.tell = record_ask, record_tell
+        def evaluate(population):
+            # As update_deap_pop(..., replace_lost=False): individuals
+            # without a rheobase (here x > 0.8) have the worst fitness
+            return population, [(1.0,) if ind[0] > 0.8 else
+                                (sum((x - 0.3)**2 for x in ind),)
+                                for ind in population]
+        toolbox = base.Toolbox()
+        toolbox.register("evaluate", evaluate)
+        hof = tools.HallOfFame(1)
+        population, hof, _, logbook, _, gen_vs_pop = \
+            algorithms.eaGenerateUpdateCheckpoint(strategy, toolbox, 30,
+                                                  halloffame=hof)
+        self.assertEqual(len(told), len(logbook))
+        for generation, population in zip(asked, told):
+            self.assertEqual([id(ind) for ind in population],
+                             [id(ind) for ind in generation])
+        self.assertTrue(any(ind.fitness.values == (1.0,)
+                            for population in told for ind in population))
+        np.testing.assert_allclose(hof[0], [0.3, 0.3], atol=1e-2)
+        # Individuals out of bounds are told as clipped to them
+        population = ask()
+        population[0][:] = [5.0, -5.0]
+        for ind in population:
+            ind.fitness.values = (0.0,) if ind is population[0] else (1.0,)
+        tell(population)
+        centroid = strategy.strategy.centroid
+        self.assertTrue(np.all((0 <= centroid) & (centroid <= 1)))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -22,10 +22,252 @@ class ReducedModelTestCase(unittest.TestCase):
     def test_reducedmodel_jneuroml(self):
         model = self.ReducedModel(self.path, backend='jNeuroML')
 
+    def test_jneuroml_batch_lems(self):
+        import quantities as pq
+        from lxml import etree
+        model = self.ReducedModel(self.path, backend='jNeuroML')
+        attrs_list = [{'izhikevich2007Cell': {'a': '0.0%d per_ms' % (i+1)}}
+                      for i in range(3)]
+        currents = [{'amplitude': (i+1)*10*pq.pA} for i in range(3)]
+        lems_path, column_map = model._backend.write_batch_lems(
+            attrs_list, currents=currents)
+        self.assertEqual(len(column_map), 3*2)  # 'v' and 'u' per member
+        self.assertEqual(column_map['RS_pop_b2[0]/v'], (2, 'RS_pop[0]/v'))
+        nml_path = os.path.join(os.path.dirname(lems_path),
+                                'Izh2007One.net.nml')
+        root = etree.parse(nml_path).getroot()
+        pops = root.findall('.//population')
+        self.assertEqual([p.attrib['id'] for p in pops],
+                         ['RS_pop_b%d' % i for i in range(3)])
+        cell = root.find(".//izhikevich2007Cell[@id='RS_b1']")
+        self.assertEqual(cell.attrib['a'], '0.02 per_ms')
+
+    def test_raw_square_current_sweep(self):
+        import numpy as np
+        import quantities as pq
+        from neuronunit.capabilities import ReceivesSquareCurrent
+        model = self.ReducedModel(self.path, backend='RAW')
+        amplitudes = [-10*pq.pA, 0.1*pq.nA, 300*pq.pA]
+        args = (amplitudes, 100*pq.ms, 500*pq.ms)
+        native = model.inject_square_current_sweep(*args)
+        looped = ReceivesSquareCurrent.inject_square_current_sweep(model,
+                                                                   *args)
+        self.assertEqual(native.shape, (len(looped), 3))
+        np.testing.assert_allclose(native.magnitude, looped.magnitude)
+
+    def test_raw_divergence(self):
+        import numpy as np
+        import quantities as pq
+        model = self.ReducedModel(self.path, backend='RAW')
+        current = {'amplitude': -10*pq.pA, 'delay': 100*pq.ms,
+                   'duration': 500*pq.ms}
+        model.inject_square_current(current)
+        model.get_membrane_potential()
+        self.assertFalse(model.results['unstable'])
+        model.set_attrs(k=-1.6)  # v runs away below rest
+        model.inject_square_current(current)
+        vm = model.get_membrane_potential()
+        self.assertTrue(model.results['unstable'])
+        self.assertTrue(np.isnan(vm[-1]))
+        # The model stays flagged by an earlier run, until set_attrs
+        current['amplitude'] = 0*pq.pA
+        model.inject_square_current(current)
+        model.get_membrane_potential()
+        self.assertFalse(model.results['unstable'])
+        self.assertTrue(model.unstable)
+        model.set_attrs(k=0.7)
+        self.assertFalse(model.unstable)
+
+    def test_raw_settle(self):
+        import quantities as pq
+        from neuronunit.tests.passive import InputResistanceTest
+        model = self.ReducedModel(self.path, backend='RAW')
+        model.set_attrs(a=0.03, b=-2.0)
+        current = {'amplitude': -10*pq.pA, 'delay': 100*pq.ms,
+                   'duration': 500*pq.ms}
+        model.inject_square_current(current)
+        full = model.get_membrane_potential()
+        windows = InputResistanceTest.get_windows(current)
+        model.get_backend().set_settle(windows)
+        model.inject_square_current(current)
+        model.get_backend().set_settle(None)
+        settled = model.get_membrane_potential()
+        self.assertLess(len(settled), len(full))
+        r_in = float(InputResistanceTest.get_rin(full, current))
+        self.assertAlmostEqual(
+            float(InputResistanceTest.get_rin(settled, current)), r_in,
+            delta=0.005*r_in)
+
+    def test_run_memoization(self):
+        import quantities as pq
+        model = self.ReducedModel(self.path, backend='RAW')
+        current = {'amplitude': 300*pq.pA, 'delay': 100*pq.ms,
+                   'duration': 500*pq.ms}
+        model.inject_square_current(current)
+        model.get_spike_count()
+        model.get_APs()
+        model.get_membrane_potential()
+        self.assertEqual(model.run_counts, {'simulated': 1, 'reused': 2})
+        model.set_attrs(a=0.02)
+        model.inject_square_current(current)
+        model.get_spike_train()
+        self.assertEqual(model.run_counts['simulated'], 2)
+
+    def test_integration_benchmark(self):
+        import quantities as pq
+        from neuronunit import integrators
+        model = self.ReducedModel(self.path, backend='RAW')
+        protocols = {'SQUARE': {'amplitude': -10*pq.pA, 'delay': 100*pq.ms,
+                                'duration': 300*pq.ms}}
+        settings = [{'dt': 0.0125}, {'dt': 0.025}, {'dt': 0.4}]
+        results = integrators.benchmark(model, protocols, settings, repeat=1)
+        self.assertEqual([r['steps'] for r in results], [48000, 24000, 1500])
+        self.assertEqual(results[0]['error'], 0)
+        self.assertLess(results[1]['error'], results[2]['error'])
+        self.assertGreater(results[0]['peak_memory'], 0)
+        setting = integrators.choose_setting(results, results[1]['error'])
+        self.assertIn(setting, settings[:2])
+        self.assertIsNone(integrators.choose_setting(results, -1))
+
+    def test_glif_backend(self):
+        import numpy as np
+        import quantities as pq
+        try:
+            from neuronunit.models.backends import glif
+        except ImportError:
+            self.skipTest("allensdk is not installed")
+        def method(name):
+            return {'name': name, 'params': {}}
+        # A leaky integrate and fire neuron, so as not to fetch a config
+        config = {'El': 0.0, 'dt': 5e-05, 'R_input': 2e8, 'C': 1e-10,
+                  'asc_tau_array': [0.01, 0.1], 'asc_amp_array': [0.0, 0.0],
+                  'spike_cut_length': 20, 'th_inf': 0.02, 'th_adapt': None,
+                  'coeffs': {'C': 1, 'G': 1, 'b': 1, 'a': 1, 'th_inf': 1,
+                             'asc_amp_array': [1, 1]},
+                  'AScurrent_dynamics_method': method('none'),
+                  'voltage_dynamics_method': method('linear_forward_euler'),
+                  'threshold_dynamics_method': method('inf'),
+                  'voltage_reset_method': method('zero'),
+                  'AScurrent_reset_method': method('none'),
+                  'threshold_reset_method': method('inf'),
+                  'init_voltage': 0.0, 'init_threshold': 0.02,
+                  'init_AScurrents': [0.0, 0.0], 'El_reference': -0.07}
+        allen_id = 566302806
+        self.addCleanup(glif._neuron_configs.pop, allen_id, None)
+        glif._neuron_configs[allen_id] = config
+        nc = glif.get_neuron_config(allen_id)
+        nc['R_input'] = 1.0
+        self.assertEqual(glif.get_neuron_config(allen_id)['R_input'], 2e8)
+
+        model = self.ReducedModel(self.path, backend='GLIF')
+        backend = model._backend
+        self.assertEqual(backend.glif.dt, 0.001)
+        stim = backend.get_stimulus_array(10, 50, 0.5)
+        self.assertEqual(len(stim), 120)
+        self.assertEqual(list(np.nonzero(stim)[0]), list(range(10, 60)))
+        self.assertTrue(np.all(stim[10:60] == 0.5))
+        backend.set_time_step(0.5*pq.ms)
+        self.assertEqual(list(np.nonzero(backend.get_stimulus_array(
+            10, 50, 0.5))[0]), list(range(20, 120)))
+        backend.set_time_step(1*pq.ms)
+        # Scalar attributes update the neuron in place
+        neuron = backend.glif
+        model.set_attrs(R_input=1e8, C=2e-10)
+        self.assertIs(backend.glif, neuron)
+        self.assertEqual((neuron.R_input, neuron.G, neuron.C),
+                         (1e8, 1e-8, 2e-10))
+        self.assertEqual(backend.nc['R_input'], 1e8)
+
+        attrs_list = [{'R_input': 1e8}, {'R_input': 3e8, 'th_inf': 0.03}]
+        current = {'amplitude': 0.2*pq.pA, 'delay': 10*pq.ms,
+                   'duration': 50*pq.ms}
+        attrs = dict(model.attrs)
+        vms = backend.run_batch(attrs_list, current)
+        self.assertEqual(model.attrs, attrs)
+        self.assertEqual(backend.glif.R_input, 1e8)
+        for member, vm in zip(attrs_list, vms):
+            model.set_attrs(**member)
+            model.inject_square_current(current)
+            np.testing.assert_array_equal(
+                vm.magnitude, model.get_membrane_potential().magnitude)
+        self.assertFalse(np.array_equal(vms[0].magnitude,
+                                        vms[1].magnitude))
+
+    def test_neuron_nested_includes(self):
+        import shutil
+        import tempfile
+        from neuronunit.models.backends.neuron import NEURONSession, \
+            get_included_paths
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        os.makedirs(os.path.join(path, 'cells'))
+        files = {
+            'LEMS.xml': '<Lems><Include file="net.nml"/></Lems>',
+            'net.nml': ('<neuroml xmlns="http://www.neuroml.org/schema/'
+                        'neuroml2"><include href="cells/cell.nml"/>'
+                        '</neuroml>'),
+            'cells/cell.nml': '<neuroml><include href="../net.nml"/>'
+                              '</neuroml>'}
+        for name, text in files.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(text)
+        lems_path = os.path.join(path, 'LEMS.xml')
+        nml_path = os.path.join(path, 'net.nml')
+        self.assertEqual(get_included_paths([nml_path]),
+                         [nml_path, os.path.join(path, 'cells', 'cell.nml')])
+        key = NEURONSession.content_hash(lems_path, [nml_path])
+        with open(os.path.join(path, 'cells', 'cell.nml'), 'a') as f:
+            f.write('\n')
+        self.assertNotEqual(NEURONSession.content_hash(lems_path,
+                                                       [nml_path]), key)
+
     @unittest.skip("Ignoring NEURON until we make it an install requirement")#If(OSX,"NEURON unreliable on OSX")
     def test_reducedmodel_neuron(self):
         model = self.ReducedModel(self.path, backend='NEURON')
 
+    def test_neuron_population_lems(self):
+        import types
+        from lxml import etree
+        from neuronunit.models.backends.neuron import NEURONBackend
+        # The population variant needs no NEURON to be written
+        backend = types.SimpleNamespace(
+            model=self.ReducedModel(self.path, backend='jNeuroML'),
+            cell_name='RS')
+        lems_path, nml_paths, pop_id = \
+            NEURONBackend.write_population_lems(backend, 3)
+        self.assertEqual(pop_id, 'RS_pop_x3')
+        root = etree.parse(nml_paths[0]).getroot()
+        pop = root.find('.//population')
+        self.assertEqual((pop.attrib['id'], pop.attrib['size']),
+                         (pop_id, '3'))
+        self.assertEqual([ei.attrib['target']
+                          for ei in root.findall('.//explicitInput')],
+                         ['RS_pop_x3[%d]' % j for j in range(3)])
+        quantities = [line.attrib['quantity'] for line in
+                      etree.parse(lems_path).getroot().iter('Line')]
+        self.assertEqual(quantities, ['RS_pop_x3[0]/v', 'RS_pop_x3[0]/u'])
+
+    @unittest.skip("Ignoring NEURON until we make it an install requirement")
+    def test_neuron_population(self):
+        import quantities as pq
+        model = self.ReducedModel(self.path, backend='NEURON')
+        attrs_list = [{'a': 0.01*(i+1)} for i in range(3)]
+        current = {'amplitude': 100*pq.pA, 'delay': 100*pq.ms,
+                   'duration': 500*pq.ms}
+        model.inject_square_current(current)
+        model.get_membrane_potential()
+        session = model._backend.session
+        ns = session.ns
+        model._backend.init_population(2)
+        vms = model._backend.run_population(attrs_list, current)
+        self.assertEqual(len(vms), 3)
+        self.assertEqual(len(vms[0]), len(vms[2]))
+        # Both models stay loaded, rather than being reloaded in turn
+        model.set_attrs(a=0.02)
+        model.inject_square_current(current)
+        self.assertIs(session.ns, ns)
+        self.assertTrue(model._backend.population_session.loaded)
+
 
 class ExtraCapabilitiesTestCase(NotebookTools,
                            unittest.TestCase):
@@ -296,6 +296,28 @@ class MorphologyTestCase(unittest.TestCase):
         z = test.judge(model)
         self.assertLess(abs(z.score), 0.1)
 
+    # -------------------- Morphometrics ------------------------------ #
+    def test_morphometrics_unordered_swc(self):
+        import os
+        import tempfile
+        import numpy as np
+        from neuronunit.capabilities import morphometrics
+        data = np.loadtxt(model.produce_swc())
+        shuffled = data[np.random.RandomState(0).permutation(len(data))]
+        with tempfile.NamedTemporaryFile('w', suffix='.swc',
+                                         delete=False) as f:
+            np.savetxt(f, shuffled, fmt='%g')
+        try:
+            for measure in morphometrics.measures:
+                expected = morphometrics.get_measure(measure,
+                                                     model.produce_swc())
+                value = morphometrics.get_measure(measure, f.name)
+                self.assertAlmostEqual(value['TotalSum'],
+                                       expected['TotalSum'], 6, measure)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(len(morphometrics._morphologies), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
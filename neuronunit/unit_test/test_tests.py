@@ -128,6 +128,19 @@ class TestsChannelTestCase(unittest.TestCase):
         #score = self.run_test(T)
         #self.assertTrue(0.2 < score < 0.3)
 
+    def test_iv_curve_scale(self):
+        import numpy as np
+        import quantities as pq
+        from neuronunit.tests.channel import IVCurveSSTest as T
+        v = np.linspace(-80, 60, 8)*pq.mV
+        i = (v.magnitude + 20)**2*pq.pA
+        test = T({'v': v, 'i': i}, scale=True)
+        score = test.compute_score(test.observation, {'v': v, 'i': i/4})
+        self.assertAlmostEqual(score.related_data['scale_factor'], 4)
+        self.assertAlmostEqual(float(score.score), 0, 6)
+        # Anti-correlated curves are not scaled below zero
+        self.assertEqual(test.get_scale_factor(i, -i), 0.0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,161 @@
+"""Compact binary storage of the recorded waveforms of cell model protocols.
+
+The t, v and i arrays of each sweep are stored as little-endian float32,
+optionally delta-encoded and zlib-compressed, appended to one data file per
+protocol.  Each sweep also appends a line to the protocol's JSON index,
+holding its metadata (protocol, label, amplitude, steps, run_time, cvode
+flag, ...) and the offset and encoding of each of its arrays.  Readers
+stream the index and read only the sweeps (and arrays) they ask for.
+
+Delta encoding is of the float32 bit patterns, as uint32 differences that
+wrap around, so it is lossless.  With the bytes of the differences grouped
+by significance before compression, the regular time steps and smooth
+voltages of a sweep compress to a fraction of their raw size.
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+DTYPE = '<f4'
+
+# The waveform arrays of a sweep; any other values are metadata
+ARRAYS = ('t', 'v', 'i')
+
+
+def encode(values, delta=True, level=1):
+    """The bytes of values as float32 and the encoding used to write them.
+
+    delta: Store the differences of consecutive values' bit patterns.
+    level: zlib compression level, or 0 not to compress.
+    """
+    data = np.ascontiguousarray(values, dtype=DTYPE)
+    if delta:
+        bits = data.view('<u4')
+        data = bits.copy()
+        data[1:] -= bits[:-1]
+    if level:
+        # Group the bytes of all values by significance: the high bytes of
+        # neighbouring values are mostly alike, so compress well
+        data = np.frombuffer(data.tobytes(), np.uint8).reshape(-1, 4).T
+        data = zlib.compress(data.tobytes(), level)
+    else:
+        data = data.tobytes()
+    encoding = {'length': len(values), 'delta': bool(delta),
+                'compression': 'zlib' if level else None}
+    return data, encoding
+
+
+def decode(data, encoding):
+    """The float32 array written by encode."""
+    if encoding['compression'] == 'zlib':
+        data = np.frombuffer(zlib.decompress(data), np.uint8)
+        data = data.reshape(4, encoding['length']).T.copy()
+    values = np.frombuffer(data, '<u4' if encoding['delta'] else DTYPE,
+                           count=encoding['length'])
+    if encoding['delta']:
+        values = np.cumsum(values, dtype='<u4')
+    return values.view(DTYPE)
+
+
+class WaveformStore(object):
+    """The waveforms of a model's protocols, in a directory."""
+
+    def __init__(self, path, delta=True, level=1):
+        self.path = path
+        self.delta = delta
+        self.level = level
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_data_path(self, protocol):
+        return os.path.join(self.path, protocol + '.waveforms')
+
+    def get_index_path(self, protocol):
+        return os.path.join(self.path, protocol + '.index.jsonl')
+
+    def get_protocols(self):
+        """The protocols with saved waveforms."""
+        suffix = '.index.jsonl'
+        return sorted(name[:-len(suffix)] for name in os.listdir(self.path)
+                      if name.endswith(suffix))
+
+    def save(self, protocol, tvi_dict, **metadata):
+        """Append a sweep: the t, v and i arrays of tvi_dict, and its other
+        values (e.g. run_time, steps, cvode_active) and metadata (e.g.
+        label, meta_protocol, amplitude) to the index."""
+        record = {'protocol': protocol, 'arrays': {}}
+        record.update((key, value) for key, value in tvi_dict.items()
+                      if key not in ARRAYS and np.ndim(value) == 0)
+        record.update(metadata)
+        with open(self.get_data_path(protocol), 'ab') as f:
+            offset = f.tell()
+            for name in ARRAYS:
+                if tvi_dict.get(name) is None:
+                    continue
+                data, encoding = encode(tvi_dict[name], self.delta,
+                                        self.level)
+                f.write(data)
+                encoding.update(offset=offset, nbytes=len(data))
+                record['arrays'][name] = encoding
+                offset += len(data)
+        # The index is written last, so it only lists complete sweeps
+        with open(self.get_index_path(protocol), 'a') as f:
+            f.write(json.dumps(record, default=to_json) + '\n')
+        return record
+
+    def remove(self, protocol):
+        """Remove the waveforms of a protocol."""
+        for path in [self.get_index_path(protocol),
+                     self.get_data_path(protocol)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def iter_index(self, protocol=None, **match):
+        """Stream the index records of the sweeps of a protocol (default:
+        all protocols) whose metadata has the values in match."""
+        protocols = self.get_protocols() if protocol is None else [protocol]
+        for protocol in protocols:
+            path = self.get_index_path(protocol)
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if all(record.get(key) == value
+                           for key, value in match.items()):
+                        yield record
+
+    def iter_waveforms(self, protocol=None, arrays=ARRAYS, **match):
+        """Stream the sweeps matching as iter_index, one at a time: dicts of
+        their metadata and float32 arrays (those in arrays)."""
+        data_file = None
+        try:
+            for record in self.iter_index(protocol, **match):
+                if data_file is None or \
+                   data_file.name != self.get_data_path(record['protocol']):
+                    if data_file is not None:
+                        data_file.close()
+                    data_file = open(self.get_data_path(record['protocol']),
+                                     'rb')
+                sweep = dict(record)
+                encodings = sweep.pop('arrays')
+                for name in arrays:
+                    if name in encodings:
+                        encoding = encodings[name]
+                        data_file.seek(encoding['offset'])
+                        sweep[name] = decode(data_file.read(encoding['nbytes']),
+                                             encoding)
+                yield sweep
+        finally:
+            if data_file is not None:
+                data_file.close()
+
+
+def to_json(value):
+    # numpy scalars in the metadata
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("%r is not JSON serializable" % value)
@@ -15,7 +15,7 @@ setup(
     version='0.19',
     author='Rick Gerkin',
     author_email='rgerkin@asu.edu',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     url='http://github.com/scidash/neuronunit',
     license='MIT',
     description=("A SciUnit library for data-driven testing of "